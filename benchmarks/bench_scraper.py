@@ -0,0 +1,172 @@
+import argparse
+import json
+import os
+import re
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_doj import BASE_PATH, FakeDojSite, serve
+
+SCRAPER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scraper")
+BENCH_BUCKET = "gestalt-bench-staging"
+LATENCY_LINE = re.compile(r"Listing page \d+ ready in ([\d.]+)s")
+
+parser = argparse.ArgumentParser(description="Run scraper.py end to end against a local fake DOJ site.")
+parser.add_argument('--datasets', type=int, default=2)
+parser.add_argument('--pages', type=int, default=5, help="Listing pages per dataset")
+parser.add_argument('--docs-per-page', type=int, default=10)
+parser.add_argument('--pdf-pages', type=int, default=2)
+parser.add_argument('--pdf-kb', type=int, default=512, help="Approximate size of every PDF")
+parser.add_argument('--listing-delay-ms', type=int, default=100, help="Server latency per listing page")
+parser.add_argument('--pdf-delay-ms', type=int, default=50, help="Server latency per PDF (time to first byte)")
+parser.add_argument('--asset-delay-ms', type=int, default=200, help="Server latency per image/stylesheet")
+parser.add_argument('--storage', choices=['local', 's3'], default='local',
+                    help="local: write to a temp dir. s3: upload to a moto S3 server (needs moto[server]).")
+parser.add_argument('--scraper-env', action='append', default=[], metavar='NAME=VALUE',
+                    help="Extra environment for the scraper, e.g. FAST_NAVIGATION=1 or DOWNLOAD_CONCURRENCY=8")
+parser.add_argument('--json', metavar='PATH', help="Also write the report to this file")
+parser.add_argument('--verbose', action='store_true', help="Echo the scraper's log")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_s3():
+    """Starts an in-process moto S3 server and returns (server, endpoint_url)."""
+    import boto3
+    from moto.server import ThreadedMotoServer
+
+    port = free_port()
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    endpoint = f"http://127.0.0.1:{port}"
+    boto3.client('s3', endpoint_url=endpoint, region_name='us-east-1',
+                 aws_access_key_id='bench', aws_secret_access_key='bench').create_bucket(Bucket=BENCH_BUCKET)
+    return server, endpoint
+
+
+def count_stored(download_dir, endpoint):
+    if endpoint:
+        import boto3
+        s3 = boto3.client('s3', endpoint_url=endpoint, region_name='us-east-1',
+                          aws_access_key_id='bench', aws_secret_access_key='bench')
+        count = 0
+        for listing in s3.get_paginator('list_objects_v2').paginate(Bucket=BENCH_BUCKET):
+            count += sum(1 for obj in listing.get('Contents', []) if obj['Key'].endswith('.pdf'))
+        return count
+    return sum(1 for name in os.listdir(download_dir) if name.endswith('.pdf'))
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else None
+
+
+def main():
+    args = parser.parse_args()
+
+    site = FakeDojSite(
+        datasets=args.datasets,
+        pages_per_dataset=args.pages,
+        docs_per_page=args.docs_per_page,
+        pdf_pages=args.pdf_pages,
+        pdf_bytes=args.pdf_kb * 1024,
+        listing_delay=args.listing_delay_ms / 1000,
+        pdf_delay=args.pdf_delay_ms / 1000,
+        asset_delay=args.asset_delay_ms / 1000
+    )
+    web = serve(site)
+    download_dir = tempfile.mkdtemp(prefix="gestalt-bench-")
+
+    env = dict(os.environ)
+    env.update({
+        "SCRAPER_BASE_URL": f"http://127.0.0.1:{web.server_port}{BASE_PATH}",
+        "DOWNLOAD_DIR": download_dir,
+        "REUSE_SESSION": "0",
+        "HOST_RATE_LIMIT": "0",  # Measure the scraper, not our politeness toward the real site
+        "PYTHONUNBUFFERED": "1"
+    })
+    env.pop("STAGING_BUCKET", None)
+
+    s3_server, endpoint = None, None
+    if args.storage == 's3':
+        s3_server, endpoint = start_s3()
+        env.update({
+            "STAGING_BUCKET": BENCH_BUCKET,
+            "AWS_ENDPOINT_URL": endpoint,
+            "AWS_ACCESS_KEY_ID": "bench",
+            "AWS_SECRET_ACCESS_KEY": "bench",
+            "AWS_DEFAULT_REGION": "us-east-1"
+        })
+    for setting in args.scraper_env:
+        name, _, value = setting.partition('=')
+        env[name] = value
+
+    print(f"Crawling {site.total_documents} synthetic documents "
+          f"({args.datasets} datasets x {args.pages} pages x {args.docs_per_page} PDFs of ~{args.pdf_kb}KB), storage={args.storage}")
+
+    latencies = []
+    started = time.monotonic()
+    process = subprocess.Popen(
+        [sys.executable, "scraper.py"], cwd=SCRAPER_DIR, env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+    )
+    for line in process.stdout:
+        match = LATENCY_LINE.search(line)
+        if match:
+            latencies.append(float(match.group(1)))
+        if args.verbose:
+            print(f"  | {line}", end="")
+    process.wait()
+    elapsed = time.monotonic() - started
+
+    # ru_maxrss of waited-for descendants: the largest single process (scraper or a Chromium
+    # process), in KB on Linux
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    stored = count_stored(download_dir, endpoint)
+    stats = site.stats
+    download_window = (stats["last_pdf_at"] - stats["first_pdf_at"]) if stats["first_pdf_at"] else None
+
+    report = {
+        "config": vars(args),
+        "exit_code": process.returncode,
+        "documents_expected": site.total_documents,
+        "documents_stored": stored,
+        "elapsed_seconds": round(elapsed, 2),
+        "time_to_first_pdf_seconds": round(stats["first_pdf_at"] - started, 2) if stats["first_pdf_at"] else None,
+        "docs_per_second": round(stored / elapsed, 2),
+        "mb_per_second": round(stats["pdf_bytes"] / 1024 ** 2 / elapsed, 2),
+        "download_window_seconds": round(download_window, 2) if download_window else None,
+        "listing_latency_seconds": {
+            "pages": len(latencies),
+            "mean": round(sum(latencies) / len(latencies), 3) if latencies else None,
+            "p50": percentile(latencies, 0.5),
+            "p95": percentile(latencies, 0.95),
+            "max": max(latencies) if latencies else None
+        },
+        "peak_rss_mb": round(peak_rss_kb / 1024, 1),
+        "server": {name: value for name, value in stats.items() if not name.endswith("_at")}
+    }
+
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    web.shutdown()
+    if s3_server:
+        s3_server.stop()
+    if process.returncode != 0 or stored < site.total_documents:
+        print(f"WARNING: scraper exited with {process.returncode} and stored {stored}/{site.total_documents} documents.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
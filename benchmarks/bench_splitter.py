@@ -0,0 +1,283 @@
+import argparse
+import contextlib
+import functools
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from splitter_corpus import CORPORA, build_corpus
+
+WORKER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "worker")
+BENCH_BUCKET = "gestalt-bench-source"
+
+parser = argparse.ArgumentParser(description="Benchmark worker/splitter.py on synthetic PDF corpora.")
+parser.add_argument('--scale', type=float, default=1.0, help="Multiplies every corpus' page count")
+parser.add_argument('--corpus', action='append', choices=list(CORPORA), help="Only these corpora (repeatable)")
+parser.add_argument('--corpus-dir', default=os.path.join(os.environ.get('TMPDIR', '/tmp'), "gestalt-splitter-corpus"))
+parser.add_argument('--scenario', choices=['process', 'pipeline', 'both'], default='both',
+                    help="process: process_pdf() on a local file. pipeline: S3 upload + SQS message through "
+                         "the batch consumer and its worker processes, against a moto server.")
+parser.add_argument('--splitter-env', action='append', default=[], metavar='NAME=VALUE',
+                    help="Extra splitter settings, e.g. SPLITTER_IO_MODE=stream or SPLITTER_CLASSIFY_PAGES=0")
+parser.add_argument('--timeout', type=int, default=900, help="Seconds to wait for the pipeline scenario to drain")
+parser.add_argument('--json', metavar='PATH', help="Write the results here, to compare against later runs")
+
+
+class StageProfiler:
+    """Accumulates wall time and call counts per pipeline stage by wrapping the functions
+    that implement each one. Times are summed across threads, so with several consumer
+    threads a stage can add up to more than the elapsed time."""
+
+    def __init__(self):
+        self.seconds = {}
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, owner, name, stage):
+        original = getattr(owner, name)
+
+        @functools.wraps(original)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - started)
+
+        setattr(owner, name, timed)
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+            self.calls[stage] = self.calls.get(stage, 0) + 1
+
+    def report(self, elapsed):
+        return {
+            stage: {
+                "seconds": round(seconds, 4),
+                "calls": self.calls[stage],
+                "share": round(seconds / elapsed, 4) if elapsed else None
+            }
+            for stage, seconds in sorted(self.seconds.items(), key=lambda item: -item[1])
+        }
+
+
+def instrument(splitter):
+    import fitz
+    import image_pipeline
+    from artifact import ArtifactWriter
+
+    profiler = StageProfiler()
+    profiler.wrap(splitter, "fetch_pdf", "download")
+    profiler.wrap(splitter, "open_pdf", "open")
+    profiler.wrap(splitter, "find_near_duplicate", "near_dup_check")
+    profiler.wrap(fitz.Page, "get_text", "get_text")
+    profiler.wrap(fitz.Document, "extract_image", "extract_image")
+    profiler.wrap(image_pipeline, "normalize_image", "normalize_image")
+    profiler.wrap(ArtifactWriter, "upload", "artifact_upload")
+    return profiler
+
+
+def configure_environment(overrides):
+    os.environ.update({
+        "AWS_ACCESS_KEY_ID": "bench",
+        "AWS_SECRET_ACCESS_KEY": "bench",
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "SPLITTER_CONSUMER_MODE": "batch",
+        "SPLITTER_HEARTBEAT_SECONDS": "60"
+    })
+    os.environ.pop("AWS_ENDPOINT_URL", None)
+    for setting in overrides:
+        name, _, value = setting.partition('=')
+        os.environ[name] = value
+    sys.path.insert(0, WORKER_DIR)
+
+
+def run_process(entry, overrides):
+    """Runs in a fresh process so peak RSS belongs to this corpus alone."""
+    configure_environment(overrides)
+    import splitter
+
+    profiler = instrument(splitter)
+    stats = {}
+    started = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        splitter.process_pdf(entry["path"], stats=stats)
+    elapsed = time.perf_counter() - started
+    return summarize(entry, elapsed, profiler, stats)
+
+
+# The pipeline's documents run in the consumer's worker processes, out of reach of the
+# profiler's wrappers, so its stages come from the timing metrics they log instead
+METRIC_STAGES = {
+    "DownloadTime": "download",
+    "NearDupCheckTime": "near_dup_check",
+    "ExtractionTime": "extraction",
+    "ImageNormalizeWaitTime": "image_wait",
+    "ArtifactUploadTime": "artifact_upload"
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def read_metrics(path):
+    """Parses the EMF lines out of a captured log: [(name, value)]."""
+    found = []
+    with open(path, errors='replace') as f:
+        for line in f:
+            if not line.startswith('{"_aws"'):
+                continue
+            record = json.loads(line)
+            for metric in record["_aws"]["CloudWatchMetrics"][0]["Metrics"]:
+                found.append((metric["Name"], record[metric["Name"]]))
+    return found
+
+
+def run_pipeline(entry, overrides, timeout):
+    configure_environment(overrides)
+    from moto.server import ThreadedMotoServer
+
+    # A server rather than mock_aws(): the worker processes need to reach it too
+    port = free_port()
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    os.environ["AWS_ENDPOINT_URL"] = f"http://127.0.0.1:{port}"
+
+    import boto3
+    import consumer
+    sqs = consumer.sqs = boto3.client('sqs')
+    queue_url = consumer.QUEUE_URL = sqs.create_queue(QueueName="gestalt-bench-splitter")['QueueUrl']
+    os.environ["SPLITTER_QUEUE_URL"] = queue_url
+
+    s3 = boto3.client('s3')
+    s3.create_bucket(Bucket=BENCH_BUCKET)
+    key = os.path.basename(entry["path"])
+    s3.upload_file(entry["path"], BENCH_BUCKET, key)
+
+    # Workers inherit stdout, so capture it at the file descriptor level
+    log = tempfile.NamedTemporaryFile(prefix="bench-splitter-", suffix=".log", delete=False)
+    sys.stdout.flush()
+    saved_stdout = os.dup(1)
+    os.dup2(log.fileno(), 1)
+    stop = threading.Event()
+    try:
+        consumer_thread = threading.Thread(target=consumer.poll_queue_batched, args=(stop,), daemon=True)
+        started = time.perf_counter()
+        sqs.send_message(QueueUrl=queue_url, MessageBody=json.dumps(
+            {"bucket": BENCH_BUCKET, "key": key, "size": entry["bytes"]}
+        ))
+        consumer_thread.start()
+
+        # Done once every message (including fan-out shards) has been processed and deleted
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            attributes = sqs.get_queue_attributes(
+                QueueUrl=queue_url,
+                AttributeNames=['ApproximateNumberOfMessages', 'ApproximateNumberOfMessagesNotVisible']
+            )['Attributes']
+            if not any(int(value) for value in attributes.values()) and \
+                    any(name == "DownloadTime" for name, _ in read_metrics(log.name)):
+                break
+            time.sleep(0.05)
+        else:
+            raise TimeoutError(f"Queue didn't drain within {timeout}s")
+        elapsed = time.perf_counter() - started
+
+        # Joining the workers makes their peak RSS visible through RUSAGE_CHILDREN
+        stop.set()
+        consumer_thread.join()
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved_stdout, 1)
+        os.close(saved_stdout)
+        server.stop()
+
+    profiler = StageProfiler()
+    images = 0
+    for name, value in read_metrics(log.name):
+        if name in METRIC_STAGES:
+            profiler.record(METRIC_STAGES[name], value / 1000)
+        elif name == "ImagesExtracted":
+            images += value
+    os.remove(log.name)
+    return summarize(entry, elapsed, profiler, images=images)
+
+
+def summarize(entry, elapsed, profiler, stats=None, images=None):
+    if images is None:
+        images = profiler.calls.get("extract_image", 0)
+    result = {
+        "corpus": entry["name"],
+        "pages": entry["pages"],
+        "bytes": entry["bytes"],
+        "elapsed_seconds": round(elapsed, 4),
+        "pages_per_second": round(entry["pages"] / elapsed, 2),
+        "images_decoded": images,
+        "images_per_second": round(images / elapsed, 2),
+        "stages": profiler.report(elapsed),
+        # KB on Linux; the largest process, including MuPDF's native allocations
+        "peak_rss_mb": round(max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                                 resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024, 1)
+    }
+    if stats:
+        result["page_classes"] = stats.get("page_classes")
+        result["images_repeated"] = stats.get("images_repeated")
+        result["images_skipped"] = stats.get("images_skipped")
+    return result
+
+
+def main():
+    args = parser.parse_args()
+    corpus = build_corpus(args.corpus_dir, args.scale, args.corpus)
+    scenarios = ['process', 'pipeline'] if args.scenario == 'both' else [args.scenario]
+
+    # "spawn" so every run starts from a clean interpreter with its own RSS high-water mark
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for scenario in scenarios:
+        for entry in corpus:
+            # An executor rather than a Pool: its worker isn't a daemon, so it can start the
+            # consumer's and the splitter's own worker processes
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                if scenario == 'process':
+                    result = pool.submit(run_process, entry, args.splitter_env).result()
+                else:
+                    result = pool.submit(run_pipeline, entry, args.splitter_env, args.timeout).result()
+            result["scenario"] = scenario
+            results.append(result)
+
+            stages = ", ".join(f"{stage} {info['seconds']:.2f}s" for stage, info in result["stages"].items())
+            print(f"{scenario:>8} {entry['name']:<12} {result['pages_per_second']:>9.1f} pages/s "
+                  f"{result['images_per_second']:>8.1f} images/s  peak {result['peak_rss_mb']:>7.1f}MB  [{stages}]")
+
+    report = {
+        "created": time.time(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "scale": args.scale,
+        "splitter_env": args.splitter_env,
+        "results": results
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
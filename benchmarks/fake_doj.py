@@ -0,0 +1,229 @@
+import argparse
+import functools
+import hashlib
+import json
+import re
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from synthetic_pdf import make_pdf
+
+BASE_PATH = "/epstein/doj-disclosures"
+DROPDOWN_TEXT = "Epstein Files Transparency Act (H.R.4405)"
+
+LANDING_PAGE = """<!DOCTYPE html>
+<html><head><title>DOJ Disclosures</title>
+<link rel="stylesheet" href="/static/site.css"></head>
+<body>
+<img src="/static/banner.png" alt="">
+<div id="age-verify-block" style="%(age_gate_style)s">
+  <p>Are you 18 or older?</p>
+  <button onclick="document.getElementById('age-verify-block').style.display='none'">Yes</button>
+</div>
+<details><summary>%(dropdown)s</summary><ul>%(datasets)s</ul></details>
+</body></html>"""
+
+# Like the real site, "Next" swaps the links in place with a fetch; the URL doesn't change
+LISTING_PAGE = """<!DOCTYPE html>
+<html><head><title>Data Set %(dataset)d</title>
+<link rel="stylesheet" href="/static/site.css"></head>
+<body>
+<img src="/static/banner.png" alt="">
+<ul id="files">%(links)s</ul>
+<button id="next" style="%(next_style)s">Next</button>
+<script>
+let currentPage = %(page)d;
+document.getElementById('next').addEventListener('click', async () => {
+  const response = await fetch(location.pathname + '?partial=1&page=' + (currentPage + 1));
+  const data = await response.json();
+  currentPage += 1;
+  document.getElementById('files').innerHTML =
+    data.links.map(href => '<li><a href="' + href + '">' + href.split('/').pop() + '</a></li>').join('');
+  if (!data.has_next) document.getElementById('next').style.display = 'none';
+});
+</script>
+</body></html>"""
+
+
+class FakeDojSite:
+    """Stand-in for the DOJ disclosures site: a landing page with an age gate and the dataset
+    dropdown, paginated dataset listings with a JavaScript "Next" button, and synthetic PDFs.
+
+    Every listing page has docs_per_page PDFs of pdf_pages pages and roughly pdf_bytes bytes.
+    PDFs carry ETag / Last-Modified and honour conditional and Range requests. The *_delay
+    settings (seconds) add server latency; static assets exist so resource blocking has
+    something to block. Served traffic is counted in self.stats.
+    """
+
+    def __init__(self, datasets=3, pages_per_dataset=5, docs_per_page=10, pdf_pages=2, pdf_bytes=256 * 1024,
+                 listing_delay=0.0, pdf_delay=0.0, asset_delay=0.0, age_gate=True):
+        self.datasets = datasets
+        self.pages_per_dataset = pages_per_dataset
+        self.docs_per_page = docs_per_page
+        self.pdf_pages = pdf_pages
+        self.pdf_bytes = pdf_bytes
+        self.listing_delay = listing_delay
+        self.pdf_delay = pdf_delay
+        self.asset_delay = asset_delay
+        self.age_gate = age_gate
+        self.last_modified = formatdate(time.time(), usegmt=True)
+
+        self.stats = {
+            "listing_requests": 0,
+            "asset_requests": 0,
+            "pdf_requests": 0,
+            "pdf_not_modified": 0,
+            "pdf_bytes": 0,
+            "first_pdf_at": None,
+            "last_pdf_at": None
+        }
+        self._lock = threading.Lock()
+
+    @property
+    def total_documents(self):
+        return self.datasets * self.pages_per_dataset * self.docs_per_page
+
+    def listing(self, dataset, page):
+        first = ((dataset - 1) * self.pages_per_dataset + page) * self.docs_per_page + 1
+        return [f"/files/data-set-{dataset}/EFTA{number:08d}.pdf" for number in range(first, first + self.docs_per_page)]
+
+    @functools.lru_cache(maxsize=256)
+    def pdf(self, number):
+        return make_pdf(number, pages=self.pdf_pages, size_bytes=self.pdf_bytes)
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+
+    def mark_pdf_served(self, size):
+        now = time.monotonic()
+        with self._lock:
+            self.stats["pdf_bytes"] += size
+            self.stats["first_pdf_at"] = self.stats["first_pdf_at"] or now
+            self.stats["last_pdf_at"] = now
+
+
+class FakeDojHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    site = None  # Set by serve()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+
+        if url.path.rstrip('/') == BASE_PATH:
+            return self.landing()
+
+        match = re.fullmatch(re.escape(BASE_PATH) + r"/data-set-(\d+)-files", url.path)
+        if match and 1 <= int(match.group(1)) <= self.site.datasets:
+            return self.listing(int(match.group(1)), int(query.get('page', ['0'])[0]), 'partial' in query)
+
+        match = re.fullmatch(r"/files/data-set-\d+/EFTA(\d+)\.pdf", url.path)
+        if match and 1 <= int(match.group(1)) <= self.site.total_documents:
+            return self.pdf(int(match.group(1)))
+
+        if url.path.startswith("/static/"):
+            self.site.count("asset_requests")
+            time.sleep(self.site.asset_delay)
+            content_type = "text/css" if url.path.endswith(".css") else "image/png"
+            return self.respond(200, b"/* synthetic */" if content_type == "text/css" else b"\x89PNG\r\n", content_type)
+
+        self.respond(404, b"Not found", "text/plain")
+
+    def landing(self):
+        datasets = "".join(
+            f'<li><a href="{BASE_PATH}/data-set-{n}-files">Data Set {n}</a></li>' for n in range(1, self.site.datasets + 1)
+        )
+        body = LANDING_PAGE % {
+            "age_gate_style": "" if self.site.age_gate else "display:none",
+            "dropdown": DROPDOWN_TEXT,
+            "datasets": datasets
+        }
+        self.respond(200, body.encode('utf-8'), "text/html; charset=utf-8")
+
+    def listing(self, dataset, page, partial):
+        self.site.count("listing_requests")
+        time.sleep(self.site.listing_delay)
+
+        page = max(0, min(page, self.site.pages_per_dataset - 1))
+        hrefs = self.site.listing(dataset, page)
+        has_next = page + 1 < self.site.pages_per_dataset
+
+        if partial:
+            body = json.dumps({"links": hrefs, "has_next": has_next})
+            return self.respond(200, body.encode('utf-8'), "application/json")
+
+        body = LISTING_PAGE % {
+            "dataset": dataset,
+            "page": page,
+            "links": "".join(f'<li><a href="{href}">{href.rsplit("/", 1)[-1]}</a></li>' for href in hrefs),
+            "next_style": "" if has_next else "display:none"
+        }
+        self.respond(200, body.encode('utf-8'), "text/html; charset=utf-8")
+
+    def pdf(self, number):
+        self.site.count("pdf_requests")
+        time.sleep(self.site.pdf_delay)
+
+        data = self.site.pdf(number)
+        etag = '"%s"' % hashlib.md5(data).hexdigest()
+        headers = {"ETag": etag, "Last-Modified": self.site.last_modified, "Accept-Ranges": "bytes"}
+
+        if self.headers.get('If-None-Match') == etag:
+            self.site.count("pdf_not_modified")
+            return self.respond(304, b"", None, headers)
+
+        start = 0
+        range_header = self.headers.get('Range')
+        if range_header and self.headers.get('If-Range', etag) == etag:
+            start = int(re.match(r"bytes=(\d+)-", range_header).group(1))
+            headers["Content-Range"] = f"bytes {start}-{len(data) - 1}/{len(data)}"
+
+        self.respond(206 if start else 200, data[start:], "application/pdf", headers)
+        self.site.mark_pdf_served(len(data) - start)
+
+    def respond(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        if content_type:
+            self.send_header("Content-Type", content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Thousands of requests per run; the stats are what matter
+
+
+def serve(site, host="127.0.0.1", port=0):
+    """Starts the fake site on a background thread and returns the server (see server.server_port)."""
+    handler = type("BoundFakeDojHandler", (FakeDojHandler,), {"site": site})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a fake DOJ disclosures site for local scraper runs.")
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--datasets', type=int, default=3)
+    parser.add_argument('--pages', type=int, default=5, help="Listing pages per dataset")
+    parser.add_argument('--docs-per-page', type=int, default=10)
+    parser.add_argument('--pdf-pages', type=int, default=2)
+    parser.add_argument('--pdf-kb', type=int, default=256)
+    args = parser.parse_args()
+
+    site = FakeDojSite(args.datasets, args.pages, args.docs_per_page, args.pdf_pages, args.pdf_kb * 1024)
+    server = serve(site, port=args.port)
+    print(f"Fake DOJ site on http://127.0.0.1:{server.server_port}{BASE_PATH} "
+          f"({site.total_documents} documents). Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,98 @@
+import os
+import random
+
+import fitz  # PyMuPDF
+
+LOREM = (
+    "The witness stated that the documents were delivered to the office on the morning of the hearing. "
+    "Counsel for the respondent objected to the admission of the exhibit and the objection was noted. "
+)
+
+
+def noise_image(width, height, seed, gray=True):
+    """An incompressible PNG, so decode and hashing costs look like a real scan's."""
+    rng = random.Random(seed)
+    colorspace = fitz.csGRAY if gray else fitz.csRGB
+    samples = rng.randbytes(width * height * colorspace.n)
+    return fitz.Pixmap(colorspace, width, height, samples, False).tobytes("png")
+
+
+def add_text(page, page_num, paragraphs=6):
+    text = f"Page {page_num + 1}\n\n" + "\n".join(LOREM for _ in range(paragraphs))
+    page.insert_textbox(fitz.Rect(54, 54, 558, 738), text, fontsize=10)
+
+
+def text_only(path, pages):
+    """Born-digital pages: lots of native text, no images."""
+    doc = fitz.open()
+    for page_num in range(pages):
+        add_text(doc.new_page(), page_num)
+    doc.save(path)
+
+
+def scan_only(path, pages, width=850, height=1100):
+    """One full-page unique image per page and no text layer, like a scanned release."""
+    doc = fitz.open()
+    for page_num in range(pages):
+        page = doc.new_page()
+        page.insert_image(page.rect, stream=noise_image(width, height, seed=page_num))
+    doc.save(path)
+
+
+def image_heavy(path, pages, images_per_page=6):
+    """Text pages with a letterhead repeated on every page (one shared xref) plus several
+    unique photos each, so both the xref memo and the image dedup have work to do."""
+    doc = fitz.open()
+    letterhead = noise_image(600, 80, seed="letterhead", gray=False)
+    letterhead_xref = 0
+    for page_num in range(pages):
+        page = doc.new_page()
+        header = fitz.Rect(54, 18, 558, 50)
+        if letterhead_xref:
+            page.insert_image(header, xref=letterhead_xref)
+        else:
+            letterhead_xref = page.insert_image(header, stream=letterhead)
+        add_text(page, page_num, paragraphs=1)
+
+        for i in range(images_per_page):
+            column, row = i % 2, i // 2
+            rect = fitz.Rect(54 + column * 260, 300 + row * 150, 294 + column * 260, 440 + row * 150)
+            page.insert_image(rect, stream=noise_image(320, 200, seed=f"{page_num}-{i}", gray=False))
+    doc.save(path)
+
+
+def large(path, pages):
+    """A very long, mostly text document with an occasional scanned exhibit page."""
+    doc = fitz.open()
+    for page_num in range(pages):
+        page = doc.new_page()
+        if page_num % 50 == 49:
+            page.insert_image(page.rect, stream=noise_image(425, 550, seed=page_num))
+        else:
+            add_text(page, page_num, paragraphs=3)
+    doc.save(path, garbage=0, deflate=True)
+
+
+# name -> (builder, pages at scale 1)
+CORPORA = {
+    "text_only": (text_only, 200),
+    "scan_only": (scan_only, 40),
+    "image_heavy": (image_heavy, 60),
+    "large": (large, 2000),
+}
+
+
+def build_corpus(directory, scale=1.0, names=None):
+    """Writes one PDF per corpus into directory (reusing existing ones) and returns
+    [{"name", "path", "pages", "bytes"}]."""
+    os.makedirs(directory, exist_ok=True)
+    corpus = []
+    for name in names or CORPORA:
+        builder, base_pages = CORPORA[name]
+        pages = max(1, int(base_pages * scale))
+        path = os.path.join(directory, f"{name}_{pages}p.pdf")
+        if not os.path.exists(path):
+            print(f"Generating {path}...")
+            builder(path, pages)
+        corpus.append({"name": name, "path": path, "pages": pages, "bytes": os.path.getsize(path)})
+    return corpus
@@ -0,0 +1,69 @@
+import hashlib
+
+
+def make_pdf(doc_id, pages=2, size_bytes=None):
+    """Builds a small but valid PDF with one line of text per page.
+
+    If size_bytes is given, the file is padded up to roughly that size with an extra stream
+    object (deterministic for a given doc_id), so transfer benchmarks can use realistic
+    document sizes without depending on PyMuPDF.
+    """
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(None)  # Filled in once the page tree exists
+    page_tree = add(None)
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    page_refs = []
+    for page_num in range(pages):
+        text = f"BT /F1 12 Tf 72 720 Td (Synthetic document {doc_id}, page {page_num + 1}) Tj ET".encode('latin-1')
+        content = add(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(text), text))
+        page_refs.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 %d 0 R >> >> "
+            b"/Contents %d 0 R >>" % (page_tree, font, content)
+        ))
+
+    objects[page_tree - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % ref for ref in page_refs), len(page_refs)
+    )
+
+    catalog_body = b"<< /Type /Catalog /Pages %d 0 R" % page_tree
+    if size_bytes:
+        catalog_body += b" /GestaltPadding %d 0 R" % (len(objects) + 1)
+    objects[catalog - 1] = catalog_body + b" >>"
+
+    if size_bytes:
+        overhead = len(_serialize(objects + [b"<< /Length 0 >>\nstream\n\nendstream"]))
+        padding = _filler(str(doc_id), max(0, size_bytes - overhead - 8))
+        add(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(padding), padding))
+
+    return _serialize(objects)
+
+
+def _filler(seed, length):
+    # Chained SHA-256 blocks: incompressible, reproducible, and cheap enough for a few MB
+    blocks = []
+    block = hashlib.sha256(seed.encode('utf-8')).digest()
+    for _ in range(0, length, 32):
+        block = hashlib.sha256(block).digest()
+        blocks.append(block)
+    return b"".join(blocks)[:length]
+
+
+def _serialize(objects):
+    out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+
+    xref_offset = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    return bytes(out)
@@ -0,0 +1,122 @@
+"""Structured metrics and tracing shared by the scraper, the router Lambda and the splitter.
+
+Every metric is written to stdout as one CloudWatch Embedded Metric Format (EMF) JSON line,
+so it is both a CloudWatch metric and a searchable log record. Lines can carry a correlation
+ID: the scraper creates one per document and it travels in the object's S3 metadata and in
+the SQS message body, so one document's path (found, stored, routed, queued, extracted) can
+be put back together with a Logs Insights query on correlation_id.
+
+Set GESTALT_METRICS=0 to turn everything into a no-op.
+"""
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+ENABLED = os.environ.get('GESTALT_METRICS', '1') == '1'
+NAMESPACE = os.environ.get('GESTALT_METRICS_NAMESPACE', 'Gestalt')
+
+# S3 user-metadata keys (sent as x-amz-meta-*) that carry the trace between stages
+CORRELATION_ID_KEY = 'correlation-id'
+DISCOVERED_AT_KEY = 'discovered-at'
+
+_service = os.environ.get('GESTALT_SERVICE', 'gestalt')
+_write_lock = threading.Lock()
+
+
+def configure(service):
+    """Names the component every metric is reported under (the "Service" dimension)."""
+    global _service
+    _service = service
+
+
+def new_correlation_id():
+    return uuid.uuid4().hex
+
+
+def trace_metadata(correlation_id, discovered_at):
+    """S3 metadata that hands a document's trace to the next stage."""
+    return {CORRELATION_ID_KEY: correlation_id, DISCOVERED_AT_KEY: f"{discovered_at:.3f}"}
+
+
+def trace_from_metadata(metadata):
+    """Reads the trace back out of S3 metadata; both values are None for untraced objects."""
+    discovered_at = metadata.get(DISCOVERED_AT_KEY)
+    return {
+        "correlation_id": metadata.get(CORRELATION_ID_KEY),
+        "discovered_at": float(discovered_at) if discovered_at else None
+    }
+
+
+def put_metric(name, value, unit="Count", correlation_id=None, **properties):
+    """Emits one metric as an EMF line. Extra keyword arguments become searchable properties."""
+    if not ENABLED:
+        return
+
+    record = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": NAMESPACE,
+                "Dimensions": [["Service"]],
+                "Metrics": [{"Name": name, "Unit": unit}]
+            }]
+        },
+        "Service": _service,
+        name: value
+    }
+    if correlation_id:
+        record["correlation_id"] = correlation_id
+    record.update(properties)
+
+    line = json.dumps(record, default=str) + "\n"
+    with _write_lock:
+        sys.stdout.write(line)
+        sys.stdout.flush()
+
+
+def put_latency(name, since_epoch, correlation_id=None, **properties):
+    """Emits the milliseconds since an epoch timestamp, e.g. how long a message sat in the queue."""
+    if ENABLED and since_epoch:
+        put_metric(name, round((time.time() - since_epoch) * 1000, 1), "Milliseconds", correlation_id, **properties)
+
+
+class _Timer:
+    __slots__ = ("name", "correlation_id", "properties", "started")
+
+    def __init__(self, name, correlation_id, properties):
+        self.name = name
+        self.correlation_id = correlation_id
+        self.properties = properties
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed_ms = round((time.perf_counter() - self.started) * 1000, 1)
+        put_metric(self.name, elapsed_ms, "Milliseconds", self.correlation_id,
+                   outcome="error" if exc_type else "ok", **self.properties)
+        return False
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_TIMER = _NoopTimer()
+
+
+def timer(name, correlation_id=None, **properties):
+    """Context manager that emits the wall time of its block in milliseconds."""
+    if not ENABLED:
+        return _NOOP_TIMER
+    return _Timer(name, correlation_id, properties)
@@ -2,12 +2,16 @@ from aws_cdk import (
     Stack,
     Duration,
     RemovalPolicy,
+    Size,
     aws_s3 as s3,
     aws_lambda as _lambda,
     aws_s3_notifications as s3_notify,
     aws_sqs as sqs, 
     aws_ec2 as ec2,  # Added for VPC Network
     aws_ecs as ecs,  # Added for Fargate Container
+    aws_cloudwatch as cloudwatch,
+    aws_applicationautoscaling as appscaling,
+    aws_lambda_event_sources as lambda_events,
 )
 from constructs import Construct
 
@@ -24,34 +28,78 @@ class GestaltStack(Stack):
         )
 
         # 2. Define the Splitter Queue
+        # A message that keeps failing (a PDF that crashes MuPDF every time) is parked in a
+        # dead-letter queue after this many receives instead of being retried forever
+        max_receive_count = int(self.node.try_get_context("maxReceiveCount") or 5)
+        splitter_dlq = sqs.Queue(
+            self, "GestaltSplitterDeadLetterQueue",
+            retention_period=Duration.days(14)
+        )
+
         # We increase the visibility timeout because downloading and 
         # splitting a 4GB PDF will take longer than the default 30 seconds.
         splitter_queue = sqs.Queue(
             self, "GestaltSplitterQueue",
-            visibility_timeout=Duration.minutes(15) 
+            visibility_timeout=Duration.minutes(15),
+            dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=max_receive_count, queue=splitter_dlq)
+        )
+
+        # Small PDFs skip the Fargate queue and go to the splitter Lambda (Phase 4)
+        fast_path_max_bytes = int(self.node.try_get_context("fastPathMaxBytes") or 25 * 1024 ** 2)
+        fast_dlq = sqs.Queue(
+            self, "GestaltFastSplitterDeadLetterQueue",
+            retention_period=Duration.days(14)
+        )
+        fast_queue = sqs.Queue(
+            self, "GestaltFastSplitterQueue",
+            # At least 6x the splitter Lambda's timeout, as Lambda recommends for SQS sources
+            visibility_timeout=Duration.minutes(30),
+            dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=max_receive_count, queue=fast_dlq)
         )
 
+        # Where the splitter keeps its artifacts, indexes and shard records in the raw data
+        # bucket; the router skips everything under it
+        state_prefix = self.node.try_get_context("statePrefix") or "_gestalt/"
+
         # 3. Define the Gestalt Lambda Router
+        # Shared code (metrics and tracing) ships as a layer; Lambda puts common/python on sys.path
+        common_layer = _lambda.LayerVersion(
+            self, "GestaltCommonLayer",
+            code=_lambda.Code.from_asset("common"),
+            compatible_runtimes=[_lambda.Runtime.PYTHON_3_11]
+        )
+
         ingestion_router = _lambda.Function(
             self, "GestaltIngestionRouter",
             runtime=_lambda.Runtime.PYTHON_3_11,
             handler="ingestion_router.handler", 
             code=_lambda.Code.from_asset("src"), 
+            layers=[common_layer],
             environment={
                 "BUCKET_NAME": raw_data_bucket.bucket_name,
-                "SPLITTER_QUEUE_URL": splitter_queue.queue_url
+                "SPLITTER_QUEUE_URL": splitter_queue.queue_url,
+                "FAST_QUEUE_URL": fast_queue.queue_url,
+                "ROUTER_FAST_PATH_MAX_BYTES": str(fast_path_max_bytes),
+                "SPLITTER_STATE_PREFIX": state_prefix,
+                # The scraper's correlation ID is in the object metadata; one HEAD per routed PDF
+                "ROUTER_READ_TRACE": "1"
             }
         )
 
         # 4. Grant Permissions
         raw_data_bucket.grant_read(ingestion_router)
         splitter_queue.grant_send_messages(ingestion_router)
+        fast_queue.grant_send_messages(ingestion_router)
 
         # 5. Wire the Trigger
-        raw_data_bucket.add_event_notification(
-            s3.EventType.OBJECT_CREATED,
-            s3_notify.LambdaDestination(ingestion_router)
-        )
+        # Only PDFs, so the splitter's own writes into this bucket (artifacts, page images,
+        # indexes) don't invoke the router at all. S3 suffix filters are case-sensitive.
+        for suffix in (".pdf", ".PDF"):
+            raw_data_bucket.add_event_notification(
+                s3.EventType.OBJECT_CREATED,
+                s3_notify.LambdaDestination(ingestion_router),
+                s3.NotificationKeyFilter(suffix=suffix)
+            )
 
         # ==========================================
         # PHASE 2: THE SCRAPER INFRASTRUCTURE (New)
@@ -93,13 +141,149 @@ class GestaltStack(Stack):
         staging_bucket.grant_read_write(scraper_task.task_role)
 
         # 5. The Container Definition
-        # This tells CDK to look in your "scraper" folder, build the Dockerfile it finds there,
-        # automatically push it to AWS ECR, and wire it to this Fargate task.
+        # This tells CDK to build scraper/Dockerfile, automatically push it to AWS ECR,
+        # and wire it to this Fargate task. The build context is the repo root so the image
+        # can include common/; the root .dockerignore keeps everything else out.
         scraper_task.add_container(
             "ScraperContainer",
-            image=ecs.ContainerImage.from_asset("scraper"),
+            image=ecs.ContainerImage.from_asset(".", file="scraper/Dockerfile"),
             logging=ecs.LogDrivers.aws_logs(stream_prefix="GestaltScraper"),
             environment={
                 "STAGING_BUCKET": staging_bucket.bucket_name
             }
-        )
\ No newline at end of file
+        )
+
+        # ==========================================
+        # PHASE 3: THE SPLITTER SERVICE
+        # ==========================================
+
+        # 1. The Splitter Task Definition
+        # Size it per environment: cdk deploy -c splitterCpu=4096 -c splitterMemoryMiB=8192
+        splitter_cpu = int(self.node.try_get_context("splitterCpu") or 2048)
+        splitter_memory = int(self.node.try_get_context("splitterMemoryMiB") or 4096)
+        splitter_max_tasks = int(self.node.try_get_context("splitterMaxTasks") or 10)
+
+        splitter_task = ecs.FargateTaskDefinition(
+            self, "GestaltSplitterTask",
+            cpu=splitter_cpu,
+            memory_limit_mib=splitter_memory,
+        )
+
+        # Reads the PDFs, writes artifacts and state under the state prefix in the same bucket,
+        # and re-enqueues page-range shards of very large documents
+        raw_data_bucket.grant_read_write(splitter_task.task_role)
+        splitter_queue.grant_consume_messages(splitter_task.task_role)
+        splitter_queue.grant_send_messages(splitter_task.task_role)
+
+        splitter_task.add_container(
+            "SplitterContainer",
+            image=ecs.ContainerImage.from_asset(".", file="worker/Dockerfile"),
+            logging=ecs.LogDrivers.aws_logs(stream_prefix="GestaltSplitter"),
+            environment={
+                "SPLITTER_QUEUE_URL": splitter_queue.queue_url,
+                "SPLITTER_CONSUMER_MODE": "batch",
+                "SPLITTER_STATE_PREFIX": state_prefix,
+                "SPLITTER_SEARCH_INDEX_BUCKET": raw_data_bucket.bucket_name,
+                "SPLITTER_NEARDUP_BUCKET": raw_data_bucket.bucket_name,
+                # Matches the queue's 15 minute visibility timeout above
+                "SPLITTER_VISIBILITY_TIMEOUT": "900"
+            }
+        )
+
+        # 2. The Service
+        # Starts at zero tasks; the scaling policies below own the count from here on.
+        # Public IP because the VPC has no NAT gateway to reach S3, SQS and ECR through.
+        splitter_service = ecs.FargateService(
+            self, "GestaltSplitterService",
+            cluster=cluster,
+            task_definition=splitter_task,
+            desired_count=0,
+            min_healthy_percent=0,
+            assign_public_ip=True,
+        )
+
+        # 3. Queue-depth Autoscaling
+        scaling = splitter_service.auto_scale_task_count(min_capacity=0, max_capacity=splitter_max_tasks)
+
+        # Scale out on the visible backlog, harder the deeper it gets. The alarm stays raised
+        # while the backlog lasts, so a task is added again after every cooldown
+        scaling.scale_on_metric(
+            "ScaleOnBacklog",
+            metric=splitter_queue.metric_approximate_number_of_messages_visible(period=Duration.minutes(1)),
+            scaling_steps=[
+                appscaling.ScalingInterval(lower=1, change=+1),
+                appscaling.ScalingInterval(lower=100, change=+3),
+                appscaling.ScalingInterval(lower=1000, change=+5),
+            ],
+            adjustment_type=appscaling.AdjustmentType.CHANGE_IN_CAPACITY,
+            cooldown=Duration.minutes(1),
+        )
+
+        # A short queue of huge PDFs barely moves the count above, so also scale out when
+        # the oldest message has waited too long
+        scaling.scale_on_metric(
+            "ScaleOnMessageAge",
+            metric=splitter_queue.metric_approximate_age_of_oldest_message(period=Duration.minutes(1)),
+            scaling_steps=[
+                appscaling.ScalingInterval(lower=300, change=+1),
+                appscaling.ScalingInterval(lower=900, change=+2),
+            ],
+            adjustment_type=appscaling.AdjustmentType.CHANGE_IN_CAPACITY,
+            cooldown=Duration.minutes(2),
+        )
+
+        # Scale in to zero only once nothing is visible OR in flight, so a task is never
+        # stopped halfway through a document
+        queue_backlog = cloudwatch.MathExpression(
+            expression="visible + in_flight",
+            using_metrics={
+                "visible": splitter_queue.metric_approximate_number_of_messages_visible(),
+                "in_flight": splitter_queue.metric_approximate_number_of_messages_not_visible()
+            },
+            period=Duration.minutes(1),
+        )
+        scaling.scale_on_metric(
+            "ScaleInWhenIdle",
+            metric=queue_backlog,
+            scaling_steps=[
+                appscaling.ScalingInterval(upper=0, change=-splitter_max_tasks),
+                appscaling.ScalingInterval(lower=1, change=0),
+            ],
+            adjustment_type=appscaling.AdjustmentType.CHANGE_IN_CAPACITY,
+            evaluation_periods=10,
+        )
+
+        # ==========================================
+        # PHASE 4: THE FAST SPLITTER (Lambda)
+        # ==========================================
+
+        # 1. The Function
+        # Same splitter code as the Fargate service, packaged for Lambda. PyMuPDF is a native
+        # wheel, hence an image rather than a zip.
+        fast_splitter = _lambda.DockerImageFunction(
+            self, "GestaltFastSplitter",
+            code=_lambda.DockerImageCode.from_image_asset(".", file="worker/Dockerfile.lambda"),
+            memory_size=int(self.node.try_get_context("fastSplitterMemoryMiB") or 3008),
+            timeout=Duration.minutes(5),
+            ephemeral_storage_size=Size.mebibytes(2048),
+            environment={
+                # Fan-out shards of a small file with a huge page count go to the Fargate fleet
+                "SPLITTER_QUEUE_URL": splitter_queue.queue_url,
+                "SPLITTER_PAGE_WORKERS": "1",
+                "SPLITTER_STATE_PREFIX": state_prefix,
+                "SPLITTER_SEARCH_INDEX_BUCKET": raw_data_bucket.bucket_name,
+                "SPLITTER_NEARDUP_BUCKET": raw_data_bucket.bucket_name
+            }
+        )
+
+        raw_data_bucket.grant_read_write(fast_splitter)
+        splitter_queue.grant_send_messages(fast_splitter)
+
+        # 2. The Trigger
+        # Failed records are reported one by one, so a bad PDF doesn't send its whole batch back
+        fast_splitter.add_event_source(lambda_events.SqsEventSource(
+            fast_queue,
+            batch_size=5,
+            max_batching_window=Duration.seconds(1),
+            report_batch_item_failures=True
+        ))
@@ -0,0 +1,160 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+
+class CompletionManifest:
+    """Set of finished document URLs, with the size and hash each one was stored with.
+
+    The same store also keeps other per-URL records, such as listing-page fingerprints.
+
+    The whole manifest is loaded into memory once, so checking a URL is a dict lookup.
+    New records are buffered and flushed in batches, and flushing never rewrites what is
+    already stored:
+
+    - Locally, records are appended to a JSON-lines file, which is compacted in place once
+      it holds more than twice as many lines as there are live records.
+    - In S3, every flush writes a new segment object under {prefix}segments/{writer_id}/.
+      Once there are more than max_segments of them they are folded into
+      {prefix}base-{writer_id}.jsonl and deleted.
+
+    Several writers (crawl shards) can share one S3 prefix: each loads everything under it
+    but only ever compacts and deletes its own objects.
+    """
+
+    def __init__(self, path=None, s3=None, bucket=None, prefix="manifest/", max_segments=200, writer_id="main",
+                 label="completed documents"):
+        self.path = path
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+        self.max_segments = max_segments
+        self.writer_id = writer_id
+        self.label = label
+
+        self._records = {}
+        self._own_urls = set()
+        self._pending = []
+        self._lines_on_disk = 0
+        self._lock = threading.Lock()
+
+    def __contains__(self, url):
+        return url in self._records
+
+    def __len__(self):
+        return len(self._records)
+
+    def get(self, url):
+        return self._records.get(url)
+
+    def items(self):
+        with self._lock:
+            return list(self._records.items())
+
+    def add(self, url, **record):
+        record = dict(record, url=url, completed=time.time())
+        with self._lock:
+            self._records[url] = record
+            self._own_urls.add(url)
+            self._pending.append(record)
+
+    # --- Loading ---
+    def load(self):
+        if self.bucket:
+            self._load_s3()
+        elif self.path and os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                for line in f:
+                    if line.strip():
+                        self._apply(json.loads(line))
+                        self._lines_on_disk += 1
+        print(f"Loaded manifest with {len(self._records)} {self.label}.")
+
+    def _apply(self, record):
+        self._records[record['url']] = record
+
+    def _load_s3(self):
+        keys = self._list(self.prefix)
+        bases = [key for key in keys if key[len(self.prefix):].startswith("base-")]
+        # Segment names start with a nanosecond timestamp, so this is write order
+        segments = sorted((key for key in keys if key.startswith(f"{self.prefix}segments/")), key=lambda k: k.rsplit('/', 1)[-1])
+
+        for key in bases + segments:
+            own = key == self._base_key() or key.startswith(self._segment_prefix())
+            body = self.s3.get_object(Bucket=self.bucket, Key=key)['Body'].read().decode('utf-8')
+            for line in body.splitlines():
+                if line.strip():
+                    record = json.loads(line)
+                    self._apply(record)
+                    if own:
+                        self._own_urls.add(record['url'])
+
+    def _base_key(self):
+        return f"{self.prefix}base-{self.writer_id}.jsonl"
+
+    def _segment_prefix(self):
+        return f"{self.prefix}segments/{self.writer_id}/"
+
+    def _list(self, prefix):
+        keys = []
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for listing in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            keys.extend(obj['Key'] for obj in listing.get('Contents', []))
+        return keys
+
+    # --- Flushing ---
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+
+        lines = "".join(json.dumps(record) + "\n" for record in pending)
+        try:
+            if self.bucket:
+                key = f"{self._segment_prefix()}{time.time_ns()}-{uuid.uuid4().hex[:8]}.jsonl"
+                self.s3.put_object(Bucket=self.bucket, Key=key, Body=lines.encode('utf-8'))
+            elif self.path:
+                with open(self.path, 'a') as f:
+                    f.write(lines)
+                self._lines_on_disk += len(pending)
+        except Exception as e:
+            # Put the records back so the next flush tries again
+            with self._lock:
+                self._pending = pending + self._pending
+            print(f"Failed to flush manifest: {e}")
+            return
+
+        self._maybe_compact()
+
+    def _maybe_compact(self):
+        if self.bucket:
+            segments = self._list(self._segment_prefix())
+            if len(segments) > self.max_segments:
+                self._compact_s3(segments)
+        elif self._lines_on_disk > 2 * len(self._records):
+            self._compact_local()
+
+    def _snapshot(self, own_only=False):
+        with self._lock:
+            records = [self._records[url] for url in self._own_urls] if own_only else self._records.values()
+            return "".join(json.dumps(record) + "\n" for record in records)
+
+    def _compact_s3(self, segments):
+        self.s3.put_object(Bucket=self.bucket, Key=self._base_key(), Body=self._snapshot(own_only=True).encode('utf-8'))
+        # Only delete the segments that existed before the snapshot; later ones are still live
+        for i in range(0, len(segments), 1000):
+            self.s3.delete_objects(
+                Bucket=self.bucket,
+                Delete={'Objects': [{'Key': key} for key in segments[i:i + 1000]], 'Quiet': True}
+            )
+        print(f"Compacted {len(segments)} manifest segments into {self._base_key()}")
+
+    def _compact_local(self):
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as f:
+            f.write(self._snapshot())
+        os.replace(temp_path, self.path)
+        self._lines_on_disk = len(self._records)
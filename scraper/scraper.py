@@ -1,5 +1,5 @@
 import os
-from playwright.sync_api import sync_playwright
+from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
 from playwright_stealth import Stealth  # <-- Import the new Stealth class
 from urllib.parse import urljoin, urlparse
 import requests
@@ -10,10 +10,29 @@ import os
 import boto3
 import re
 import random
+import hashlib
+import sys
+import threading
+from concurrent.futures import wait
+from transfer import DownloadEngine, S3StreamUploader, FileSink, download_with_resume
+from manifest import CompletionManifest
 
-BASE_URL = 'https://www.justice.gov/epstein/doj-disclosures'
+# Shared instrumentation lives in common/python; the Docker image copies it next to this file
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common', 'python'))
+import gestalt_metrics as metrics
+
+metrics.configure("scraper")
+
+BASE_URL = os.environ.get('SCRAPER_BASE_URL', 'https://www.justice.gov/epstein/doj-disclosures')
 DOWNLOAD_DIR = "/tmp"
 STATE_FILE = "scraper_state.json"
+MANIFEST_FILE = "scraper_manifest.jsonl"  # Local mode; cloud mode keeps segments under MANIFEST_PREFIX
+MANIFEST_PREFIX = "manifest/"
+LISTINGS_FILE = "scraper_listings.jsonl"  # Listing-page fingerprints, same layout as the manifest
+LISTINGS_PREFIX = "listings/"
+RETRY_FILE = "scraper_retries.jsonl"  # PDFs that were still failing, same layout as the manifest
+RETRY_PREFIX = "retries/"
+SESSION_FILE = "scraper_session.json"  # Browser storage state + dataset links from the last bootstrap
 BAD_PAGE_FILE = "bad_pages.json"
 LOG_FILE = "playwright_scraper_log.txt"
 cur_dataset_index = 0
@@ -23,7 +42,6 @@ cur_doc_index = 0
 #should start on dataset 10, page 20, EFTA00000990.pdf
 start_dataset_index = 10
 start_dataset_page = 2208
-start_doc_index = 0
 started = False
 
 # Set these to integers to force the scraper to start at a specific location, ignoring the saved state file. 
@@ -31,6 +49,81 @@ started = False
 FORCE_DATASET_INDEX = None  # e.g., 10
 FORCE_DATASET_PAGE = None   # e.g., 1257
 
+# Download engine: each listing page's PDFs are fetched as one batch over a pooled HTTP
+# session, DOWNLOAD_CONCURRENCY at a time and at most HOST_RATE_LIMIT requests per second
+# per host, while the browser moves on to the next listing page.
+DOWNLOAD_CONCURRENCY = int(os.environ.get('DOWNLOAD_CONCURRENCY', '4'))
+HOST_RATE_LIMIT = float(os.environ.get('HOST_RATE_LIMIT', '2'))
+
+# Cloud mode streams every response straight into an S3 multipart upload instead of
+# writing it to /tmp first. Set STREAM_UPLOADS=0 to go back to download-then-upload.
+STREAM_UPLOADS = os.environ.get('STREAM_UPLOADS', '1') == '1'
+UPLOAD_PART_SIZE = int(os.environ.get('UPLOAD_PART_SIZE', str(16 * 1024 * 1024)))
+
+# Failed transfers are retried with jittered exponential backoff, resuming from the last
+# byte received. PDFs that still fail go on a retry queue that is drained once at the end
+# of each dataset; whatever fails again waits for the next drain. Failures are also written
+# to the retry store, so the next run retries them first, before it starts crawling.
+DOWNLOAD_MAX_ATTEMPTS = int(os.environ.get('DOWNLOAD_MAX_ATTEMPTS', '5'))
+DOWNLOAD_BACKOFF_SECONDS = float(os.environ.get('DOWNLOAD_BACKOFF_SECONDS', '1'))
+DOWNLOAD_MAX_BACKOFF_SECONDS = float(os.environ.get('DOWNLOAD_MAX_BACKOFF_SECONDS', '30'))
+retry_queue = []
+retry_queue_lock = threading.Lock()
+
+# When each queued PDF's link was first seen; starts the document's end-to-end trace
+discovered_at = {}
+downloader = None
+manifest = None
+listings = None
+retries = None
+
+# Incremental re-crawl, for refreshing a finished crawl: walk every listing from the top,
+# pass over listing pages whose set of PDF links hasn't changed since they were last seen,
+# and re-check known PDFs with conditional requests (ETag / Last-Modified) so an unchanged
+# document costs a 304 instead of a download.
+INCREMENTAL_CRAWL = os.environ.get('INCREMENTAL_CRAWL', '0') == '1'
+
+# Fast navigation (FAST_NAVIGATION=1): the browser never fetches resource types we don't
+# read, and instead of waiting for the network to go idle after every click, a listing page
+# counts as loaded as soon as its PDF links differ from the previous page's. Each listing
+# page's latency is recorded in both modes so they can be compared. Stylesheets load by
+# default: without them, elements the site hides or shows with CSS fool is_visible().
+FAST_NAVIGATION = os.environ.get('FAST_NAVIGATION', '0') == '1'
+BLOCKED_RESOURCE_TYPES = [t for t in os.environ.get('BLOCKED_RESOURCE_TYPES', 'image,font,media').split(',') if t]
+NAVIGATION_TIMEOUT_MS = int(os.environ.get('NAVIGATION_TIMEOUT_MS', '15000'))
+listing_latencies = []
+
+# True once the page shows PDF links that differ from the (newline-joined) previous ones
+PDF_LINKS_CHANGED_JS = """previous => {
+    const hrefs = Array.from(document.querySelectorAll('a[href$=".pdf"]'), a => a.getAttribute('href'));
+    return hrefs.length > 0 && hrefs.join('\\n') !== previous;
+}"""
+
+# Sharded crawl (see trigger_scraper.py --shards). A shard only takes the datasets assigned
+# to it: SHARD_DATASETS lists them by number (1-based, the same numbering the state file
+# uses), otherwise every SHARD_COUNT-th dataset starting at SHARD_INDEX. SHARD_PAGE_START/END
+# narrow a shard down to a page range of its dataset, which has SHARD_PAGE_TOTAL pages in all.
+# Every shard keeps its own state file and reports to crawl_runs/<CRAWL_RUN_ID>/ when it is done.
+SHARD_INDEX = int(os.environ.get('SHARD_INDEX', '0'))
+SHARD_COUNT = int(os.environ.get('SHARD_COUNT', '1'))
+SHARD_DATASETS = [int(n) for n in os.environ.get('SHARD_DATASETS', '').split(',') if n.strip()]
+SHARD_PAGE_START = int(os.environ.get('SHARD_PAGE_START', '0'))
+SHARD_PAGE_END = int(os.environ['SHARD_PAGE_END']) if os.environ.get('SHARD_PAGE_END') else None
+SHARD_PAGE_TOTAL = int(os.environ['SHARD_PAGE_TOTAL']) if os.environ.get('SHARD_PAGE_TOTAL') else None
+CRAWL_RUN_ID = os.environ.get('CRAWL_RUN_ID')
+if SHARD_COUNT > 1:
+    STATE_FILE = f"scraper_state_shard{SHARD_INDEX}.json"
+    SESSION_FILE = f"scraper_session_shard{SHARD_INDEX}.json"
+
+# Warm start: restore the browser session (cookies, local storage) and dataset links saved
+# by the last bootstrap and go straight to the resume page. Only when the site rejects the
+# restored session do we go through the age gate and dropdown again.
+REUSE_SESSION = os.environ.get('REUSE_SESSION', '1') == '1'
+session_restored = False
+process_started = time.monotonic()
+first_download_logged = False
+first_download_lock = threading.Lock()
+
 # 1. Grab the bucket name injected by our CDK stack
 STAGING_BUCKET = os.environ.get('STAGING_BUCKET')
 
@@ -38,17 +131,17 @@ STAGING_BUCKET = os.environ.get('STAGING_BUCKET')
 if STAGING_BUCKET:
     print(f"Running in CLOUD MODE. Destination: S3 Bucket '{STAGING_BUCKET}'")
     s3 = boto3.client('s3')
-    DOWNLOAD_DIR = "/tmp"  # Ephemeral storage for Fargate
+    DOWNLOAD_DIR = os.environ.get('DOWNLOAD_DIR', "/tmp")  # Ephemeral storage for Fargate
 else:
     print("Running in LOCAL MODE. Destination: Local Disk")
     s3 = None
-    DOWNLOAD_DIR = "D:/development/datasets/Epstein_DOJ_Files"
+    DOWNLOAD_DIR = os.environ.get('DOWNLOAD_DIR', "D:/development/datasets/Epstein_DOJ_Files")
     os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 
 # --- STATE MANAGEMENT ---
 def load_state():
-    global start_dataset_index, start_dataset_page, start_doc_index
-    state = {"dataset_index": 0, "dataset_page": 0, "doc_index": 0}
+    global start_dataset_index, start_dataset_page
+    state = {"dataset_index": 0, "dataset_page": 0}
 
     try:
         # Try to pull the latest state from S3 if in cloud mode
@@ -71,19 +164,24 @@ def load_state():
     except Exception as e:
         print(f"Error loading state: {e}. Starting fresh.")
 
+    # A refresh has to look at every listing page, so the saved position doesn't apply
+    if INCREMENTAL_CRAWL:
+        state = {"dataset_index": 0, "dataset_page": 0}
+        print("INCREMENTAL CRAWL: starting from the first dataset.")
+
     # Apply Overrides
     start_dataset_index = FORCE_DATASET_INDEX if FORCE_DATASET_INDEX is not None else state.get("dataset_index", 0)
     start_dataset_page = FORCE_DATASET_PAGE if FORCE_DATASET_PAGE is not None else state.get("dataset_page", 0)
-    start_doc_index = state.get("doc_index", 0)
 
     if FORCE_DATASET_INDEX is not None or FORCE_DATASET_PAGE is not None:
         print(f"OVERRIDE ENGAGED: Forcing start at Dataset {start_dataset_index}, Page {start_dataset_page}")
 
-def save_state(d_idx, p_idx, doc_idx):
+def save_state(d_idx, p_idx):
+    # Only used to fast-forward the listing on restart; which documents are
+    # done is tracked per URL in the completion manifest
     state = {
         "dataset_index": d_idx,
-        "dataset_page": p_idx,
-        "doc_index": doc_idx
+        "dataset_page": p_idx
     }
     try:
         with open(os.path.join(DOWNLOAD_DIR, STATE_FILE), 'w') as f:
@@ -95,6 +193,36 @@ def save_state(d_idx, p_idx, doc_idx):
     except Exception as e:
         print(f"Failed to save state: {e}")
 
+def load_session():
+    session_path = os.path.join(DOWNLOAD_DIR, SESSION_FILE)
+    try:
+        if STAGING_BUCKET:
+            s3.download_file(STAGING_BUCKET, SESSION_FILE, session_path)
+        with open(session_path, 'r') as f:
+            session = json.load(f)
+        print(f"Loaded saved browser session from {time.ctime(session['saved'])} with {len(session['dataset_links'])} datasets.")
+        return session
+    except Exception as e:
+        print(f"No saved browser session to restore ({e}). Doing a full bootstrap.")
+        return None
+
+def save_session(context, dataset_links):
+    session = {
+        "storage_state": context.storage_state(),
+        "dataset_links": dataset_links,
+        "saved": time.time()
+    }
+    try:
+        session_path = os.path.join(DOWNLOAD_DIR, SESSION_FILE)
+        with open(session_path, 'w') as f:
+            json.dump(session, f)
+
+        if STAGING_BUCKET:
+            s3.upload_file(session_path, STAGING_BUCKET, SESSION_FILE)
+        print(f"--> Browser session saved: {SESSION_FILE}")
+    except Exception as e:
+        print(f"Failed to save browser session: {e}")
+
 def save_bad_page(d_idx, p_idx, doc_ids, dataset_url):
     bad_page_info = {
         "dataset_index": d_idx,
@@ -111,13 +239,93 @@ def save_bad_page(d_idx, p_idx, doc_ids, dataset_url):
     except Exception as e:
         print(f"Failed to log bad page: {e}")
 
+def shard_owns_dataset(d_idx):
+    if SHARD_DATASETS:
+        return d_idx + 1 in SHARD_DATASETS
+    return d_idx % SHARD_COUNT == SHARD_INDEX
+
+def save_shard_report(dataset_links):
+    report = {
+        "run_id": CRAWL_RUN_ID,
+        "shard_index": SHARD_INDEX,
+        "shard_count": SHARD_COUNT,
+        "dataset_count": len(dataset_links),
+        "datasets": [i + 1 for i in range(len(dataset_links)) if shard_owns_dataset(i)],
+        "page_start": SHARD_PAGE_START,
+        "page_end": SHARD_PAGE_END,
+        "page_total": SHARD_PAGE_TOTAL,
+        "documents": len(manifest),
+        "listing_latency": listing_latency_summary(),
+        "finished": time.time()
+    }
+    report_name = f"shard-{SHARD_INDEX}.json"
+    try:
+        report_path = os.path.join(DOWNLOAD_DIR, f"crawl_run_{CRAWL_RUN_ID}_{report_name}")
+        with open(report_path, 'w') as f:
+            json.dump(report, f)
+
+        if STAGING_BUCKET:
+            s3.upload_file(report_path, STAGING_BUCKET, f"crawl_runs/{CRAWL_RUN_ID}/{report_name}")
+        print(f"--> Shard {SHARD_INDEX}/{SHARD_COUNT} finished: {report}")
+    except Exception as e:
+        print(f"Failed to save shard report: {e}")
+
+def block_unneeded_resources(context):
+    def handle(route):
+        if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+            route.abort()
+        else:
+            route.continue_()
+    context.route("**/*", handle)
+    print(f"Blocking resource types: {BLOCKED_RESOURCE_TYPES}")
+
+def wait_for_page(page):
+    # Fast mode only needs the DOM; the slow mode also waits for every background request
+    page.wait_for_load_state('domcontentloaded' if FAST_NAVIGATION else 'networkidle')
+
+def current_pdf_hrefs(page):
+    # One round trip for the whole list instead of one per link
+    return page.locator('a[href$=".pdf"]').evaluate_all("links => links.map(a => a.getAttribute('href'))")
+
+def wait_for_listing(page, previous_hrefs=None):
+    """Waits for a listing page to show its PDF links (different ones from previous_hrefs, if given)."""
+    if not FAST_NAVIGATION:
+        page.wait_for_load_state('networkidle')
+        return
+
+    try:
+        page.wait_for_function(PDF_LINKS_CHANGED_JS, arg="\n".join(previous_hrefs or []), timeout=NAVIGATION_TIMEOUT_MS)
+    except PlaywrightTimeoutError:
+        # Empty or unchanged listings never satisfy the check; let the network decide instead
+        print(f"PDF links didn't change within {NAVIGATION_TIMEOUT_MS}ms, waiting for networkidle...")
+        page.wait_for_load_state('networkidle')
+
+def record_listing_latency(page_index, seconds):
+    listing_latencies.append(seconds)
+    print(f"Listing page {page_index} ready in {seconds:.2f}s")
+    metrics.put_metric("ListingLatency", round(seconds * 1000, 1), "Milliseconds",
+                       page=page_index, mode="fast" if FAST_NAVIGATION else "networkidle")
+
+def listing_latency_summary():
+    if not listing_latencies:
+        return None
+    latencies = sorted(listing_latencies)
+    return {
+        "mode": "fast" if FAST_NAVIGATION else "networkidle",
+        "pages": len(latencies),
+        "mean": round(sum(latencies) / len(latencies), 3),
+        "p50": round(latencies[len(latencies) // 2], 3),
+        "p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3),
+        "max": round(latencies[-1], 3)
+    }
+
 def check_for_robot_check(page):
     try:
         robot_button = page.get_by_role('button', name='I am not a robot').or_(page.get_by_text('I am not a robot'))
         if robot_button.count() > 0 and robot_button.first.is_visible():
             print("Clicking the 'I am not a robot' button...")
             robot_button.first.click()
-            page.wait_for_load_state('networkidle')  # Wait for the page to load after
+            wait_for_page(page)  # Wait for the page to load after
         else:
             print("Could not find the 'I am not a robot' button. Please check the page structure.")
     except Exception as e:
@@ -132,7 +340,7 @@ def check_for_age_gate(page):
             if yes_button.count() > 0:
                 # Click the "I am over 18" button within the age gate block
                 yes_button.first.click()
-            page.wait_for_load_state('networkidle')  # Wait for the page to load after bypassing age gate
+            wait_for_page(page)  # Wait for the page to load after bypassing age gate
         else:
             print("No age gate detected.")
     except Exception as e:
@@ -143,7 +351,7 @@ def select_dropdown(page):
     if drop_down.count() > 0:
         print("Clicking the dataset dropdown...")
         drop_down.first.click()
-        page.wait_for_load_state('networkidle')  # Wait for the page to load after clicking the dropdown
+        wait_for_page(page)  # Wait for the page to load after clicking the dropdown
     else:
         print("Could not find the dataset dropdown. Please check the page structure.")
 
@@ -180,6 +388,7 @@ def navigate_to_next_page(page):
     print(f"next_is_present: {next_is_present}") 
     if next_is_present:
         print("Clicking the 'Next' button to go to the next page of the dataset...")
+        previous_hrefs = current_pdf_hrefs(page) if FAST_NAVIGATION else None
         # 1. Smoothly scroll the button into the browser viewport
         next_button.first.scroll_into_view_if_needed()
         time.sleep(random.uniform(0.5, 1.0))
@@ -193,9 +402,10 @@ def navigate_to_next_page(page):
         next_button.first.click(delay=random.randint(50, 150))
 
         # 4. Wait for the DOJ's JavaScript to fetch the new PDF links
-        # Because the URL doesn't change, we wait for the network to stop making requests
+        # Because the URL doesn't change, we wait for the network to stop making requests,
+        # or in fast mode just for the links to change
         print("Click successful. Waiting for new PDFs to load...")
-        page.wait_for_load_state("networkidle")
+        wait_for_listing(page, previous_hrefs)
 
         # (Optional but recommended) Add a hard buffer just in case their server is slow
         # time.sleep(random.uniform(2.0, 4.0))
@@ -205,36 +415,166 @@ def navigate_to_next_page(page):
         print("No more pages found in this dataset.")
         return False
 
-def download_pdf(page, pdf_url):
-    global cur_doc_index
-    cookies = page.context.cookies()
-    session_cookies = {cookie['name']: cookie['value'] for cookie in cookies}
-    user_agent = page.evaluate("navigator.userAgent")
-    headers = {'User-Agent': user_agent}
+def listing_page_url(base_dataset_url, page_index):
+    # Handle whether the base URL already has query parameters
+    if "?" in base_dataset_url:
+        return base_dataset_url + f"&page={page_index}"
+    return base_dataset_url + f"?page={page_index}"
+
+def resume_url(dataset_links):
+    """The listing page this run starts on, i.e. where loop_through_datasets will go first."""
+    for i, link in enumerate(dataset_links):
+        if not shard_owns_dataset(i) or i < start_dataset_index - 1:
+            continue
+        dataset_url = urljoin(BASE_URL, link)
+        if i == start_dataset_index - 1 and start_dataset_page - 1 > 0:
+            return listing_page_url(dataset_url, start_dataset_page - 1)
+        if SHARD_PAGE_START > 0:
+            return listing_page_url(dataset_url, SHARD_PAGE_START)
+        return dataset_url
+    return None
+
+def restore_session(page, session):
+    """Opens the resume page with a restored session. Returns the saved dataset links, or None if the site rejected us."""
+    target_url = resume_url(session['dataset_links'])
+    if target_url is None:
+        return None
+
+    print(f"Restored session: going straight to {target_url}")
+    page.goto(target_url)
+    wait_for_listing(page)
+
+    # A stale session lands on the robot check or the age gate instead of a listing
+    age_block = page.locator('#age-verify-block')
+    if (age_block.count() > 0 and age_block.first.is_visible()) or not current_pdf_hrefs(page):
+        print("Restored session was rejected. Falling back to the full bootstrap...")
+        return None
+    return session['dataset_links']
+
+def log_first_download():
+    global first_download_logged
+    with first_download_lock:
+        if first_download_logged:
+            return
+        first_download_logged = True
+    print(f"--> Cold start to first download: {time.monotonic() - process_started:.1f}s "
+          f"({'restored session' if session_restored else 'full bootstrap'})")
+
+def conditional_headers(record):
+    """Request headers that turn a re-download of a known PDF into a cheap 304 if it hasn't changed."""
+    headers = {}
+    if record and record.get('etag'):
+        headers['If-None-Match'] = record['etag']
+    if record and record.get('last_modified'):
+        headers['If-Modified-Since'] = record['last_modified']
+    return headers
+
+def response_validators(headers):
+    return {'etag': headers.get('ETag'), 'last_modified': headers.get('Last-Modified')}
+
+def fetch_pdf(session, pdf_url, sink, headers):
+    return download_with_resume(
+        session, pdf_url, sink, headers,
+        max_attempts=DOWNLOAD_MAX_ATTEMPTS,
+        backoff=DOWNLOAD_BACKOFF_SECONDS,
+        max_backoff=DOWNLOAD_MAX_BACKOFF_SECONDS,
+        rate_limiter=downloader.rate_limiter
+    )
+
+def queue_retry(pdf_url, doc_index):
+    metrics.put_metric("DownloadFailures", 1, url=pdf_url)
+    retries.add(pdf_url, failed=True, doc_index=doc_index, shard=SHARD_INDEX)
+    with retry_queue_lock:
+        retry_queue.append((pdf_url, doc_index))
+
+def requeue_failed_downloads(page):
+    # Records are never removed from the store, only superseded, so the latest one says
+    # whether a URL is still failing. Each shard only retries its own failures.
+    jobs = [
+        (url, record['doc_index']) for url, record in retries.items()
+        if record.get('failed') and record.get('shard', 0) == SHARD_INDEX
+    ]
+    if not jobs:
+        return
+
+    print(f"Re-queueing {len(jobs)} PDF(s) that were still failing at the end of the last run.")
+    for url, _ in jobs:
+        discovered_at.setdefault(url, time.time())
+    with retry_queue_lock:
+        retry_queue.extend(jobs)
+    drain_retry_queue(page)
+
+def drain_retry_queue(page):
+    with retry_queue_lock:
+        jobs = list(dict.fromkeys(retry_queue))
+        retry_queue.clear()
+    if not jobs:
+        return
 
+    print(f"Retrying {len(jobs)} failed PDF(s)...")
+    wait(downloader.submit_batch(page, jobs))
+    manifest.flush()
+    retries.flush()
+    print(f"Retry pass done: {len(jobs) - len(retry_queue)} recovered, {len(retry_queue)} still failing.")
+
+def listing_fingerprint(pdf_hrefs):
+    return hashlib.sha256("\n".join(sorted(set(pdf_hrefs))).encode('utf-8')).hexdigest()
+
+def document_stored(pdf_url, size, sha256, response_headers, correlation_id):
+    manifest.add(pdf_url, size=size, sha256=sha256, correlation_id=correlation_id,
+                 **response_validators(response_headers))
+    record = retries.get(pdf_url)
+    if record and record.get('failed'):
+        retries.add(pdf_url, failed=False, doc_index=record['doc_index'], shard=record.get('shard', 0))
+    log_first_download()
+    metrics.put_metric("DocumentBytes", size, "Bytes", correlation_id, url=pdf_url)
+    metrics.put_latency("DiscoveryToStoredLatency", discovered_at.get(pdf_url), correlation_id, url=pdf_url)
+
+def download_pdf(session, pdf_url, doc_index):
+    # Runs on the download engine's worker threads: the session already carries the
+    # browser's cookies and user agent, so there's no Playwright access in here.
     parsed_url = urlparse(pdf_url)
     filename = os.path.basename(parsed_url.path)
     if not filename:
-        filename = f'unknown_document_{cur_doc_index}.pdf'
+        filename = f'unknown_document_{doc_index}.pdf'
+
+    headers = conditional_headers(manifest.get(pdf_url)) if INCREMENTAL_CRAWL else {}
+
+    # The trace rides along in the object's metadata to the router and the splitter
+    correlation_id = metrics.new_correlation_id()
+    trace = metrics.trace_metadata(correlation_id, discovered_at.get(pdf_url, time.time()))
+
+    if STAGING_BUCKET and STREAM_UPLOADS:
+        stream_pdf_to_s3(session, pdf_url, doc_index, filename, headers, correlation_id, trace)
+        return
 
     file_path = os.path.join(DOWNLOAD_DIR, filename)
     try:
-        # 1. Download the file locally
-        with requests.get(pdf_url, headers=headers, cookies=session_cookies, stream=True, timeout=30) as response:
-            response.raise_for_status()
-            with open(file_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
+        # 1. Download the file locally, hashing it on the way so the splitter can dedup re-uploads
+        sink = FileSink(file_path)
+        try:
+            with metrics.timer("DownloadTime", correlation_id, url=pdf_url):
+                response_headers = fetch_pdf(session, pdf_url, sink, headers)
+        finally:
+            size = sink.close()
+        if response_headers is None:
+            print(f"  -> UNCHANGED: {filename} (304 Not Modified)")
+            metrics.put_metric("DocumentsUnchanged", 1, url=pdf_url)
+            return
         print(f"Downloaded PDF to: {file_path}")
 
         # 2. Environment-Aware Storage Handling
         if STAGING_BUCKET:
             try:
                 print(f"  -> Pushing {filename} to S3 Staging Bucket...")   
-                s3.upload_file(file_path, STAGING_BUCKET, filename)
+                with metrics.timer("UploadTime", correlation_id, url=pdf_url):
+                    s3.upload_file(file_path, STAGING_BUCKET, filename,
+                                   ExtraArgs={'Metadata': dict(trace, sha256=sink.sha256.hexdigest())})
                 print(f"  -> SUCCESS: {filename} secured in S3.")
+                document_stored(pdf_url, size, sink.sha256.hexdigest(), response_headers, correlation_id)
             except Exception as e:
                 print(f"  -> ERROR: Failed to upload {filename} to S3: {str(e)}")
+                queue_retry(pdf_url, doc_index)
             finally:
                 # CRITICAL for Fargate: Clean up ephemeral disk space
                 if os.path.exists(file_path):
@@ -242,9 +582,33 @@ def download_pdf(page, pdf_url):
         else:
             # Local mode: leave the file exactly where it is
             print(f"  -> LOCAL MODE: File retained on disk.")
+            document_stored(pdf_url, size, sink.sha256.hexdigest(), response_headers, correlation_id)
 
-    except requests.exceptions.RequestException as e:
+    except Exception as e:
         print(f"Failed to download PDF: {pdf_url} with error {e}")
+        queue_retry(pdf_url, doc_index)
+
+def stream_pdf_to_s3(session, pdf_url, doc_index, filename, headers, correlation_id, trace):
+    # Zero disk I/O: each part-sized buffer is uploaded while the next one downloads.
+    # A dropped connection resumes into the same multipart upload.
+    uploader = S3StreamUploader(s3, STAGING_BUCKET, filename, part_size=UPLOAD_PART_SIZE, metadata=trace)
+    try:
+        print(f"  -> Streaming {filename} into S3 Staging Bucket...")
+        # Download and upload overlap here, so there's one timer for both
+        with metrics.timer("DownloadTime", correlation_id, url=pdf_url, mode="stream"):
+            response_headers = fetch_pdf(session, pdf_url, uploader, headers)
+            if response_headers is None:
+                # Nothing was written, so there is no upload to finish or abort
+                print(f"  -> UNCHANGED: {filename} (304 Not Modified)")
+                metrics.put_metric("DocumentsUnchanged", 1, url=pdf_url)
+                return
+            size = uploader.close()
+        print(f"  -> SUCCESS: {filename} ({size} bytes) secured in S3.")
+        document_stored(pdf_url, size, uploader.sha256.hexdigest(), response_headers, correlation_id)
+    except Exception as e:
+        uploader.abort()
+        print(f"  -> ERROR: Failed to stream {pdf_url} to S3: {str(e)}")
+        queue_retry(pdf_url, doc_index)
 
 def fast_forward_to_page(page, base_dataset_url, target_page_index):
     print(f"Fast-forwarding to page {target_page_index} using the hybrid click-then-jump method...")
@@ -264,12 +628,7 @@ def fast_forward_to_page(page, base_dataset_url, target_page_index):
         time.sleep(random.uniform(1.5, 2.5))
 
     # Step 2: Jump directly to the target URL
-    # Handle whether the base URL already has query parameters
-    target_url = base_dataset_url
-    if "?" in target_url:
-        target_url += f"&page={target_page_index}"
-    else:
-        target_url += f"?page={target_page_index}"
+    target_url = listing_page_url(base_dataset_url, target_page_index)
 
     print(f"Trust established. Jumping directly to: {target_url}")
 
@@ -277,37 +636,50 @@ def fast_forward_to_page(page, base_dataset_url, target_page_index):
     time.sleep(random.uniform(2.0, 3.5))
 
     page.goto(target_url)
-    page.wait_for_load_state('networkidle')
+    wait_for_listing(page)
     print("Successfully jumped to target page!")
 
+def open_listing_at(page, base_dataset_url, page_index):
+    target_url = listing_page_url(base_dataset_url, page_index) if page_index > 0 else base_dataset_url
+    if page.url == target_url:
+        return  # Already there from checking the restored session
+
+    # A restored session already has the site's trust, so there are no clicks to replay
+    if page_index == 0 or session_restored:
+        page.goto(target_url)
+        wait_for_listing(page)
+    else:
+        page.goto(base_dataset_url)
+        wait_for_listing(page)
+        fast_forward_to_page(page, base_dataset_url, page_index)
+
 
 def process_dataset_page(page, dataset_url, is_resume_dataset=False):
-    global started, start_dataset_page, start_doc_index
+    global started, start_dataset_page
     global cur_dataset_page, cur_doc_index
 
     print(f"Navigating to dataset page: {dataset_url}")
     cur_dataset_page = 0
-    page.goto(dataset_url)
-    page.wait_for_load_state('networkidle')
+    listing_started = time.monotonic()
 
     # --- THE NEW FAST-FORWARD LOGIC ---
     if is_resume_dataset and start_dataset_page - 1 > 0:
-        fast_forward_to_page(page, dataset_url, start_dataset_page - 1)
+        open_listing_at(page, dataset_url, start_dataset_page - 1)
         # CRITICAL: Update our tracker so the script knows we jumped!
         cur_dataset_page = start_dataset_page 
+    elif SHARD_PAGE_START > 0:
+        # Page-range shard: start at the beginning of our range
+        open_listing_at(page, dataset_url, SHARD_PAGE_START)
+        cur_dataset_page = SHARD_PAGE_START
+    else:
+        open_listing_at(page, dataset_url, 0)
+    record_listing_latency(cur_dataset_page, time.monotonic() - listing_started)
 
     # Get the list of PDF links on the dataset page
     while True:
         check_for_robot_check(page)
         check_for_age_gate(page)
-        pdf_links = page.locator('a[href$=".pdf"]').all()
-        pdf_hrefs = [link.get_attribute('href') for link in pdf_links]
-        
-        pdf_hrefs_to_process = pdf_hrefs
-
-        # If we are resuming, slice off the documents we already downloaded on this specific page
-        if is_resume_dataset and not started and start_doc_index > 0:
-            pdf_hrefs_to_process = pdf_hrefs[start_doc_index:]
+        pdf_hrefs = current_pdf_hrefs(page)
 
         # The moment we process our first batch of links, we are officially fully caught up.
         started = True
@@ -321,25 +693,63 @@ def process_dataset_page(page, dataset_url, is_resume_dataset=False):
             if STAGING_BUCKET:
                 s3.upload_file(screenshot_path, STAGING_BUCKET, f"debug_state_{cur_dataset_index}_page_{cur_dataset_page}.png")
 
-        for i, pdf_href in enumerate(pdf_hrefs_to_process):
-            full_pdf_url = urljoin(dataset_url, pdf_href)
-
-            # Keep global track of where we are on the current page for logging/errors
-            # If we sliced the array, we need to add the offset back to get the real index
-            cur_doc_index = i if start_doc_index == 0 else (i + start_doc_index)
+        # Same links as last time, all of them stored: nothing on this page can be new
+        listing_key = f"{dataset_url}#page={cur_dataset_page}"
+        fingerprint = listing_fingerprint(pdf_hrefs)
+        last_seen = listings.get(listing_key)
+        unchanged_listing = (
+            INCREMENTAL_CRAWL and pdf_hrefs and last_seen and last_seen['fingerprint'] == fingerprint
+            and all(urljoin(dataset_url, pdf_href) in manifest for pdf_href in pdf_hrefs)
+        )
 
-            print(f"Processing PDF {cur_doc_index}: {full_pdf_url}")
-            download_pdf(page, full_pdf_url)
+        jobs = []
+        if unchanged_listing:
+            print(f"Listing page {cur_dataset_page} unchanged since last crawl, passing over its {len(pdf_hrefs)} PDFs.")
+            pdf_hrefs = []
 
-        # Reset doc index to 0 for the next page
-        start_doc_index = 0 
+        for i, pdf_href in enumerate(pdf_hrefs):
+            full_pdf_url = urljoin(dataset_url, pdf_href)
 
-        if not navigate_to_next_page(page):
-            save_state(cur_dataset_index + 2, 0, 0)
+            # Keep global track of where we are on the current page for logging/errors
+            cur_doc_index = i
+
+            # The manifest, not our position on the page, decides what's already done,
+            # so a crash mid-page or a listing that shifts order can't skip or repeat files.
+            # A refresh re-checks known PDFs, unless there's nothing to make the request conditional on.
+            record = manifest.get(full_pdf_url)
+            if record and not (INCREMENTAL_CRAWL and conditional_headers(record)):
+                print(f"Skipping PDF {cur_doc_index} (already in manifest): {full_pdf_url}")
+                continue
+
+            print(f"{'Re-checking' if record else 'Queueing'} PDF {cur_doc_index}: {full_pdf_url}")
+            discovered_at.setdefault(full_pdf_url, time.time())
+            jobs.append((full_pdf_url, cur_doc_index))
+
+        # Downloads run in the background while we move on to the next listing page
+        batch = downloader.submit_batch(page, jobs)
+
+        # A page-range shard stops at the end of its range instead of walking the whole dataset
+        if SHARD_PAGE_END is not None and cur_dataset_page + 1 >= SHARD_PAGE_END:
+            has_next_page = False
+        else:
+            listing_started = time.monotonic()
+            has_next_page = navigate_to_next_page(page)
+            if has_next_page:
+                record_listing_latency(cur_dataset_page + 1, time.monotonic() - listing_started)
+
+        # Only record progress once every PDF of this page is safely stored
+        wait(batch)
+        manifest.flush()
+        if pdf_hrefs and (last_seen or {}).get('fingerprint') != fingerprint:
+            listings.add(listing_key, fingerprint=fingerprint, documents=len(pdf_hrefs))
+            listings.flush()
+
+        if not has_next_page:
+            save_state(cur_dataset_index + 2, 0)
             break
         else:
             cur_dataset_page += 1
-            save_state(cur_dataset_index + 1, cur_dataset_page, 0)
+            save_state(cur_dataset_index + 1, cur_dataset_page)
 
 
 def loop_through_datasets(page, dataset_links):
@@ -349,6 +759,9 @@ def loop_through_datasets(page, dataset_links):
     for i, link in enumerate(dataset_links):
         cur_dataset_index = i
 
+        if not shard_owns_dataset(i):
+            continue
+
         if not started and i < start_dataset_index - 1:
             print(f"Skipping dataset {i}: {link}")
             continue
@@ -358,25 +771,68 @@ def loop_through_datasets(page, dataset_links):
         # Pass a flag so the page processor knows if it needs to click the 'Next' button to catch up
         is_resume_target = (not started and i == start_dataset_index - 1)
         process_dataset_page(page, urljoin(BASE_URL, link), is_resume_dataset=is_resume_target)
+        drain_retry_queue(page)
+
+def open_manifest(local_file, prefix, label):
+    if STAGING_BUCKET:
+        # Shards share one manifest but each writes (and compacts) only its own segments
+        writer_id = f"shard{SHARD_INDEX}" if SHARD_COUNT > 1 else "main"
+        store = CompletionManifest(s3=s3, bucket=STAGING_BUCKET, prefix=prefix, writer_id=writer_id, label=label)
+    else:
+        store = CompletionManifest(path=os.path.join(DOWNLOAD_DIR, local_file), label=label)
+    store.load()
+    return store
+
+def bootstrap(page):
+    page.goto(BASE_URL)
+    wait_for_page(page)  # Wait for the page to load completely
+    if not FAST_NAVIGATION:
+        page.wait_for_timeout(2000)  # Wait for 2 seconds to ensure the page is fully loaded
+
+    navigate_to_datasets(page)
+    return list_dataset_links(page)
 
 def run():
+    global downloader, manifest, listings, retries, session_restored
     load_state()
+    manifest = open_manifest(MANIFEST_FILE, MANIFEST_PREFIX, "completed documents")
+    listings = open_manifest(LISTINGS_FILE, LISTINGS_PREFIX, "listing fingerprints")
+    retries = open_manifest(RETRY_FILE, RETRY_PREFIX, "failed downloads")
+    downloader = DownloadEngine(download_pdf, DOWNLOAD_CONCURRENCY, HOST_RATE_LIMIT)
+    session = load_session() if REUSE_SESSION else None
     with Stealth().use_sync(sync_playwright()) as p:
         browser = p.chromium.launch(headless=True)  # Set headless=True to run without opening a browser window
         context = browser.new_context( 
             user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36",
             viewport={"width": 1920, "height": 1080},  # <-- Comma added here
-            accept_downloads=True
+            accept_downloads=True,
+            storage_state=session['storage_state'] if session else None
         )
+        if FAST_NAVIGATION and BLOCKED_RESOURCE_TYPES:
+            block_unneeded_resources(context)
         page = context.new_page()
-        page.goto(BASE_URL)
-        page.wait_for_load_state('networkidle')  # Wait for the page to load completely
-        page.wait_for_timeout(2000)  # Wait for 2 seconds to ensure the page is fully loaded
 
-        navigate_to_datasets(page)
-        dataset_links = list_dataset_links(page)
+        dataset_links = restore_session(page, session) if session else None
+        session_restored = dataset_links is not None
+        if not session_restored:
+            context.clear_cookies()
+            dataset_links = bootstrap(page)
+            if dataset_links:
+                save_session(context, dataset_links)
+        print(f"Ready to crawl after {time.monotonic() - process_started:.1f}s")
+
         print("Found PDF links:", dataset_links)
+        requeue_failed_downloads(page)
         loop_through_datasets(page, dataset_links)
+        downloader.shutdown()
+        manifest.flush()
+        retries.flush()
+        if retry_queue:
+            print(f"{len(retry_queue)} PDF(s) still failing; they are in the retry store for the next run: {[url for url, _ in retry_queue]}")
+        save_session(context, dataset_links)  # Keep the freshest cookies for the next start
+        print(f"Listing latency: {listing_latency_summary()}")
+        if CRAWL_RUN_ID:
+            save_shard_report(dataset_links)
         browser.close()
 
 if __name__ == "__main__":
@@ -0,0 +1,329 @@
+import base64
+import hashlib
+import queue
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class HostRateLimiter:
+    """Spaces out requests so no host sees more than requests_per_second from us."""
+
+    def __init__(self, requests_per_second):
+        self.interval = 1.0 / requests_per_second if requests_per_second > 0 else 0
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        if not self.interval:
+            return
+
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.interval
+
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class IncompleteDownload(Exception):
+    """The connection closed before Content-Length bytes arrived."""
+
+
+# Worth another attempt: timeouts, throttling and server-side errors
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+def backoff_delay(attempt, base, cap):
+    """Full-jitter exponential backoff: anywhere from 0 up to base * 2^attempt, capped."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def _is_retryable(error):
+    if isinstance(error, requests.exceptions.HTTPError):
+        return error.response is not None and error.response.status_code in RETRYABLE_STATUS
+    return isinstance(error, (requests.exceptions.RequestException, IncompleteDownload))
+
+
+def download_with_resume(session, url, sink, headers=None, max_attempts=5, backoff=1.0, max_backoff=30.0,
+                         rate_limiter=None, timeout=30, chunk_size=64 * 1024):
+    """Streams url into sink.write(), retrying with backoff and resuming where a dropped
+    transfer left off.
+
+    The sink's bytes_written is the resume offset: later attempts ask for the rest with a
+    Range request (guarded by If-Range, so a changed file isn't stitched onto the old one's
+    prefix). Servers that ignore Range resend everything and the part we already have is
+    skipped, so the sink only ever sees each byte once. The total is checked against
+    Content-Length / Content-Range. Returns the headers of the first response, or None if
+    the server answered 304 Not Modified.
+    """
+    first_headers = None
+    expected_size = None
+
+    for attempt in range(max_attempts):
+        if attempt and rate_limiter:
+            rate_limiter.wait(url)
+
+        offset = sink.bytes_written
+        request_headers = dict(headers or {})
+        if offset:
+            request_headers.pop('If-None-Match', None)
+            request_headers.pop('If-Modified-Since', None)
+            request_headers['Range'] = f"bytes={offset}-"
+            validator = first_headers.get('ETag') or first_headers.get('Last-Modified')
+            if validator:
+                request_headers['If-Range'] = validator
+
+        try:
+            with session.get(url, headers=request_headers, stream=True, timeout=timeout) as response:
+                if response.status_code == 304:
+                    return None
+                response.raise_for_status()
+
+                skip = 0
+                if response.status_code == 206:
+                    start, expected_size = _parse_content_range(response.headers.get('Content-Range', ''))
+                    if start > offset:
+                        raise ValueError(f"Server resumed {url} at byte {start}, past the {offset} we have")
+                    skip = offset - start
+                else:
+                    if first_headers is not None and response.headers.get('ETag') != first_headers.get('ETag'):
+                        raise ValueError(f"{url} changed while it was being downloaded")
+                    if offset:
+                        print(f"  -> {url} doesn't support Range; skipping the {offset} bytes we already have")
+                    skip = offset
+                    length = response.headers.get('Content-Length')
+                    expected_size = int(length) if length and 'Content-Encoding' not in response.headers else None
+                first_headers = first_headers or response.headers
+
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    if skip:
+                        dropped = min(skip, len(chunk))
+                        chunk = chunk[dropped:]
+                        skip -= dropped
+                    if chunk:
+                        sink.write(chunk)
+
+            if expected_size is not None and sink.bytes_written != expected_size:
+                if sink.bytes_written > expected_size:
+                    raise ValueError(f"Got {sink.bytes_written} bytes of {url}, more than the {expected_size} announced")
+                raise IncompleteDownload(f"Got {sink.bytes_written} of {expected_size} bytes of {url}")
+            return first_headers
+
+        except Exception as e:
+            if not _is_retryable(e) or attempt + 1 == max_attempts:
+                raise
+            delay = backoff_delay(attempt, backoff, max_backoff)
+            print(f"  -> Attempt {attempt + 1}/{max_attempts} for {url} failed ({e}); "
+                  f"resuming from byte {sink.bytes_written} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def _parse_content_range(value):
+    # "bytes 1000-1999/5000" -> (1000, 5000); the total may be "*" when unknown
+    match = re.match(r'bytes (\d+)-\d+/(\d+|\*)', value)
+    if not match:
+        raise ValueError(f"Unexpected Content-Range: {value!r}")
+    total = match.group(2)
+    return int(match.group(1)), None if total == '*' else int(total)
+
+
+class FileSink:
+    """Write-only file sink that hashes and counts what goes through it, like S3StreamUploader."""
+
+    def __init__(self, path):
+        self.path = path
+        self.sha256 = hashlib.sha256()
+        self.bytes_written = 0
+        self._file = None
+
+    def write(self, data):
+        # Opened on first write, so a 304 leaves an existing copy untouched
+        if self._file is None:
+            self._file = open(self.path, 'wb')
+        self._file.write(data)
+        self.sha256.update(data)
+        self.bytes_written += len(data)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+        return self.bytes_written
+
+
+class DownloadEngine:
+    """Downloads a listing page's PDFs as one batch over a single pooled HTTP session.
+
+    download_fn(session, url, doc_index) does the actual transfer; the engine runs up to
+    max_workers of them at once and keeps every host under its request-rate cap.
+    """
+
+    def __init__(self, download_fn, max_workers, requests_per_second):
+        self.download_fn = download_fn
+        self.rate_limiter = HostRateLimiter(requests_per_second)
+
+        # One keep-alive connection per worker instead of a fresh connection per PDF
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+
+    def capture_session(self, page):
+        """Copies the browser's cookies and user agent onto the pooled session.
+
+        Playwright objects are not thread-safe, so this runs on the navigation thread.
+        """
+        self.session.cookies.update({cookie['name']: cookie['value'] for cookie in page.context.cookies()})
+        self.session.headers['User-Agent'] = page.evaluate("navigator.userAgent")
+
+    def submit_batch(self, page, jobs):
+        """Queues (url, doc_index) jobs for download and returns their futures right away."""
+        self.capture_session(page)
+        return [self._pool.submit(self._run, url, doc_index) for url, doc_index in jobs]
+
+    def _run(self, url, doc_index):
+        self.rate_limiter.wait(url)
+        return self.download_fn(self.session, url, doc_index)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+
+# A multipart object's metadata is fixed before its hash is known, so the SHA-256 of a streamed
+# multipart upload is stored next to it, in {key}.sha256, for the splitter's dedup index.
+SHA256_SIDECAR_SUFFIX = ".sha256"
+
+
+class S3StreamUploader:
+    """Write-only sink that streams bytes into S3 while they are still being downloaded.
+
+    Writes are buffered into part_size parts and handed to a background thread through a
+    small queue, so the next part downloads while the previous one uploads. Objects that never
+    fill a whole part go up with a single put_object instead of a multipart upload. Any extra
+    metadata is stored with the object.
+
+    S3 verifies what it receives against native SHA-256 checksums: of the whole object for a
+    put_object, of every part for a multipart upload. The SHA-256 of everything written is kept
+    in self.sha256 for the caller's records, and stored with the object: as "sha256" metadata for
+    a put_object, and for a multipart upload (whose metadata is fixed before the hash is known)
+    as the hex digest in a small {key}.sha256 object, written before the upload completes.
+    """
+
+    def __init__(self, s3, bucket, key, part_size=16 * 1024 ** 2, queue_depth=2, content_type='application/pdf',
+                 metadata=None):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.content_type = content_type
+        self.metadata = dict(metadata or {})
+        self.sha256 = hashlib.sha256()
+        self.bytes_written = 0
+
+        self._buffer = bytearray()
+        self._queue = queue.Queue(maxsize=queue_depth)
+        self._upload_id = None
+        self._parts = []
+        self._error = None
+        self._thread = None
+        self._sidecar_written = False
+
+    def write(self, data):
+        if self._error:
+            raise self._error
+
+        self.sha256.update(data)
+        self.bytes_written += len(data)
+        self._buffer.extend(data)
+
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            self._hand_off(part)
+
+    def _hand_off(self, part):
+        if self._upload_id is None:
+            self._upload_id = self.s3.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, ContentType=self.content_type, Metadata=self.metadata,
+                ChecksumAlgorithm='SHA256'
+            )['UploadId']
+            self._thread = threading.Thread(target=self._upload_parts, daemon=True)
+            self._thread.start()
+
+        # Blocks when the uploader falls behind, which bounds memory to queue_depth parts
+        self._queue.put(part)
+
+    def _upload_parts(self):
+        while True:
+            part = self._queue.get()
+            if part is None:
+                return
+            if self._error:
+                continue  # Keep draining so the downloading thread never blocks on a dead uploader
+
+            try:
+                part_number = len(self._parts) + 1
+                # S3 rejects the part if what arrived doesn't match
+                checksum = base64.b64encode(hashlib.sha256(part).digest()).decode('ascii')
+                response = self.s3.upload_part(
+                    Bucket=self.bucket, Key=self.key, UploadId=self._upload_id, PartNumber=part_number, Body=part,
+                    ChecksumSHA256=checksum
+                )
+                self._parts.append({'PartNumber': part_number, 'ETag': response['ETag'], 'ChecksumSHA256': checksum})
+            except Exception as e:
+                self._error = e
+
+    def close(self):
+        """Finishes the upload and returns the number of bytes stored."""
+        if self._upload_id is None:
+            self.s3.put_object(
+                Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer),
+                ContentType=self.content_type, Metadata=dict(self.metadata, sha256=self.sha256.hexdigest()),
+                ChecksumSHA256=base64.b64encode(self.sha256.digest()).decode('ascii')
+            )
+            return self.bytes_written
+
+        if self._buffer:
+            self._queue.put(bytes(self._buffer))
+            self._buffer = bytearray()
+        self._queue.put(None)
+        self._thread.join()
+        if self._error:
+            raise self._error
+
+        # Before the object exists, so whoever it notifies can already read its hash
+        self.s3.put_object(
+            Bucket=self.bucket, Key=self.key + SHA256_SIDECAR_SUFFIX, Body=self.sha256.hexdigest().encode('ascii'),
+            ContentType='text/plain'
+        )
+        self._sidecar_written = True
+        self.s3.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self._upload_id, MultipartUpload={'Parts': self._parts}
+        )
+        return self.bytes_written
+
+    def abort(self):
+        if self._upload_id is None:
+            return
+
+        if self._thread.is_alive():
+            self._error = self._error or Exception("Upload aborted")
+            self._queue.put(None)
+            self._thread.join()
+
+        try:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+            if self._sidecar_written:
+                self.s3.delete_object(Bucket=self.bucket, Key=self.key + SHA256_SIDECAR_SUFFIX)
+        except Exception as e:
+            print(f"  -> Failed to abort multipart upload for {self.key}: {str(e)}")
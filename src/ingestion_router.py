@@ -1,35 +1,139 @@
 import json
 import urllib.parse
 import os
+import re
+import time
+from datetime import datetime
 import boto3
+import gestalt_metrics as metrics  # From the GestaltCommon layer
 
 sqs = boto3.client('sqs')
+s3 = boto3.client('s3')
 SPLITTER_QUEUE_URL = os.environ.get('SPLITTER_QUEUE_URL')
 
+# Size tiers: PDFs up to FAST_PATH_MAX_BYTES go to the fast queue (the splitter Lambda), the
+# rest to the Fargate splitters. Without a fast queue everything goes to SPLITTER_QUEUE_URL.
+FAST_QUEUE_URL = os.environ.get('FAST_QUEUE_URL')
+FAST_PATH_MAX_BYTES = int(os.environ.get('ROUTER_FAST_PATH_MAX_BYTES', str(25 * 1024 ** 2)))
+
+# Only PDFs are worth splitting. Scraper bookkeeping (scraper_state.json, bad_pages.json,
+# debug_state_*.png) fails the include pattern, and the splitter's own records under its
+# state prefix are excluded explicitly. The stack hands both Lambdas the same prefix.
+STATE_PREFIX = os.environ.get('SPLITTER_STATE_PREFIX', '_gestalt/')
+INCLUDE_PATTERN = re.compile(os.environ.get('ROUTER_INCLUDE_PATTERN', r'\.pdf$'), re.IGNORECASE)
+EXCLUDE_PATTERN = re.compile(os.environ.get('ROUTER_EXCLUDE_PATTERN', '^' + re.escape(STATE_PREFIX)))
+
+# S3 events don't carry the content type, so checking it costs a HEAD per object; off by default.
+# Objects uploaded without an explicit type come back as binary/octet-stream.
+CHECK_CONTENT_TYPE = os.environ.get('ROUTER_CHECK_CONTENT_TYPE', '0') == '1'
+ALLOWED_CONTENT_TYPES = os.environ.get(
+    'ROUTER_ALLOWED_CONTENT_TYPES', 'application/pdf,binary/octet-stream,application/octet-stream'
+).split(',')
+
+# The scraper's trace (correlation ID, discovery time) rides in the object's user metadata,
+# which also costs a HEAD to read. Only objects that arrive from the scraper with their
+# metadata intact carry one, so it is read only when asked for; GestaltStack turns it on.
+READ_TRACE = os.environ.get('ROUTER_READ_TRACE', '0') == '1'
+
+MAX_SEND_ATTEMPTS = 3
+
+metrics.configure("router")
+
+def should_route(bucket_name, file_key):
+    """Returns (route, head). S3 events carry neither the content type nor the user metadata
+    the trace lives in, so one HEAD serves both; without either feature there's no HEAD at all."""
+    if not INCLUDE_PATTERN.search(file_key) or EXCLUDE_PATTERN.search(file_key):
+        return False, None
+
+    head = s3.head_object(Bucket=bucket_name, Key=file_key) if CHECK_CONTENT_TYPE or READ_TRACE else None
+
+    if CHECK_CONTENT_TYPE:
+        content_type = head.get('ContentType', '')
+        if content_type.split(';')[0].strip() not in ALLOWED_CONTENT_TYPES:
+            return False, head
+
+    return True, head
+
+def event_time(record):
+    # "2024-01-01T12:00:00.000Z"
+    return datetime.fromisoformat(record['eventTime'].replace('Z', '+00:00')).timestamp()
+
+def choose_tier(size):
+    """Objects of unknown size take the Fargate path, which can handle anything."""
+    if FAST_QUEUE_URL and size is not None and size <= FAST_PATH_MAX_BYTES:
+        return "fast"
+    return "fargate"
+
+def send_batch(queue_url, messages):
+    """Sends up to 10 message bodies in one call, retrying only the entries that failed."""
+    entries = {str(i): body for i, body in enumerate(messages)}
+
+    for attempt in range(MAX_SEND_ATTEMPTS):
+        response = sqs.send_message_batch(
+            QueueUrl=queue_url,
+            Entries=[{'Id': entry_id, 'MessageBody': body} for entry_id, body in entries.items()]
+        )
+        entries = {failure['Id']: entries[failure['Id']] for failure in response.get('Failed', [])}
+        if not entries:
+            return
+
+        print(f"{len(entries)} message(s) failed on attempt {attempt + 1}, retrying...")
+        time.sleep(0.1 * 2 ** attempt)
+
+    raise Exception(f"Failed to route {len(entries)} message(s) after {MAX_SEND_ATTEMPTS} attempts")
+
 def handler(event, context):
     print("Incoming S3 Event detected!")
-    
+
+    messages = {"fast": [], "fargate": []}
+    skipped = 0
     for record in event.get('Records', []):
         bucket_name = record['s3']['bucket']['name']
         file_key = urllib.parse.unquote_plus(record['s3']['object']['key'])
-        
-        message_body = json.dumps({
+
+        route, head = should_route(bucket_name, file_key)
+        if not route:
+            print(f"Skipping '{file_key}'.")
+            skipped += 1
+            continue
+
+        trace = metrics.trace_from_metadata(head.get('Metadata', {})) if head else {}
+        if 'eventTime' in record:
+            metrics.put_latency("RouteLag", event_time(record), trace.get("correlation_id"), key=file_key)
+
+        size = record['s3']['object'].get('size')
+        if size is None and head:
+            size = head.get('ContentLength')
+        tier = choose_tier(size)
+
+        # The size lets workers make sizing decisions without a HEAD request
+        messages[tier].append(json.dumps({
             "bucket": bucket_name,
-            "key": file_key
-        })
-
-        # Everything goes to the Splitter Queue now
-        try:
-            print(f"Routing '{file_key}' to the Splitter Queue...")
-            sqs.send_message(
-                QueueUrl=SPLITTER_QUEUE_URL,
-                MessageBody=message_body
-            )
-        except Exception as e:
-            print(f"Error routing file {file_key}: {str(e)}")
-            raise e
+            "key": file_key,
+            "size": size,
+            "correlation_id": trace.get("correlation_id"),
+            "discovered_at": trace.get("discovered_at"),
+            "routed_at": time.time()
+        }))
+
+    # Each tier's queue gets its files 10 messages per request
+    queue_urls = {"fast": FAST_QUEUE_URL, "fargate": SPLITTER_QUEUE_URL}
+    for tier, tier_messages in messages.items():
+        queue_url = queue_urls[tier]
+        for i in range(0, len(tier_messages), 10):
+            batch = tier_messages[i:i + 10]
+            try:
+                print(f"Routing {len(batch)} file(s) to the {tier} tier...")
+                send_batch(queue_url, batch)
+            except Exception as e:
+                print(f"Error routing files: {str(e)}")
+                raise e
+        metrics.put_metric("FilesRouted", len(tier_messages), tier=tier)
+
+    metrics.put_metric("FilesSkipped", skipped)
 
+    routed = sum(len(tier_messages) for tier_messages in messages.values())
     return {
         'statusCode': 200,
-        'body': json.dumps('Routed to Splitter.')
-    }
\ No newline at end of file
+        'body': json.dumps(f'Routed {routed} file(s) to Splitter ({len(messages["fast"])} fast), skipped {skipped}.')
+    }
@@ -0,0 +1,71 @@
+import os
+import sys
+
+import boto3
+import pytest
+from moto import mock_aws
+
+# The worker, scraper and Lambda code are flat scripts that import each other by module name,
+# the way they run in their containers
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+for directory in ("worker", "scraper", "src", os.path.join("common", "python")):
+    sys.path.insert(0, os.path.join(REPO_ROOT, directory))
+
+# They also build their boto3 clients at import time, which needs a region
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    """An S3 client against moto's in-memory S3, with one empty bucket: "bucket1"."""
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_SESSION_TOKEN"):
+        monkeypatch.setenv(name, "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+
+    with mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket='bucket1')
+        yield client
+
+
+@pytest.fixture
+def make_pdf():
+    """Builds a PDF in memory. Each page is {"text": ..., "image": (r, g, b), "image_rect": (x0, y0, x1, y1)},
+    every key optional; the image is a solid colour drawn over image_rect (default: the lower half)."""
+    import fitz
+
+    def build(pages):
+        doc = fitz.open()
+        for spec in pages:
+            page = doc.new_page()
+            if spec.get("text"):
+                page.insert_textbox(fitz.Rect(36, 36, 576, 396), spec["text"], fontsize=4)
+            if spec.get("image"):
+                pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 64, 64), False)
+                pix.set_rect(pix.irect, spec["image"])
+                page.insert_image(fitz.Rect(*spec.get("image_rect", (36, 400, 576, 756))), pixmap=pix)
+        data = doc.tobytes()
+        doc.close()
+        return data
+
+    return build
+
+
+@pytest.fixture
+def splitter(s3, monkeypatch):
+    """The splitter module on moto's S3, with the optional indexes and caches off.
+
+    Tests turn on what they exercise by setting the module attribute.
+    """
+    import splitter
+    from image_cache import ImageDedupCache
+    from image_pipeline import ImagePipeline
+
+    monkeypatch.setattr(splitter, "s3", s3)
+    for name in ("dedup_index", "neardup_index", "neardup_sync", "search_index", "search_publisher", "source_cache"):
+        monkeypatch.setattr(splitter, name, None)
+    monkeypatch.setattr(splitter, "image_cache", ImageDedupCache(1000))
+    pipeline = ImagePipeline(2, 16 * 1024 ** 2, s3, "page-images/")
+    monkeypatch.setattr(splitter, "image_pipeline", pipeline)
+    yield splitter
+    pipeline.shutdown()
@@ -0,0 +1,52 @@
+import pytest
+
+import artifact
+from artifact import ArtifactWriter, read_header, read_page
+
+
+def page(page_num, text, images=()):
+    return {"page_num": page_num, "class": "text", "text": text, "images": list(images)}
+
+
+def upload_artifact(s3, pages, key="artifacts/a.pdf.gsta"):
+    writer = ArtifactWriter("bucket1", "a.pdf", 0, len(pages))
+    for result in pages:
+        writer.add_page(result)
+    writer.near_duplicate_of = {"bucket": "bucket1", "key": "b.pdf", "similarity": 0.9}
+    writer.upload(s3, "bucket1", key)
+    return key
+
+
+def test_header_and_pages_round_trip(s3):
+    image = {"index": 0, "xref": 12, "ext": "png", "sha256": "ab" * 32, "key": "images/ab.webp", "format": "webp"}
+    key = upload_artifact(s3, [page(0, "first page", [image]), page(1, "second page")])
+
+    header, data_start = read_header(s3, "bucket1", key)
+    assert header["source"] == {"bucket": "bucket1", "key": "a.pdf"}
+    assert (header["page_start"], header["page_end"]) == (0, 2)
+    assert header["near_duplicate_of"]["key"] == "b.pdf"
+    assert [entry[0] for entry in header["pages"]] == [0, 1]
+
+    second = read_page(s3, "bucket1", key, 1, header=(header, data_start))
+    assert second["text"] == "second page"
+    first = read_page(s3, "bucket1", key, 0)
+    assert first["images"] == [image]
+
+
+def test_a_header_larger_than_the_probe_takes_a_second_read(s3, monkeypatch):
+    key = upload_artifact(s3, [page(n, f"page {n}") for n in range(50)])
+    monkeypatch.setattr(artifact, "HEADER_PROBE_BYTES", 32)
+
+    header, _ = read_header(s3, "bucket1", key)
+    assert len(header["pages"]) == 50
+    assert read_page(s3, "bucket1", key, 49)["text"] == "page 49"
+
+
+def test_missing_pages_and_foreign_objects_are_rejected(s3):
+    key = upload_artifact(s3, [page(0, "only page")])
+    with pytest.raises(KeyError):
+        read_page(s3, "bucket1", key, 5)
+
+    s3.put_object(Bucket="bucket1", Key="a.pdf", Body=b"%PDF-1.7 not an artifact")
+    with pytest.raises(ValueError):
+        read_header(s3, "bucket1", "a.pdf")
@@ -0,0 +1,141 @@
+import threading
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import boto3
+import pytest
+
+import consumer
+
+
+class FakeSQS:
+    """Hands out canned receive_message batches and records every call."""
+
+    def __init__(self, *batches, on_receive=None):
+        self.batches = list(batches)
+        self.on_receive = on_receive
+        self.deleted = []
+        self.visibility_changes = []
+
+    def receive_message(self, **kwargs):
+        if self.on_receive:
+            self.on_receive()
+        return {'Messages': self.batches.pop(0)} if self.batches else {}
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        self.deleted.append([entry['Id'] for entry in Entries])
+        return {}
+
+    def change_message_visibility_batch(self, QueueUrl, Entries):
+        self.visibility_changes.append(Entries)
+        return {}
+
+
+class FakePool:
+    """Runs each message at once; a message whose body is "crash" takes the pool down like a dead worker."""
+
+    created = 0
+
+    def __init__(self):
+        FakePool.created += 1
+        self.shut_down = False
+
+    def submit(self, fn, message):
+        future = Future()
+        if message['Body'] == "crash":
+            future.set_exception(BrokenProcessPool("a worker died"))
+        else:
+            future.set_result(message['Body'] == "ok")
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shut_down = True
+
+
+def message(message_id, body="ok"):
+    return {'MessageId': message_id, 'ReceiptHandle': f"handle-{message_id}", 'Body': body}
+
+
+def test_chunked():
+    assert consumer.chunked([1, 2, 3, 4, 5], 2) == [[1, 2], [3, 4], [5]]
+    assert consumer.chunked([], 10) == []
+
+
+def test_delete_messages_goes_in_batches_of_ten(s3, monkeypatch):
+    sqs = boto3.client('sqs', region_name='us-east-1')
+    queue_url = sqs.create_queue(QueueName="splitter")['QueueUrl']
+    for i in range(12):
+        sqs.send_message(QueueUrl=queue_url, MessageBody=str(i))
+    received = []
+    while len(received) < 12:
+        received.extend(sqs.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=10)['Messages'])
+    monkeypatch.setattr(consumer, "sqs", sqs)
+    monkeypatch.setattr(consumer, "QUEUE_URL", queue_url)
+
+    consumer.delete_messages(received)
+
+    attributes = sqs.get_queue_attributes(QueueUrl=queue_url, AttributeNames=['All'])['Attributes']
+    assert attributes['ApproximateNumberOfMessages'] == attributes['ApproximateNumberOfMessagesNotVisible'] == '0'
+
+
+def test_the_heartbeat_extends_only_the_messages_in_flight(monkeypatch):
+    sqs = FakeSQS()
+    monkeypatch.setattr(consumer, "sqs", sqs)
+    heartbeat = consumer.VisibilityHeartbeat(0.01, 900)
+    heartbeat.track(message("a"))
+    heartbeat.track(message("b"))
+    heartbeat.untrack(message("a"))
+    heartbeat.start()
+    try:
+        for _ in range(200):
+            if sqs.visibility_changes:
+                break
+            threading.Event().wait(0.01)
+    finally:
+        heartbeat.stop()
+
+    assert sqs.visibility_changes[0] == [{'Id': "b", 'ReceiptHandle': "handle-b", 'VisibilityTimeout': 900}]
+
+
+def test_a_dead_worker_fails_its_messages_and_the_pool_is_rebuilt(monkeypatch):
+    stop = threading.Event()
+    sqs = FakeSQS([message("1"), message("2", "crash"), message("3", "failed")], on_receive=stop.set)
+    monkeypatch.setattr(consumer, "sqs", sqs)
+    monkeypatch.setattr(consumer, "new_document_pool", FakePool)
+    monkeypatch.setattr(consumer, "MAX_WORKERS", 4)
+    FakePool.created = 0
+
+    consumer.poll_queue_batched(stop)
+
+    # Only the message that succeeded is deleted; the others go back to the queue
+    assert sqs.deleted == [["1"]]
+    assert FakePool.created == 2
+
+
+@pytest.mark.parametrize("cpus, max_workers, configured, expected", [
+    (8, 8, "4", 1),
+    (8, 2, "4", 4),
+    (8, 2, "8", 4),
+    (8, 2, None, 1),
+    (2, 4, "2", 1),
+])
+def test_page_workers_are_capped_at_each_documents_share_of_the_cpus(cpus, max_workers, configured, expected,
+                                                                     monkeypatch):
+    monkeypatch.setattr(consumer.os, "cpu_count", lambda: cpus)
+    monkeypatch.setattr(consumer, "MAX_WORKERS", max_workers)
+    if configured is None:
+        monkeypatch.delenv("SPLITTER_PAGE_WORKERS", raising=False)
+    else:
+        monkeypatch.setenv("SPLITTER_PAGE_WORKERS", configured)
+
+    assert consumer.page_workers_per_document() == expected
+
+
+def test_batch_mode_refuses_a_per_process_dedup_index(monkeypatch):
+    monkeypatch.setattr(consumer, "QUEUE_URL", "https://queue")
+    monkeypatch.setattr(consumer, "CONSUMER_MODE", "batch")
+    monkeypatch.setattr(consumer, "MAX_WORKERS", 2)
+    monkeypatch.setenv("SPLITTER_DEDUP_BACKEND", "memory")
+
+    with pytest.raises(SystemExit):
+        consumer.main()
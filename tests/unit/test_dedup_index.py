@@ -0,0 +1,136 @@
+import sqlite3
+
+import pytest
+
+from dedup_index import ClaimPending, MemoryDedupIndex, SQLiteDedupIndex, S3DedupIndex, open_dedup_index
+
+
+def open_index(backend, request, tmp_path, claim_seconds=3600):
+    if backend == "s3":
+        return S3DedupIndex(request.getfixturevalue("s3"), "bucket1", claim_seconds=claim_seconds)
+    return open_dedup_index(backend, path=str(tmp_path / "dedup.db"), claim_seconds=claim_seconds)
+
+
+@pytest.fixture(params=["memory", "sqlite", "s3"])
+def dedup(request, tmp_path):
+    return open_index(request.param, request, tmp_path)
+
+
+@pytest.fixture(params=["memory", "sqlite", "s3"])
+def expiring_dedup(request, tmp_path):
+    """An index whose pending claims expire at once, as if every holder had died."""
+    return open_index(request.param, request, tmp_path, claim_seconds=-1)
+
+
+def test_first_claim_is_canonical_and_reclaiming_it_is_idempotent(dedup):
+    assert dedup.claim("h1", "bucket1", "a.pdf") is None
+    assert dedup.claim("h1", "bucket1", "a.pdf") is None
+    assert dedup.aliases("h1") == []
+
+
+def test_a_copy_under_another_key_is_an_alias_recorded_once(dedup):
+    dedup.claim("h1", "bucket1", "a.pdf")
+    dedup.commit("h1", "bucket1", "a.pdf")
+
+    assert dedup.claim("h1", "bucket1", "copy.pdf") == {"bucket": "bucket1", "key": "a.pdf"}
+    assert dedup.claim("h1", "bucket1", "copy.pdf") == {"bucket": "bucket1", "key": "a.pdf"}
+    assert dedup.aliases("h1") == [{"bucket": "bucket1", "key": "copy.pdf"}]
+    # Other content is unaffected
+    assert dedup.claim("h2", "bucket1", "copy.pdf") is None
+
+
+def test_a_copy_waits_while_the_first_claim_is_pending(dedup):
+    dedup.claim("h1", "bucket1", "a.pdf")
+
+    with pytest.raises(ClaimPending):
+        dedup.claim("h1", "bucket1", "copy.pdf")
+    assert dedup.aliases("h1") == []
+
+
+def test_a_released_claim_can_be_taken_by_a_copy(dedup):
+    dedup.claim("h1", "bucket1", "a.pdf")
+    dedup.release("h1", "bucket1", "a.pdf")
+
+    assert dedup.claim("h1", "bucket1", "copy.pdf") is None
+    dedup.commit("h1", "bucket1", "copy.pdf")
+    assert dedup.claim("h1", "bucket1", "a.pdf") == {"bucket": "bucket1", "key": "copy.pdf"}
+
+
+def test_only_the_holder_can_commit_or_release_and_committed_claims_stay(dedup):
+    dedup.claim("h1", "bucket1", "a.pdf")
+    dedup.release("h1", "bucket1", "copy.pdf")
+    dedup.commit("h1", "bucket1", "a.pdf")
+    dedup.release("h1", "bucket1", "a.pdf")
+
+    assert dedup.claim("h1", "bucket1", "copy.pdf") == {"bucket": "bucket1", "key": "a.pdf"}
+
+
+def test_an_expired_pending_claim_is_taken_over(expiring_dedup):
+    expiring_dedup.claim("h1", "bucket1", "a.pdf")
+
+    assert expiring_dedup.claim("h1", "bucket1", "copy.pdf") is None
+    # The first holder coming back late no longer owns the hash
+    expiring_dedup.commit("h1", "bucket1", "a.pdf")
+    expiring_dedup.commit("h1", "bucket1", "copy.pdf")
+    assert expiring_dedup.claim("h1", "bucket1", "a.pdf") == {"bucket": "bucket1", "key": "copy.pdf"}
+
+
+def test_sqlite_index_survives_a_restart(tmp_path):
+    path = str(tmp_path / "dedup.db")
+    index = SQLiteDedupIndex(path)
+    index.claim("h1", "bucket1", "a.pdf")
+    index.commit("h1", "bucket1", "a.pdf")
+
+    reopened = SQLiteDedupIndex(path)
+    assert reopened.claim("h1", "bucket1", "b.pdf") == {"bucket": "bucket1", "key": "a.pdf"}
+    assert reopened.aliases("h1") == [{"bucket": "bucket1", "key": "b.pdf"}]
+
+
+def test_sqlite_rows_from_before_pending_claims_count_as_committed(tmp_path):
+    path = str(tmp_path / "dedup.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE documents (content_hash TEXT PRIMARY KEY, bucket TEXT, key TEXT, first_seen REAL)")
+        conn.execute("INSERT INTO documents VALUES ('h1', 'bucket1', 'a.pdf', 0)")
+
+    assert SQLiteDedupIndex(path).claim("h1", "bucket1", "b.pdf") == {"bucket": "bucket1", "key": "a.pdf"}
+
+
+def test_s3_index_defaults_to_the_documents_bucket(s3):
+    dedup = S3DedupIndex(s3)
+    dedup.claim("h1", "bucket1", "a.pdf")
+    dedup.commit("h1", "bucket1", "a.pdf")
+
+    assert s3.get_object(Bucket="bucket1", Key="dedup/h1.json")["Body"].read()
+    assert dedup.claim("h1", "bucket1", "b.pdf") == {"bucket": "bucket1", "key": "a.pdf"}
+    assert dedup.aliases("h1", bucket="bucket1") == [{"bucket": "bucket1", "key": "b.pdf"}]
+
+
+def test_open_dedup_index_backends(tmp_path):
+    assert open_dedup_index("none") is None
+    assert open_dedup_index("") is None
+    assert isinstance(open_dedup_index("memory"), MemoryDedupIndex)
+    with pytest.raises(ValueError):
+        open_dedup_index("redis")
+
+
+def test_a_document_that_fails_hands_its_hash_to_the_next_copy(splitter, make_pdf, s3, monkeypatch):
+    monkeypatch.setattr(splitter, "dedup_index", MemoryDedupIndex())
+    data = make_pdf([{"text": "the same document twice"}])
+    s3.put_object(Bucket="bucket1", Key="a.pdf", Body=data)
+    s3.put_object(Bucket="bucket1", Key="copy.pdf", Body=data)
+
+    process_pdf = splitter.process_pdf
+
+    def fail_once(*args, **kwargs):
+        monkeypatch.setattr(splitter, "process_pdf", process_pdf)
+        raise RuntimeError("MuPDF gave up")
+
+    monkeypatch.setattr(splitter, "process_pdf", fail_once)
+    with pytest.raises(RuntimeError):
+        splitter.download_and_process("bucket1", "a.pdf")
+
+    # The copy is processed rather than skipped in favour of the failed document
+    splitter.download_and_process("bucket1", "copy.pdf")
+    assert s3.head_object(Bucket="bucket1", Key=splitter.artifact_key("copy.pdf"))
+    splitter.download_and_process("bucket1", "a.pdf")
+    assert splitter.dedup_index.aliases(splitter.local_content_hash(data)) == [{"bucket": "bucket1", "key": "a.pdf"}]
@@ -0,0 +1,110 @@
+import fitz
+import pytest
+
+import extraction
+from extraction import classify_page, extract_page, iter_pages_parallel, open_pdf
+
+LETTER = fitz.Rect(0, 0, 612, 792)
+PARAGRAPH = "Some native text on the page, long enough to count as a real text layer. " * 2
+LOGO = (36, 700, 86, 750)
+
+
+def serial_pages(source):
+    xref_memo = {}
+    with open_pdf(source) as doc:
+        return [extract_page(doc, page_num, xref_memo) for page_num in range(len(doc))]
+
+
+def summary(pages):
+    return [(page["page_num"], page["text"], [image["sha256"] for image in page["images"]]) for page in pages]
+
+
+def test_parallel_extraction_yields_the_serial_pages_in_order(make_pdf):
+    source = make_pdf([{"text": f"page {i}", "image": (i * 20, 0, 0)} for i in range(7)])
+
+    pages = list(iter_pages_parallel(source, 0, 7, workers=2, chunk_size=2))
+
+    assert summary(pages) == summary(serial_pages(source))
+
+
+def test_parallel_extraction_covers_just_the_requested_range(make_pdf, tmp_path):
+    path = tmp_path / "doc.pdf"
+    path.write_bytes(make_pdf([{"text": f"page {i}"} for i in range(9)]))
+
+    pages = list(iter_pages_parallel(str(path), 2, 7, workers=3, chunk_size=2, skip_images=True))
+
+    assert [page["page_num"] for page in pages] == [2, 3, 4, 5, 6]
+    assert [page["text"].strip() for page in pages] == [f"page {i}" for i in range(2, 7)]
+
+
+class PageCollector:
+    """Stands in for the ArtifactWriter and keeps the page numbers it is handed."""
+
+    def __init__(self):
+        self.pages = []
+
+    def add_page(self, result):
+        self.pages.append(result["page_num"])
+
+
+def test_large_documents_take_the_parallel_path_in_process_pdf(splitter, make_pdf, monkeypatch):
+    calls = []
+
+    def recording(*args, **kwargs):
+        calls.append(args[1:5])
+        return extraction.iter_pages_parallel(*args, **kwargs)
+
+    monkeypatch.setattr(splitter, "iter_pages_parallel", recording)
+    monkeypatch.setattr(splitter, "PAGE_WORKERS", 2)
+    monkeypatch.setattr(splitter, "PARALLEL_PAGE_THRESHOLD", 4)
+    monkeypatch.setattr(splitter, "PAGE_CHUNK_SIZE", 2)
+    source = make_pdf([{"text": f"page {i}"} for i in range(5)])
+
+    small = PageCollector()
+    splitter.process_pdf(source, 0, 3, artifact=small)
+    assert calls == []
+    assert small.pages == [0, 1, 2]
+
+    large = PageCollector()
+    splitter.process_pdf(source, artifact=large)
+    assert calls == [(0, 5, 2, 2)]
+    assert large.pages == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.parametrize("text, boxes, expected", [
+    (PARAGRAPH, [], "text"),
+    ("", [], "text"),
+    # A logo and a signature on a text page
+    (PARAGRAPH, [LOGO, (400, 700, 500, 750)], "text"),
+    ("", [(0, 0, 612, 792)], "scanned"),
+    ("Page 3", [(0, 0, 612, 792)], "scanned"),
+    (PARAGRAPH, [(36, 400, 576, 756)], "mixed"),
+    # Small, but too many of them to be decoration
+    (PARAGRAPH, [LOGO, LOGO, LOGO], "mixed"),
+])
+def test_classify_page(text, boxes, expected):
+    assert classify_page(LETTER, text, boxes) == expected
+
+
+def test_images_are_only_decoded_on_scanned_and_mixed_pages(make_pdf):
+    source = make_pdf([
+        {"text": PARAGRAPH, "image": (255, 0, 0), "image_rect": LOGO},
+        {"image": (0, 255, 0), "image_rect": (0, 0, 612, 792)},
+        {"text": PARAGRAPH, "image": (0, 0, 255)},
+    ])
+
+    text, scanned, mixed = serial_pages(source)
+
+    assert (text["class"], text["images"], text["images_skipped"], text["decoded"]) == ("text", [], 1, 0)
+    assert (scanned["class"], len(scanned["images"]), scanned["decoded"]) == ("scanned", 1, 1)
+    assert (mixed["class"], len(mixed["images"]), mixed["decoded"]) == ("mixed", 1, 1)
+    assert text["text"].split()[:3] == PARAGRAPH.split()[:3]
+
+
+def test_without_classification_every_page_has_its_images_decoded(make_pdf, monkeypatch):
+    monkeypatch.setattr(extraction, "CLASSIFY_PAGES", False)
+
+    [page] = serial_pages(make_pdf([{"text": PARAGRAPH, "image": (255, 0, 0), "image_rect": LOGO}]))
+
+    assert page["class"] is None
+    assert len(page["images"]) == page["decoded"] == 1
@@ -0,0 +1,90 @@
+import json
+
+import boto3
+import pytest
+
+from source_cache import SourceCache
+
+
+@pytest.fixture
+def fanout(splitter, monkeypatch):
+    """The splitter with a real (moto) queue to fan out onto and small fan-out thresholds."""
+    sqs = boto3.client('sqs', region_name='us-east-1')
+    monkeypatch.setattr(splitter, "sqs", sqs)
+    monkeypatch.setattr(splitter, "QUEUE_URL", sqs.create_queue(QueueName="splitter")['QueueUrl'])
+    monkeypatch.setattr(splitter, "FANOUT_PAGE_THRESHOLD", 4)
+    monkeypatch.setattr(splitter, "FANOUT_SIZE_THRESHOLD", 0)
+    monkeypatch.setattr(splitter, "FANOUT_SHARD_PAGES", 2)
+    return splitter
+
+
+def queued(splitter):
+    bodies = []
+    while True:
+        messages = splitter.sqs.receive_message(QueueUrl=splitter.QUEUE_URL, MaxNumberOfMessages=10).get('Messages', [])
+        if not messages:
+            return bodies
+        bodies.extend(json.loads(message['Body']) for message in messages)
+        for message in messages:
+            splitter.sqs.delete_message(QueueUrl=splitter.QUEUE_URL, ReceiptHandle=message['ReceiptHandle'])
+
+
+def test_plan_shards_only_fans_out_documents_over_a_threshold(fanout, make_pdf):
+    assert fanout.plan_shards(make_pdf([{"text": "page"}] * 4), 100) == []
+    assert fanout.plan_shards(make_pdf([{"text": "page"}] * 5), 100) == [(0, 2), (2, 4), (4, 5)]
+
+
+def test_plan_shards_cuts_oversized_documents_by_size_too(fanout, make_pdf, monkeypatch):
+    monkeypatch.setattr(fanout, "FANOUT_PAGE_THRESHOLD", 0)
+    monkeypatch.setattr(fanout, "FANOUT_SIZE_THRESHOLD", 1000)
+    monkeypatch.setattr(fanout, "FANOUT_SHARD_PAGES", 250)
+    document = make_pdf([{"text": "page"}] * 4)
+
+    assert fanout.plan_shards(document, 1000) == []
+    # Three times over the limit: at least three shards, even though the page count is tiny
+    assert fanout.plan_shards(document, 3000) == [(0, 2), (2, 4)]
+    assert fanout.plan_shards(make_pdf([{"text": "page"}] * 9), 3000) == [(0, 3), (3, 6), (6, 9)]
+
+
+def test_a_large_document_goes_back_on_the_queue_as_shards_with_its_trace(fanout, make_pdf, s3):
+    s3.put_object(Bucket="bucket1", Key="big.pdf", Body=make_pdf([{"text": f"page {i}"} for i in range(5)]))
+
+    fanout.download_and_process("bucket1", "big.pdf", trace={"correlation_id": "c1"})
+
+    shards = queued(fanout)
+    assert [(shard["page_start"], shard["page_end"]) for shard in shards] == [(0, 2), (2, 4), (4, 5)]
+    assert {shard["correlation_id"] for shard in shards} == {"c1"}
+    manifest = json.loads(s3.get_object(Bucket="bucket1", Key=fanout.shard_prefix("big.pdf") + "manifest.json")["Body"].read())
+    assert manifest["shards"] == [[0, 2], [2, 4], [4, 5]]
+    # Nothing was extracted from the parent itself
+    assert s3.list_objects_v2(Bucket="bucket1", Prefix=fanout.ARTIFACT_PREFIX)["KeyCount"] == 0
+
+
+def test_the_last_shard_to_finish_completes_the_document(fanout, s3):
+    fanout.enqueue_shards("bucket1", "big.pdf", [(0, 2), (2, 4), (4, 5)])
+    complete = fanout.shard_prefix("big.pdf") + "complete.json"
+
+    assert fanout.record_shard_complete("bucket1", "big.pdf", 2, 4) is False
+    assert fanout.record_shard_complete("bucket1", "big.pdf", 0, 2) is False
+    # A redelivered shard doesn't count twice
+    assert fanout.record_shard_complete("bucket1", "big.pdf", 0, 2) is False
+    assert s3.list_objects_v2(Bucket="bucket1", Prefix=complete)["KeyCount"] == 0
+
+    assert fanout.record_shard_complete("bucket1", "big.pdf", 4, 5) is True
+    assert json.loads(s3.get_object(Bucket="bucket1", Key=complete)["Body"].read())["shards"] == 3
+
+
+def test_shards_share_the_cached_source_until_the_last_one_is_done(fanout, make_pdf, s3, tmp_path, monkeypatch):
+    from artifact import read_header
+
+    cache = SourceCache(str(tmp_path), 10 * 1024 ** 2)
+    monkeypatch.setattr(fanout, "source_cache", cache)
+    s3.put_object(Bucket="bucket1", Key="big.pdf", Body=make_pdf([{"text": f"page {i}"} for i in range(5)]))
+    fanout.download_and_process("bucket1", "big.pdf")
+
+    for shard in queued(fanout):
+        fanout.download_and_process("bucket1", "big.pdf", shard["page_start"], shard["page_end"])
+        header, _ = read_header(s3, "bucket1", fanout.artifact_key("big.pdf", shard["page_start"], shard["page_end"]))
+        assert [page for page, _, _ in header["pages"]] == list(range(shard["page_start"], shard["page_end"]))
+
+    assert [name for name in tmp_path.iterdir() if name.suffix == ".pdf"] == []
@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+import gestalt_metrics as metrics
+
+
+@pytest.fixture
+def emitted(capsys, monkeypatch):
+    """Reads back the EMF records written so far, one per stdout line."""
+    monkeypatch.setattr(metrics, "ENABLED", True)
+    monkeypatch.setattr(metrics, "_service", "splitter")
+
+    def read():
+        return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+    return read
+
+
+def test_put_metric_writes_one_emf_record(emitted):
+    metrics.put_metric("ImagesExtracted", 3, correlation_id="c1", key="a.pdf", page_start=None)
+
+    [record] = emitted()
+    directive = record["_aws"]["CloudWatchMetrics"][0]
+    assert directive == {"Namespace": "Gestalt", "Dimensions": [["Service"]],
+                         "Metrics": [{"Name": "ImagesExtracted", "Unit": "Count"}]}
+    assert isinstance(record["_aws"]["Timestamp"], int)
+    assert {key: value for key, value in record.items() if key != "_aws"} == {
+        "Service": "splitter", "ImagesExtracted": 3, "correlation_id": "c1", "key": "a.pdf", "page_start": None
+    }
+
+
+def test_untraced_metrics_carry_no_correlation_id(emitted):
+    metrics.put_metric("FilesSkipped", 0)
+    assert "correlation_id" not in emitted()[0]
+
+
+def test_timer_reports_milliseconds_and_the_outcome(emitted):
+    with metrics.timer("DownloadTime", "c1", key="a.pdf"):
+        pass
+    with pytest.raises(ValueError):
+        with metrics.timer("ExtractionTime", "c1"):
+            raise ValueError("bad PDF")
+
+    ok, error = emitted()
+    assert ok["_aws"]["CloudWatchMetrics"][0]["Metrics"] == [{"Name": "DownloadTime", "Unit": "Milliseconds"}]
+    assert (ok["outcome"], ok["key"]) == ("ok", "a.pdf")
+    assert ok["DownloadTime"] >= 0
+    assert error["outcome"] == "error"
+
+
+def test_put_latency_measures_from_an_epoch_and_skips_untraced_documents(emitted, monkeypatch):
+    monkeypatch.setattr(metrics.time, "time", lambda: 1000.0)
+    metrics.put_latency("EndToEndLatency", 998.5, "c1")
+    metrics.put_latency("EndToEndLatency", None, "c1")
+
+    [record] = emitted()
+    assert record["EndToEndLatency"] == 1500.0
+    assert record["_aws"]["CloudWatchMetrics"][0]["Metrics"][0]["Unit"] == "Milliseconds"
+
+
+def test_disabled_metrics_write_nothing(emitted, monkeypatch):
+    monkeypatch.setattr(metrics, "ENABLED", False)
+    metrics.put_metric("FilesRouted", 1)
+    with metrics.timer("DownloadTime"):
+        pass
+    metrics.put_latency("QueueWaitTime", 1.0)
+
+    assert emitted() == []
+
+
+def test_the_trace_survives_s3_metadata(s3):
+    s3.put_object(Bucket="bucket1", Key="a.pdf", Body=b"%PDF", Metadata=metrics.trace_metadata("c1", 1767268800.25))
+
+    metadata = s3.head_object(Bucket="bucket1", Key="a.pdf")["Metadata"]
+    assert metrics.trace_from_metadata(metadata) == {"correlation_id": "c1", "discovered_at": 1767268800.25}
+    assert metrics.trace_from_metadata({}) == {"correlation_id": None, "discovered_at": None}
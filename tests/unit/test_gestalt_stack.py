@@ -13,3 +13,153 @@ def test_sqs_queue_created():
 #     template.has_resource_properties("AWS::SQS::Queue", {
 #         "VisibilityTimeout": 300
 #     })
+
+
+def splitter_template(context=None):
+    app = core.App(context=context)
+    stack = GestaltStack(app, "gestalt")
+    return assertions.Template.from_stack(stack)
+
+
+def test_splitter_service_starts_at_zero_in_batch_mode():
+    template = splitter_template()
+
+    template.has_resource_properties("AWS::ECS::Service", {
+        "DesiredCount": 0,
+        "NetworkConfiguration": {"AwsvpcConfiguration": {"AssignPublicIp": "ENABLED"}}
+    })
+    template.has_resource_properties("AWS::ECS::TaskDefinition", {
+        "Cpu": "2048",
+        "Memory": "4096",
+        "ContainerDefinitions": [assertions.Match.object_like({
+            "Name": "SplitterContainer",
+            "Environment": assertions.Match.array_with([
+                {"Name": "SPLITTER_CONSUMER_MODE", "Value": "batch"},
+                {"Name": "SPLITTER_SEARCH_INDEX_BUCKET", "Value": {"Ref": assertions.Match.string_like_regexp("GestaltRawDataBucket")}}
+            ])
+        })]
+    })
+
+
+def test_splitter_size_comes_from_context():
+    template = splitter_template({"splitterCpu": 4096, "splitterMemoryMiB": 8192, "splitterMaxTasks": 25})
+
+    template.has_resource_properties("AWS::ECS::TaskDefinition", {
+        "Cpu": "4096",
+        "Memory": "8192",
+        "ContainerDefinitions": [assertions.Match.object_like({"Name": "SplitterContainer"})]
+    })
+    template.has_resource_properties("AWS::ApplicationAutoScaling::ScalableTarget", {
+        "MinCapacity": 0,
+        "MaxCapacity": 25
+    })
+
+
+def test_splitter_scales_out_on_backlog_and_message_age():
+    template = splitter_template()
+
+    template.has_resource_properties("AWS::CloudWatch::Alarm", {
+        "MetricName": "ApproximateNumberOfMessagesVisible",
+        "ComparisonOperator": "GreaterThanOrEqualToThreshold",
+        "Threshold": 1
+    })
+    template.has_resource_properties("AWS::CloudWatch::Alarm", {
+        "MetricName": "ApproximateAgeOfOldestMessage",
+        "ComparisonOperator": "GreaterThanOrEqualToThreshold",
+        "Threshold": 300
+    })
+    template.has_resource_properties("AWS::ApplicationAutoScaling::ScalingPolicy", {
+        "PolicyType": "StepScaling",
+        "StepScalingPolicyConfiguration": assertions.Match.object_like({
+            "AdjustmentType": "ChangeInCapacity",
+            "StepAdjustments": assertions.Match.array_with([
+                assertions.Match.object_like({"MetricIntervalLowerBound": 999, "ScalingAdjustment": 5})
+            ])
+        })
+    })
+
+
+def test_splitter_scales_in_only_when_nothing_is_in_flight():
+    template = splitter_template()
+
+    template.has_resource_properties("AWS::CloudWatch::Alarm", {
+        "ComparisonOperator": "LessThanOrEqualToThreshold",
+        "Threshold": 0,
+        "Metrics": assertions.Match.array_with([
+            assertions.Match.object_like({"Expression": "visible + in_flight"}),
+            assertions.Match.object_like({
+                "Id": "in_flight",
+                "MetricStat": assertions.Match.object_like({
+                    "Metric": assertions.Match.object_like({"MetricName": "ApproximateNumberOfMessagesNotVisible"})
+                })
+            })
+        ])
+    })
+    template.has_resource_properties("AWS::ApplicationAutoScaling::ScalingPolicy", {
+        "StepScalingPolicyConfiguration": assertions.Match.object_like({
+            "StepAdjustments": [{"MetricIntervalUpperBound": 0, "ScalingAdjustment": -10}]
+        })
+    })
+
+
+def test_router_sends_small_pdfs_to_the_fast_queue():
+    template = splitter_template({"fastPathMaxBytes": 10485760})
+
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "ingestion_router.handler",
+        "Environment": {"Variables": assertions.Match.object_like({
+            "ROUTER_FAST_PATH_MAX_BYTES": "10485760",
+            "ROUTER_READ_TRACE": "1",
+            "FAST_QUEUE_URL": assertions.Match.any_value(),
+            "SPLITTER_QUEUE_URL": assertions.Match.any_value()
+        })}
+    })
+
+
+def test_fast_splitter_lambda_consumes_the_fast_queue():
+    template = splitter_template()
+
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "PackageType": "Image",
+        "Timeout": 300
+    })
+    template.has_resource_properties("AWS::Lambda::EventSourceMapping", {
+        "BatchSize": 5,
+        "FunctionResponseTypes": ["ReportBatchItemFailures"]
+    })
+    # The fast queue has to outlast the function's timeout
+    template.has_resource_properties("AWS::SQS::Queue", {
+        "VisibilityTimeout": 1800
+    })
+
+
+def test_router_is_only_notified_about_pdfs():
+    template = splitter_template()
+
+    template.has_resource_properties("Custom::S3BucketNotifications", {
+        "NotificationConfiguration": {
+            "LambdaFunctionConfigurations": [
+                assertions.Match.object_like({
+                    "Events": ["s3:ObjectCreated:*"],
+                    "Filter": {"Key": {"FilterRules": [{"Name": "suffix", "Value": suffix}]}}
+                })
+                for suffix in (".pdf", ".PDF")
+            ]
+        }
+    })
+
+
+def test_both_splitter_queues_have_dead_letter_queues():
+    template = splitter_template({"maxReceiveCount": 3})
+
+    template.resource_count_is("AWS::SQS::Queue", 4)
+    for queue, dlq in (("GestaltSplitterQueue", "GestaltSplitterDeadLetterQueue"),
+                       ("GestaltFastSplitterQueue", "GestaltFastSplitterDeadLetterQueue")):
+        queues = template.find_resources("AWS::SQS::Queue")
+        [queue_id] = [logical_id for logical_id in queues if logical_id.startswith(queue) and "DeadLetter" not in logical_id]
+        [dlq_id] = [logical_id for logical_id in queues if logical_id.startswith(dlq)]
+        assert queues[queue_id]["Properties"]["RedrivePolicy"] == {
+            "deadLetterTargetArn": {"Fn::GetAtt": [dlq_id, "Arn"]},
+            "maxReceiveCount": 3
+        }
+        assert queues[dlq_id]["Properties"]["MessageRetentionPeriod"] == 1209600
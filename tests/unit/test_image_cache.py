@@ -0,0 +1,73 @@
+import pytest
+
+from image_cache import ImageDedupCache
+
+
+@pytest.fixture
+def cache():
+    return ImageDedupCache(max_entries=2)
+
+
+def test_a_new_image_is_claimed_and_then_seen_once_committed(cache):
+    assert cache.check("h1") is False
+    # Another page of the same batch while it's in flight
+    assert cache.check("h1") is True
+
+    cache.commit("h1")
+    cache.release("h1")
+    assert cache.check("h1") is True
+
+
+def test_a_released_claim_is_tried_again(cache):
+    assert cache.check("h1") is False
+    cache.release("h1")
+
+    assert cache.check("h1") is False
+
+
+def test_the_least_recently_seen_images_are_forgotten(cache):
+    for digest in ("h1", "h2"):
+        cache.check(digest)
+        cache.commit(digest)
+    cache.check("h1")
+    cache.check("h3")
+    cache.commit("h3")
+
+    assert cache.check("h1") is True
+    assert cache.check("h2") is False
+
+
+def test_the_s3_index_shares_delivered_images_between_workers(s3):
+    first = ImageDedupCache(10, s3, "bucket1")
+    second = ImageDedupCache(10, s3, "bucket1")
+
+    assert first.check("h1") is False
+    # Claimed but not delivered: the other worker doesn't know about it yet
+    assert second.check("h1") is False
+    second.release("h1")
+
+    first.commit("h1")
+    assert s3.head_object(Bucket="bucket1", Key="images/h1")
+    assert second.check("h1") is True
+
+
+def test_an_image_is_delivered_once_across_documents_unless_its_document_fails(splitter, make_pdf, s3, monkeypatch,
+                                                                              capsys):
+    s3.put_object(Bucket="bucket1", Key="a.pdf", Body=make_pdf([{"text": "first", "image": (255, 0, 0)}]))
+    s3.put_object(Bucket="bucket1", Key="b.pdf", Body=make_pdf([{"text": "second", "image": (255, 0, 0)}]))
+    upload = splitter.ArtifactWriter.upload
+
+    def failing_upload(*args, **kwargs):
+        raise RuntimeError("S3 is down")
+
+    monkeypatch.setattr(splitter.ArtifactWriter, "upload", failing_upload)
+    with pytest.raises(RuntimeError):
+        splitter.download_and_process("bucket1", "a.pdf")
+    monkeypatch.setattr(splitter.ArtifactWriter, "upload", upload)
+    capsys.readouterr()
+
+    # a.pdf never made it, so b.pdf hands the image downstream itself
+    splitter.download_and_process("bucket1", "b.pdf")
+    assert "Extracted image 0" in capsys.readouterr().out
+    splitter.download_and_process("bucket1", "a.pdf")
+    assert "Skipped duplicate image 0" in capsys.readouterr().out
@@ -0,0 +1,106 @@
+import threading
+
+import fitz
+import pytest
+
+from image_pipeline import ByteBudget, ImagePipeline, effective_dpi, normalize_extracted, normalize_image
+
+
+def png(width, height, colour=(200, 30, 30)):
+    pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, width, height), False)
+    pix.set_rect(pix.irect, colour)
+    return pix.tobytes("png")
+
+
+def output(size, sha256="h", failed=False):
+    return {"sha256": sha256, "format": "jpg", "output": {
+        "data": b"x" * size, "ext": "jpg", "thumbnail": None, "failed": failed, "bytes_in": size * 2, "dpi": 300
+    }}
+
+
+class FakeS3:
+    """Records uploads; keys containing "broken" fail."""
+
+    def __init__(self):
+        self.keys = []
+
+    def put_object(self, Bucket, Key, Body, ContentType):
+        if "broken" in Key:
+            raise ConnectionError("S3 went away")
+        self.keys.append(Key)
+
+
+def test_byte_budget_blocks_until_enough_is_released():
+    budget = ByteBudget(100)
+    assert budget.acquire(60) == 60
+    acquired = threading.Event()
+
+    def second():
+        budget.acquire(60)
+        acquired.set()
+
+    threading.Thread(target=second, daemon=True).start()
+    assert not acquired.wait(0.1)
+    budget.release(60)
+    assert acquired.wait(1)
+    assert budget.peak == 60
+
+
+def test_a_request_over_the_whole_budget_runs_on_its_own():
+    budget = ByteBudget(100)
+    assert budget.acquire(500) == 100
+    budget.release(100)
+    assert budget.in_use == 0
+
+
+def test_the_pipeline_never_holds_more_than_its_budget():
+    pipeline = ImagePipeline(max_workers=4, max_inflight_bytes=250, s3=FakeS3())
+    batch = pipeline.batch("bucket1")
+    try:
+        for i in range(20):
+            batch.add_image(output(100, sha256=f"h{i}"))
+        totals = batch.wait()
+    finally:
+        pipeline.shutdown()
+
+    assert totals["images"] == 20
+    assert totals["bytes_out"] == 2000
+    assert pipeline.budget.peak <= 250
+    assert pipeline.budget.in_use == 0
+
+
+def test_wait_reraises_a_failed_upload_after_the_rest_are_delivered():
+    s3 = FakeS3()
+    pipeline = ImagePipeline(max_workers=2, s3=s3)
+    batch = pipeline.batch("bucket1")
+    try:
+        for sha256 in ("a", "broken", "b"):
+            batch.add_image(output(10, sha256=sha256))
+        with pytest.raises(ConnectionError):
+            batch.wait()
+    finally:
+        pipeline.shutdown()
+
+    assert sorted(s3.keys) == ["page-images/a.jpg", "page-images/b.jpg"]
+    assert pipeline.budget.in_use == 0
+
+
+def test_an_oversampled_image_is_downsampled_to_the_target_dpi():
+    # 600 pixels drawn one inch wide
+    image = {"image": png(600, 300), "ext": "png", "width": 600, "height": 300, "placement": (72, 36)}
+
+    result = normalize_image(image, target_dpi=150, thumbnail_px=64)
+
+    assert (result["width"], result["height"], result["dpi"]) == (150, 75, 150)
+    assert result["ext"] == "jpg"
+    assert max(fitz.Pixmap(result["thumbnail"]).irect[2:]) == 64
+    assert effective_dpi(600, None) is None
+
+
+def test_an_image_that_cant_be_decoded_is_kept_as_embedded():
+    image = {"image": b"not an image", "ext": "jbig2", "width": 10, "height": 10}
+
+    result = normalize_extracted(image, {"target_dpi": 300})
+
+    assert result["failed"] is True
+    assert (result["data"], result["ext"], result["bytes_in"]) == (b"not an image", "jbig2", 12)
@@ -0,0 +1,165 @@
+import json
+
+import boto3
+import pytest
+
+import gestalt_metrics as metrics
+import ingestion_router
+
+
+@pytest.fixture
+def router(s3, monkeypatch):
+    """The router on moto, with a Fargate queue and a fast queue for files up to 1 KiB."""
+    sqs = boto3.client('sqs', region_name='us-east-1')
+    queues = {name: sqs.create_queue(QueueName=name)['QueueUrl'] for name in ("splitter", "fast")}
+    monkeypatch.setattr(ingestion_router, "s3", s3)
+    monkeypatch.setattr(ingestion_router, "sqs", sqs)
+    monkeypatch.setattr(ingestion_router, "SPLITTER_QUEUE_URL", queues["splitter"])
+    monkeypatch.setattr(ingestion_router, "FAST_QUEUE_URL", queues["fast"])
+    monkeypatch.setattr(ingestion_router, "FAST_PATH_MAX_BYTES", 1024)
+    ingestion_router.queues = queues
+    return ingestion_router
+
+
+def s3_event(*objects):
+    return {"Records": [
+        {"eventTime": "2026-01-01T12:00:00.000Z",
+         "s3": {"bucket": {"name": "bucket1"}, "object": {"key": key, "size": size}}}
+        for key, size in objects
+    ]}
+
+
+def received(router, queue):
+    sqs = router.sqs
+    bodies = []
+    while True:
+        messages = sqs.receive_message(QueueUrl=router.queues[queue], MaxNumberOfMessages=10).get('Messages', [])
+        if not messages:
+            return bodies
+        bodies.extend(json.loads(message['Body']) for message in messages)
+        for message in messages:
+            sqs.delete_message(QueueUrl=router.queues[queue], ReceiptHandle=message['ReceiptHandle'])
+
+
+def test_the_scrapers_trace_reaches_the_splitter_message(router, s3, monkeypatch):
+    monkeypatch.setattr(router, "READ_TRACE", True)
+    # What the scraper attaches to every PDF it stores
+    s3.put_object(Bucket="bucket1", Key="EFTA0001.pdf", Body=b"%PDF",
+                  Metadata=metrics.trace_metadata("c0ffee", 1767268800.5))
+
+    router.handler(s3_event(("EFTA0001.pdf", 4)), None)
+
+    [body] = received(router, "fast")
+    assert body["correlation_id"] == "c0ffee"
+    assert body["discovered_at"] == 1767268800.5
+
+
+class FlakySQS:
+    """Fails the given entry IDs on the first send_message_batch call and accepts everything after."""
+
+    def __init__(self, fail_ids):
+        self.fail_ids = set(fail_ids)
+        self.calls = []
+
+    def send_message_batch(self, QueueUrl, Entries):
+        self.calls.append([entry['Id'] for entry in Entries])
+        failed = [{'Id': entry['Id'], 'SenderFault': False, 'Code': 'InternalError'}
+                  for entry in Entries if entry['Id'] in self.fail_ids]
+        self.fail_ids = set()
+        return {'Successful': [], 'Failed': failed}
+
+
+@pytest.mark.parametrize("key, routed", [
+    ("EFTA0001.pdf", True),
+    ("dataset 1/EFTA0002.PDF", True),
+    ("scraper_state.json", False),
+    ("debug_state_3.png", False),
+    ("_gestalt/artifacts/EFTA0001.pdf.gsta", False),
+    ("_gestalt/shards/EFTA0001.pdf/manifest.json", False),
+])
+def test_only_pdfs_outside_the_state_prefix_are_routed(router, key, routed):
+    assert router.should_route("bucket1", key) == (routed, None)
+
+
+def test_the_content_type_check_rejects_non_pdfs(router, s3, monkeypatch):
+    monkeypatch.setattr(router, "CHECK_CONTENT_TYPE", True)
+    s3.put_object(Bucket="bucket1", Key="real.pdf", Body=b"%PDF", ContentType="application/pdf")
+    s3.put_object(Bucket="bucket1", Key="fake.pdf", Body=b"<html>", ContentType="text/html; charset=utf-8")
+
+    assert router.should_route("bucket1", "real.pdf")[0] is True
+    assert router.should_route("bucket1", "fake.pdf")[0] is False
+
+
+def test_an_event_is_routed_ten_files_per_request(router, monkeypatch):
+    monkeypatch.setattr(router, "FAST_QUEUE_URL", None)
+    sent = []
+    send_batch = router.send_batch
+
+    def counting_send_batch(queue_url, batch):
+        sent.append(len(batch))
+        send_batch(queue_url, batch)
+
+    monkeypatch.setattr(router, "send_batch", counting_send_batch)
+    objects = [(f"doc{i}.pdf", 2048) for i in range(23)] + [("scraper_state.json", 10)]
+
+    response = router.handler(s3_event(*objects), None)
+
+    assert sent == [10, 10, 3]
+    assert sorted(body["key"] for body in received(router, "splitter")) == sorted(key for key, _ in objects[:23])
+    assert "skipped 1" in response["body"]
+
+
+def test_send_batch_retries_only_the_entries_that_failed(router, monkeypatch):
+    sqs = FlakySQS(fail_ids={"1", "3"})
+    monkeypatch.setattr(router, "sqs", sqs)
+    monkeypatch.setattr(router.time, "sleep", lambda seconds: None)
+
+    router.send_batch("https://queue", ["a", "b", "c", "d"])
+
+    assert sqs.calls == [["0", "1", "2", "3"], ["1", "3"]]
+
+
+def test_send_batch_gives_up_after_its_attempts(router, monkeypatch):
+    class BrokenSQS(FlakySQS):
+        def send_message_batch(self, QueueUrl, Entries):
+            self.calls.append([entry['Id'] for entry in Entries])
+            return {'Failed': [{'Id': entry['Id']} for entry in Entries]}
+
+    sqs = BrokenSQS(fail_ids=())
+    monkeypatch.setattr(router, "sqs", sqs)
+    monkeypatch.setattr(router.time, "sleep", lambda seconds: None)
+
+    with pytest.raises(Exception, match="after 3 attempts"):
+        router.send_batch("https://queue", ["a", "b"])
+    assert len(sqs.calls) == router.MAX_SEND_ATTEMPTS
+
+
+@pytest.mark.parametrize("size, tier", [(0, "fast"), (1024, "fast"), (1025, "fargate"), (None, "fargate")])
+def test_choose_tier(router, size, tier):
+    assert router.choose_tier(size) == tier
+
+
+def test_without_a_fast_queue_everything_takes_the_fargate_path(router, monkeypatch):
+    monkeypatch.setattr(router, "FAST_QUEUE_URL", None)
+    assert router.choose_tier(10) == "fargate"
+
+
+def test_files_are_split_between_the_tiers_by_size(router):
+    response = router.handler(s3_event(("small.pdf", 500), ("large.pdf", 5000), ("edge.pdf", 1024)), None)
+
+    assert sorted(body["key"] for body in received(router, "fast")) == ["edge.pdf", "small.pdf"]
+    [large] = received(router, "splitter")
+    assert (large["key"], large["size"]) == ("large.pdf", 5000)
+    assert "(2 fast)" in response["body"]
+
+
+def test_a_missing_event_size_is_taken_from_the_head_when_there_is_one(router, s3, monkeypatch):
+    monkeypatch.setattr(router, "READ_TRACE", True)
+    s3.put_object(Bucket="bucket1", Key="large.pdf", Body=b"x" * 2048)
+    event = s3_event(("large.pdf", None))
+    del event["Records"][0]["s3"]["object"]["size"]
+
+    router.handler(event, None)
+
+    assert [body["size"] for body in received(router, "splitter")] == [2048]
+    assert received(router, "fast") == []
@@ -0,0 +1,74 @@
+from manifest import CompletionManifest
+
+
+def local_manifest(path):
+    manifest = CompletionManifest(path=str(path))
+    manifest.load()
+    return manifest
+
+
+def line_count(path):
+    with open(path) as f:
+        return sum(1 for line in f if line.strip())
+
+
+def test_local_manifest_round_trip(tmp_path):
+    path = tmp_path / "manifest.jsonl"
+    manifest = local_manifest(path)
+    manifest.add("https://example.com/a.pdf", size=10, sha256="aa")
+    manifest.add("https://example.com/b.pdf", size=20, sha256="bb")
+    manifest.flush()
+
+    reloaded = local_manifest(path)
+    assert len(reloaded) == 2
+    assert "https://example.com/a.pdf" in reloaded
+    assert reloaded.get("https://example.com/b.pdf")["size"] == 20
+    assert dict(reloaded.items()).keys() == {"https://example.com/a.pdf", "https://example.com/b.pdf"}
+
+
+def test_local_manifest_compacts_once_it_holds_twice_the_live_records(tmp_path):
+    path = tmp_path / "manifest.jsonl"
+    manifest = local_manifest(path)
+    manifest.add("https://example.com/a.pdf", size=1)
+    manifest.flush()
+    manifest.add("https://example.com/a.pdf", size=2)
+    manifest.flush()
+    assert line_count(path) == 2
+
+    # A third line for the same URL is more than 2x the one live record
+    manifest.add("https://example.com/a.pdf", size=3)
+    manifest.flush()
+    assert line_count(path) == 1
+    assert local_manifest(path).get("https://example.com/a.pdf")["size"] == 3
+
+
+def test_s3_manifest_folds_segments_into_a_base_object(s3):
+    manifest = CompletionManifest(s3=s3, bucket="bucket1", prefix="manifest/", max_segments=2)
+    for i in range(3):
+        manifest.add(f"https://example.com/{i}.pdf", size=i)
+        manifest.flush()
+
+    keys = [obj["Key"] for obj in s3.list_objects_v2(Bucket="bucket1", Prefix="manifest/")["Contents"]]
+    assert keys == ["manifest/base-main.jsonl"]
+
+    reloaded = CompletionManifest(s3=s3, bucket="bucket1", prefix="manifest/")
+    reloaded.load()
+    assert len(reloaded) == 3
+
+
+def test_s3_writers_share_a_prefix_but_only_compact_their_own_records(s3):
+    shard0 = CompletionManifest(s3=s3, bucket="bucket1", prefix="manifest/", max_segments=1, writer_id="shard0")
+    shard1 = CompletionManifest(s3=s3, bucket="bucket1", prefix="manifest/", max_segments=1, writer_id="shard1")
+    shard1.add("https://example.com/shard1.pdf")
+    shard1.flush()
+    for i in range(2):
+        shard0.add(f"https://example.com/shard0-{i}.pdf")
+        shard0.flush()
+
+    base = s3.get_object(Bucket="bucket1", Key="manifest/base-shard0.jsonl")["Body"].read().decode("utf-8")
+    assert "shard1.pdf" not in base
+    assert s3.list_objects_v2(Bucket="bucket1", Prefix="manifest/segments/shard1/")["KeyCount"] == 1
+
+    reloaded = CompletionManifest(s3=s3, bucket="bucket1", prefix="manifest/", writer_id="shard0")
+    reloaded.load()
+    assert len(reloaded) == 3
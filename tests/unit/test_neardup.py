@@ -0,0 +1,130 @@
+import random
+
+import pytest
+
+from neardup import MinHasher, NearDupIndex, NearDupSync, choose_bands, shingles, similarity
+
+
+def document(seed, words=400):
+    rng = random.Random(seed)
+    return " ".join(f"w{rng.randrange(5000)}" for _ in range(words))
+
+
+def edit(text, share, seed=0):
+    """Replaces about `share` of the words of text."""
+    rng = random.Random(seed)
+    return " ".join(f"x{rng.randrange(10 ** 6)}" if rng.random() < share else word for word in text.split())
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = NearDupIndex(str(tmp_path / "neardup.db"), threshold=0.8)
+    yield index
+    index.close()
+
+
+def test_shingles_are_lowercased_word_five_grams():
+    assert shingles("A b C d E f") == {"a b c d e", "b c d e f"}
+    assert shingles("Too short") == {"too short"}
+    assert shingles("  ") == set()
+
+
+def test_minhash_estimates_jaccard_similarity():
+    hasher = MinHasher(num_perm=256)
+    original = shingles(document(1))
+    edited = shingles(edit(document(1), 0.05))
+    jaccard = len(original & edited) / len(original | edited)
+
+    assert similarity(hasher.signature(original), MinHasher(num_perm=256).signature(original)) == 1.0
+    assert similarity(hasher.signature(original), hasher.signature(edited)) == pytest.approx(jaccard, abs=0.1)
+    assert hasher.signature(set()) is None
+
+
+@pytest.mark.parametrize("threshold", [0.5, 0.8, 0.9])
+def test_bands_put_the_s_curve_below_the_threshold(threshold):
+    bands, rows = choose_bands(128, threshold)
+    assert bands * rows <= 128
+    assert (1 / bands) ** (1 / rows) <= threshold * 0.85
+
+    def candidate_probability(s):
+        return 1 - (1 - s ** rows) ** bands
+
+    # Most pairs at the threshold become candidates, few at half of it do
+    assert candidate_probability(threshold) > 0.85
+    assert candidate_probability(threshold / 2) < 0.15
+
+
+def test_a_lightly_edited_copy_is_flagged(index):
+    original = document(1)
+    assert index.check("bucket1", "a.pdf", original) is None
+
+    match = index.check("bucket1", "a-rescan.pdf", edit(original, 0.02))
+    assert match["key"] == "a.pdf"
+    assert match["similarity"] >= 0.8
+
+
+def test_documents_below_the_threshold_are_not_flagged(index):
+    original = document(1)
+    index.check("bucket1", "a.pdf", original)
+
+    assert index.check("bucket1", "b.pdf", document(2)) is None
+    # Half the words replaced leaves well under 80% of the shingles in common
+    assert index.check("bucket1", "a-rewrite.pdf", edit(original, 0.5)) is None
+
+
+def test_a_document_never_matches_itself_and_empty_text_is_skipped(index):
+    index.check("bucket1", "a.pdf", document(1))
+    assert index.check("bucket1", "a.pdf", document(1)) is None
+    assert index.check("bucket1", "scan.pdf", "") is None
+    assert index.version == 2
+
+
+def test_query_many_looks_up_several_documents_at_once(index):
+    original = document(1)
+    index.check("bucket1", "a.pdf", original)
+    signatures = {
+        "copy": index.hasher.signature(shingles(original)),
+        "other": index.hasher.signature(shingles(document(3))),
+    }
+
+    results = index.query_many(signatures)
+    assert [match["key"] for match in results["copy"]] == ["a.pdf"]
+    assert results["other"] == []
+    assert index.query_many(signatures, exclude={"copy": ("bucket1", "a.pdf")})["copy"] == []
+
+
+def test_sync_shares_entries_between_workers(s3, tmp_path):
+    first = NearDupIndex(str(tmp_path / "first.db"))
+    second = NearDupIndex(str(tmp_path / "second.db"))
+    first_sync = NearDupSync(first, s3, "bucket1", "neardup/index.db", sync_seconds=0)
+    second_sync = NearDupSync(second, s3, "bucket1", "neardup/index.db", sync_seconds=0)
+
+    original = document(1)
+    first.check("bucket1", "a.pdf", original)
+    first_sync.sync()
+    second_sync.sync()
+
+    assert second.check("bucket1", "b.pdf", edit(original, 0.02))["key"] == "a.pdf"
+    second_sync.sync(force=True)
+    first_sync.sync()
+    assert first.query(second.hasher.signature(shingles(original)), exclude=("bucket1", "a.pdf"))[0]["key"] == "b.pdf"
+
+
+def test_a_flagged_document_is_indexed_without_its_images(splitter, make_pdf, s3, tmp_path, monkeypatch):
+    from artifact import read_header, read_page
+
+    monkeypatch.setattr(splitter, "neardup_index", NearDupIndex(str(tmp_path / "neardup.db")))
+    original = document(1)
+    s3.put_object(Bucket="bucket1", Key="a.pdf", Body=make_pdf([{"text": original, "image": (255, 0, 0)}]))
+    s3.put_object(Bucket="bucket1", Key="b.pdf", Body=make_pdf([{"text": edit(original, 0.02), "image": (0, 0, 255)}]))
+
+    splitter.download_and_process("bucket1", "a.pdf")
+    splitter.download_and_process("bucket1", "b.pdf")
+
+    # Only the original's image (and its thumbnail) went out
+    assert s3.list_objects_v2(Bucket="bucket1", Prefix="page-images/")["KeyCount"] == 2
+    header = read_header(s3, "bucket1", splitter.artifact_key("b.pdf"))
+    assert header[0]["near_duplicate_of"]["key"] == "a.pdf"
+    page = read_page(s3, "bucket1", splitter.artifact_key("b.pdf"), 0, header=header)
+    assert page["images"] == []
+    assert page["text"].split()[:3] == edit(original, 0.02).split()[:3]
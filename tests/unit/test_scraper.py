@@ -0,0 +1,224 @@
+import json
+
+import pytest
+
+pytest.importorskip("playwright")
+pytest.importorskip("playwright_stealth")
+
+
+@pytest.fixture
+def scraper(tmp_path, monkeypatch):
+    """The scraper module in local mode, keeping its files under tmp_path."""
+    # Local mode creates DOWNLOAD_DIR on import
+    monkeypatch.setenv("DOWNLOAD_DIR", str(tmp_path))
+    monkeypatch.delenv("STAGING_BUCKET", raising=False)
+    import scraper
+
+    monkeypatch.setattr(scraper, "DOWNLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(scraper, "STAGING_BUCKET", None)
+    monkeypatch.setattr(scraper, "s3", None)
+    monkeypatch.setattr(scraper, "listing_latencies", [])
+    return scraper
+
+
+class FakeLocator:
+
+    def __init__(self, hrefs=(), visible=False):
+        self.hrefs = list(hrefs)
+        self.visible = visible
+
+    def count(self):
+        return len(self.hrefs) or int(self.visible)
+
+    @property
+    def first(self):
+        return self
+
+    def is_visible(self):
+        return self.visible
+
+    def evaluate_all(self, script):
+        return self.hrefs
+
+
+class FakePage:
+    """Records navigation; `listing` holds the PDF links the page shows, `age_gate` whether it is gated."""
+
+    def __init__(self, listing=(), age_gate=False, links_change=True):
+        self.listing = list(listing)
+        self.age_gate = age_gate
+        self.links_change = links_change
+        self.url = "about:blank"
+        self.calls = []
+
+    def goto(self, url):
+        self.url = url
+        self.calls.append(("goto", url))
+
+    def wait_for_load_state(self, state):
+        self.calls.append(("load_state", state))
+
+    def wait_for_function(self, script, arg=None, timeout=None):
+        self.calls.append(("wait_for_function", arg))
+        if not self.links_change:
+            from playwright.sync_api import TimeoutError
+            raise TimeoutError("timed out")
+
+    def locator(self, selector):
+        if selector == '#age-verify-block':
+            return FakeLocator(visible=self.age_gate)
+        return FakeLocator(hrefs=self.listing)
+
+
+class FakeContext:
+
+    def __init__(self):
+        self.handler = None
+
+    def route(self, pattern, handler):
+        self.handler = handler
+
+    def storage_state(self):
+        return {"cookies": [{"name": "ak_bmsc", "value": "trusted"}], "origins": []}
+
+
+class FakeRoute:
+
+    def __init__(self, resource_type):
+        self.request = type("Request", (), {"resource_type": resource_type})()
+        self.outcome = None
+
+    def abort(self):
+        self.outcome = "abort"
+
+    def continue_(self):
+        self.outcome = "continue"
+
+
+def test_fast_navigation_blocks_the_resource_types_it_never_reads(scraper):
+    context = FakeContext()
+    scraper.block_unneeded_resources(context)
+
+    outcomes = {}
+    for resource_type in ("image", "font", "media", "document", "script", "stylesheet", "xhr"):
+        route = FakeRoute(resource_type)
+        context.handler(route)
+        outcomes[resource_type] = route.outcome
+
+    assert [t for t, outcome in outcomes.items() if outcome == "abort"] == ["image", "font", "media"]
+
+
+def test_fast_mode_waits_for_the_pdf_links_to_change(scraper, monkeypatch):
+    monkeypatch.setattr(scraper, "FAST_NAVIGATION", True)
+    page = FakePage()
+
+    scraper.wait_for_page(page)
+    scraper.wait_for_listing(page, ["/a.pdf", "/b.pdf"])
+
+    assert page.calls == [("load_state", "domcontentloaded"), ("wait_for_function", "/a.pdf\n/b.pdf")]
+
+
+def test_fast_mode_falls_back_to_networkidle_when_the_links_dont_change(scraper, monkeypatch):
+    monkeypatch.setattr(scraper, "FAST_NAVIGATION", True)
+    page = FakePage(links_change=False)
+
+    scraper.wait_for_listing(page, ["/a.pdf"])
+
+    assert page.calls == [("wait_for_function", "/a.pdf"), ("load_state", "networkidle")]
+
+
+def test_slow_mode_waits_for_networkidle(scraper, monkeypatch):
+    monkeypatch.setattr(scraper, "FAST_NAVIGATION", False)
+    page = FakePage()
+
+    scraper.wait_for_page(page)
+    scraper.wait_for_listing(page, ["/a.pdf"])
+
+    assert page.calls == [("load_state", "networkidle"), ("load_state", "networkidle")]
+
+
+def test_listing_latency_summary(scraper, monkeypatch):
+    monkeypatch.setattr(scraper, "FAST_NAVIGATION", True)
+    assert scraper.listing_latency_summary() is None
+
+    for page_index, seconds in enumerate([0.4, 0.1, 0.3, 0.2, 2.0]):
+        scraper.record_listing_latency(page_index, seconds)
+
+    assert scraper.listing_latency_summary() == {"mode": "fast", "pages": 5, "mean": 0.6, "p50": 0.3, "p95": 2.0,
+                                                 "max": 2.0}
+
+
+DATASETS = ["/epstein/doj-disclosures/data-set-1-files", "/epstein/doj-disclosures/data-set-2-files"]
+
+
+def test_a_saved_session_loads_back(scraper):
+    scraper.save_session(FakeContext(), DATASETS)
+
+    session = scraper.load_session()
+    assert session["dataset_links"] == DATASETS
+    assert session["storage_state"]["cookies"][0]["value"] == "trusted"
+
+
+def test_without_a_saved_session_there_is_nothing_to_load(scraper):
+    assert scraper.load_session() is None
+
+
+def test_in_cloud_mode_the_session_goes_through_the_staging_bucket(scraper, s3, tmp_path, monkeypatch):
+    monkeypatch.setattr(scraper, "STAGING_BUCKET", "bucket1")
+    monkeypatch.setattr(scraper, "s3", s3)
+    scraper.save_session(FakeContext(), DATASETS)
+    (tmp_path / scraper.SESSION_FILE).unlink()
+
+    assert json.loads(s3.get_object(Bucket="bucket1", Key=scraper.SESSION_FILE)["Body"].read())["dataset_links"] == DATASETS
+    assert scraper.load_session()["dataset_links"] == DATASETS
+
+
+@pytest.mark.parametrize("dataset_index, dataset_page, expected", [
+    (0, 0, "https://www.justice.gov/epstein/doj-disclosures/data-set-1-files"),
+    (2, 0, "https://www.justice.gov/epstein/doj-disclosures/data-set-2-files"),
+    (2, 6, "https://www.justice.gov/epstein/doj-disclosures/data-set-2-files?page=5"),
+    (3, 0, None),
+])
+def test_resume_url_is_where_the_crawl_picks_up(scraper, monkeypatch, dataset_index, dataset_page, expected):
+    monkeypatch.setattr(scraper, "BASE_URL", "https://www.justice.gov/epstein/doj-disclosures")
+    monkeypatch.setattr(scraper, "start_dataset_index", dataset_index)
+    monkeypatch.setattr(scraper, "start_dataset_page", dataset_page)
+
+    assert scraper.resume_url(DATASETS) == expected
+
+
+@pytest.fixture
+def resuming(scraper, monkeypatch):
+    monkeypatch.setattr(scraper, "BASE_URL", "https://www.justice.gov/epstein/doj-disclosures")
+    monkeypatch.setattr(scraper, "start_dataset_index", 2)
+    monkeypatch.setattr(scraper, "start_dataset_page", 6)
+    monkeypatch.setattr(scraper, "FAST_NAVIGATION", True)
+    return scraper
+
+
+def test_a_restored_session_goes_straight_to_the_resume_page(resuming):
+    page = FakePage(listing=["/files/EFTA0001.pdf"])
+
+    assert resuming.restore_session(page, {"dataset_links": DATASETS}) == DATASETS
+    assert page.calls[0] == ("goto", "https://www.justice.gov/epstein/doj-disclosures/data-set-2-files?page=5")
+
+
+@pytest.mark.parametrize("page", [
+    FakePage(listing=["/files/EFTA0001.pdf"], age_gate=True),
+    FakePage(listing=[]),
+])
+def test_a_rejected_session_falls_back_to_the_bootstrap(resuming, page):
+    assert resuming.restore_session(page, {"dataset_links": DATASETS}) is None
+
+
+def test_a_restored_session_jumps_to_a_listing_page_without_trust_clicks(resuming, monkeypatch):
+    monkeypatch.setattr(resuming, "session_restored", True)
+    monkeypatch.setattr(resuming, "fast_forward_to_page", lambda *args: pytest.fail("replayed the trust clicks"))
+    page = FakePage(listing=["/files/EFTA0001.pdf"])
+    dataset_url = "https://www.justice.gov/epstein/doj-disclosures/data-set-2-files"
+
+    resuming.open_listing_at(page, dataset_url, 7)
+    # Already there: nothing to do
+    resuming.open_listing_at(page, dataset_url, 7)
+
+    assert [call for call in page.calls if call[0] == "goto"] == [("goto", dataset_url + "?page=7")]
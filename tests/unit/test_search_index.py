@@ -0,0 +1,114 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from search_index import SearchIndex, SearchIndexPublisher, fetch_index, merge_deltas, to_match_query
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = SearchIndex(str(tmp_path / "shard.db"))
+    yield index
+    index.close()
+
+
+def test_to_match_query_quotes_every_word():
+    assert to_match_query('flight "logs" OR') == '"flight" "logs" "OR"'
+    assert to_match_query("  ...  ") == ""
+
+
+def test_search_ranks_pages_that_contain_every_word(index):
+    index.add_pages("a.pdf", [(0, "the flight logs for the island"), (1, "unrelated memo")])
+    index.add_pages("b.pdf", [(3, "flight logs, flight logs and more flight logs")])
+
+    hits = index.search("Flight Logs")
+    assert [(hit["key"], hit["page_num"]) for hit in hits] == [("b.pdf", 3), ("a.pdf", 0)]
+    assert hits[0]["score"] >= hits[1]["score"]
+    assert "[flight]" in hits[1]["snippet"]
+    # The porter stemmer matches other forms of a word
+    assert index.search("flights")
+    assert index.search("memo island") == []
+
+
+def test_raw_queries_go_to_fts5_unchanged(index):
+    index.add_pages("a.pdf", [(0, "flight plan filed"), (1, "passenger manifest")])
+
+    assert {hit["page_num"] for hit in index.search('"flight plan" OR manifest', raw=True)} == {0, 1}
+    assert index.search("", raw=False) == []
+
+
+def test_reindexing_a_page_replaces_its_text(index):
+    index.add_pages("a.pdf", [(0, "old text")])
+    index.add_pages("a.pdf", [(0, "new text")])
+
+    assert index.search("old") == []
+    assert [hit["key"] for hit in index.search("new")] == ["a.pdf"]
+
+
+def test_deltas_never_replace_a_page_with_an_older_copy(index, tmp_path):
+    index.add_pages("a.pdf", [(0, "older copy")])
+    older = str(tmp_path / "older.db")
+    index.export_since(0, older)
+
+    merged = SearchIndex(str(tmp_path / "merged.db"))
+    index.add_pages("a.pdf", [(0, "newer copy")])
+    newer = str(tmp_path / "newer.db")
+    pages, _ = index.export_since(0, newer)
+    assert pages == 1
+
+    merged.apply_delta(newer)
+    merged.apply_delta(older)
+    assert [hit["key"] for hit in merged.search("newer")] == ["a.pdf"]
+    assert merged.search("older") == []
+    merged.close()
+
+
+def test_prune_keeps_pages_indexed_after_the_cutoff(index):
+    index.add_pages("a.pdf", [(0, "published page")])
+    cutoff = index.last_indexed_at
+    index.add_pages("b.pdf", [(0, "pending page")])
+
+    assert index.prune_until(cutoff) == 1
+    assert index.search("published") == []
+    assert [hit["key"] for hit in index.search("pending")] == ["b.pdf"]
+
+
+def test_publish_merge_and_fetch(index, s3, tmp_path):
+    publisher = SearchIndexPublisher(index, s3, "bucket1", merge_seconds=0)
+    index.add_pages("a.pdf", [(0, "flight logs")])
+    publisher.publish(force=True)
+    # Nothing new since the last publish: no second delta
+    publisher.publish(force=True)
+
+    deltas = s3.list_objects_v2(Bucket="bucket1", Prefix="search/deltas/")["Contents"]
+    assert len(deltas) == 1
+    # Published pages leave the local shard
+    assert index.search("flight") == []
+
+    assert merge_deltas(s3, "bucket1") == 1
+    assert s3.list_objects_v2(Bucket="bucket1", Prefix="search/deltas/")["KeyCount"] == 0
+    assert merge_deltas(s3, "bucket1") == 0
+
+    merged = SearchIndex(fetch_index(s3, "bucket1", "search/", str(tmp_path / "local.db")))
+    assert [hit["key"] for hit in merged.search("flight logs")] == ["a.pdf"]
+    merged.close()
+
+
+@pytest.mark.parametrize("env, enabled", [
+    ({}, False),
+    ({"SPLITTER_SEARCH_INDEX_BUCKET": "bucket1"}, True),
+    ({"SPLITTER_SEARCH_INDEX_BUCKET": "bucket1", "SPLITTER_SEARCH_INDEX": "0"}, False),
+    ({"SPLITTER_SEARCH_INDEX": "1"}, True),
+])
+def test_the_splitter_only_indexes_by_default_when_it_can_publish(env, enabled, tmp_path):
+    # The flag is read at import, so ask a fresh interpreter
+    worker = os.path.join(os.path.dirname(__file__), "..", "..", "worker")
+    common = os.path.join(os.path.dirname(__file__), "..", "..", "common", "python")
+    environment = {key: value for key, value in os.environ.items() if not key.startswith("SPLITTER_")}
+    environment.update(env, PYTHONPATH=os.pathsep.join([worker, common]), AWS_DEFAULT_REGION="us-east-1",
+                       SPLITTER_SEARCH_DB=str(tmp_path / "search.db"))
+    result = subprocess.run([sys.executable, "-c", "import splitter; print(splitter.search_index is not None)"],
+                            env=environment, capture_output=True, text=True, check=True)
+    assert result.stdout.strip().splitlines()[-1] == str(enabled)
@@ -0,0 +1,61 @@
+import os
+
+from source_cache import SourceCache
+
+
+def fetch(cache, s3, key):
+    stats = {}
+    return cache.fetch(s3, "bucket1", key, stats), stats
+
+
+def test_the_first_fetch_downloads_and_later_ones_reuse_the_copy(s3, tmp_path):
+    s3.put_object(Bucket="bucket1", Key="a.pdf", Body=b"%PDF a")
+    cache = SourceCache(str(tmp_path), 1024)
+
+    path, stats = fetch(cache, s3, "a.pdf")
+    again, again_stats = fetch(cache, s3, "a.pdf")
+
+    assert again == path
+    assert open(path, 'rb').read() == b"%PDF a"
+    assert stats["bytes_downloaded"] == 6
+    assert again_stats == {}
+
+
+def test_a_replaced_object_is_never_served_from_the_old_copy(s3, tmp_path):
+    cache = SourceCache(str(tmp_path), 1024)
+    s3.put_object(Bucket="bucket1", Key="a.pdf", Body=b"%PDF v1")
+    old, _ = fetch(cache, s3, "a.pdf")
+    s3.put_object(Bucket="bucket1", Key="a.pdf", Body=b"%PDF v2")
+
+    new, _ = fetch(cache, s3, "a.pdf")
+    assert new != old
+    assert open(new, 'rb').read() == b"%PDF v2"
+
+
+def test_discard_leaves_the_lock_file_for_whoever_is_waiting_on_it(s3, tmp_path):
+    s3.put_object(Bucket="bucket1", Key="a.pdf", Body=b"%PDF a")
+    cache = SourceCache(str(tmp_path), 1024)
+    path, _ = fetch(cache, s3, "a.pdf")
+
+    cache.discard(path)
+    cache.discard(path)
+
+    assert not os.path.exists(path)
+    assert os.path.exists(path + ".lock")
+
+
+def test_the_least_recently_used_copies_go_once_the_cache_is_full(s3, tmp_path):
+    cache = SourceCache(str(tmp_path), 30)
+    paths = {}
+    for key in ("a.pdf", "b.pdf", "c.pdf"):
+        s3.put_object(Bucket="bucket1", Key=key, Body=b"x" * 8)
+        paths[key], _ = fetch(cache, s3, key)
+        # Give each file its own mtime
+        os.utime(paths[key], (len(paths), len(paths)))
+
+    # Using a.pdf again makes b.pdf the oldest when d.pdf pushes the cache past 30 bytes
+    fetch(cache, s3, "a.pdf")
+    s3.put_object(Bucket="bucket1", Key="d.pdf", Body=b"x" * 8)
+    fetch(cache, s3, "d.pdf")
+
+    assert [key for key, path in paths.items() if os.path.exists(path)] == ["a.pdf", "c.pdf"]
@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+
+@pytest.fixture
+def streaming(splitter, monkeypatch):
+    monkeypatch.setattr(splitter, "IO_MODE", "stream")
+    monkeypatch.setattr(splitter, "STREAM_MAX_BYTES", 1024)
+    return splitter
+
+
+def fetch(splitter, key):
+    stats = {"bytes_downloaded": 0, "bytes_spilled": 0}
+    source, local_file_path = splitter.fetch_pdf("bucket1", key, stats)
+    return source, local_file_path, stats
+
+
+def test_small_objects_stream_into_memory(streaming, s3):
+    s3.put_object(Bucket="bucket1", Key="small.pdf", Body=b"%PDF" + b"x" * 100)
+
+    source, local_file_path, stats = fetch(streaming, "small.pdf")
+
+    assert source == b"%PDF" + b"x" * 100
+    assert local_file_path is None
+    assert stats == {"bytes_downloaded": 104, "bytes_spilled": 0}
+
+
+def test_objects_over_the_limit_spill_to_disk(streaming, s3):
+    data = os.urandom(4096)
+    s3.put_object(Bucket="bucket1", Key="dir/large.pdf", Body=data)
+
+    source, local_file_path, stats = fetch(streaming, "dir/large.pdf")
+    try:
+        assert source == local_file_path
+        assert open(local_file_path, 'rb').read() == data
+        assert stats == {"bytes_downloaded": 4096, "bytes_spilled": 4096}
+    finally:
+        os.remove(local_file_path)
+
+
+def test_disk_mode_always_downloads_to_a_file(splitter, s3, monkeypatch):
+    monkeypatch.setattr(splitter, "IO_MODE", "disk")
+    s3.put_object(Bucket="bucket1", Key="small.pdf", Body=b"%PDF small")
+
+    source, local_file_path, stats = fetch(splitter, "small.pdf")
+    try:
+        assert source == local_file_path
+        assert stats["bytes_spilled"] == 10
+    finally:
+        os.remove(local_file_path)
+
+
+@pytest.mark.parametrize("limit", [10 * 1024 ** 2, 0])
+def test_a_streamed_document_is_processed_and_leaves_nothing_in_tmp(streaming, make_pdf, s3, monkeypatch, limit):
+    from artifact import read_header
+
+    monkeypatch.setattr(streaming, "STREAM_MAX_BYTES", limit)
+    s3.put_object(Bucket="bucket1", Key="a.pdf", Body=make_pdf([{"text": "streamed page"}]))
+    before = set(os.listdir("/tmp"))
+
+    streaming.download_and_process("bucket1", "a.pdf")
+
+    header, _ = read_header(s3, "bucket1", streaming.artifact_key("a.pdf"))
+    assert [page for page, _, _ in header["pages"]] == [0]
+    assert not [name for name in set(os.listdir("/tmp")) - before if name.endswith("a.pdf")]
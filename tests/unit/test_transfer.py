@@ -0,0 +1,197 @@
+import hashlib
+import os
+
+import pytest
+import requests
+
+from transfer import IncompleteDownload, S3StreamUploader, _parse_content_range, download_with_resume
+
+
+class FakeResponse:
+
+    def __init__(self, status_code, body=b"", headers=None, fail_after=None):
+        self.status_code = status_code
+        self.headers = requests.structures.CaseInsensitiveDict(headers or {})
+        self.body = body
+        # Drop the connection after this many bytes
+        self.fail_after = fail_after
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code}", response=self)
+
+    def iter_content(self, chunk_size):
+        body = self.body if self.fail_after is None else self.body[:self.fail_after]
+        for i in range(0, len(body), 2):
+            yield body[i:i + 2]
+        if self.fail_after is not None:
+            raise requests.exceptions.ConnectionError("connection reset")
+
+
+class FakeSession:
+    """Answers each GET with the next canned response and keeps the request headers."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, headers=None, stream=False, timeout=None):
+        self.requests.append(headers)
+        return self.responses.pop(0)
+
+
+class BytesSink:
+
+    def __init__(self):
+        self.data = b""
+
+    @property
+    def bytes_written(self):
+        return len(self.data)
+
+    def write(self, data):
+        self.data += data
+
+
+BODY = b"0123456789"
+HEADERS = {"Content-Length": "10", "ETag": '"v1"'}
+
+
+def download(session, sink, **kwargs):
+    return download_with_resume(session, "https://example.com/a.pdf", sink, backoff=0, max_backoff=0, **kwargs)
+
+
+def test_a_dropped_transfer_resumes_with_range_and_if_range():
+    session = FakeSession(
+        FakeResponse(200, BODY, HEADERS, fail_after=4),
+        FakeResponse(206, BODY[4:], {"Content-Range": "bytes 4-9/10", "ETag": '"v1"'})
+    )
+    sink = BytesSink()
+
+    headers = download(session, sink, headers={"If-None-Match": '"v0"'})
+
+    assert sink.data == BODY
+    assert headers["ETag"] == '"v1"'
+    assert session.requests[0] == {"If-None-Match": '"v0"'}
+    # The conditional-GET headers make no sense for a resume; If-Range guards it instead
+    assert session.requests[1] == {"Range": "bytes=4-", "If-Range": '"v1"'}
+
+
+def test_a_server_that_ignores_range_has_our_prefix_skipped():
+    session = FakeSession(
+        FakeResponse(200, BODY, HEADERS, fail_after=4),
+        FakeResponse(200, BODY, HEADERS)
+    )
+    sink = BytesSink()
+
+    download(session, sink)
+
+    assert sink.data == BODY
+
+
+def test_a_file_that_changed_mid_download_is_not_stitched_together():
+    session = FakeSession(
+        FakeResponse(200, BODY, HEADERS, fail_after=4),
+        FakeResponse(200, b"abcdefghij", {"Content-Length": "10", "ETag": '"v2"'})
+    )
+
+    with pytest.raises(ValueError, match="changed"):
+        download(session, BytesSink())
+
+
+def test_not_modified_returns_none():
+    sink = BytesSink()
+    assert download(FakeSession(FakeResponse(304)), sink, headers={"If-None-Match": '"v1"'}) is None
+    assert sink.data == b""
+
+
+def test_short_responses_are_retried_until_attempts_run_out():
+    session = FakeSession(*[FakeResponse(200, BODY[:4], HEADERS) for _ in range(2)])
+
+    with pytest.raises(IncompleteDownload):
+        download(session, BytesSink(), max_attempts=2)
+    assert len(session.requests) == 2
+
+
+def test_only_transient_http_errors_are_retried():
+    session = FakeSession(FakeResponse(503), FakeResponse(200, BODY, HEADERS))
+    sink = BytesSink()
+    download(session, sink)
+    assert sink.data == BODY
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        download(FakeSession(FakeResponse(404), FakeResponse(200, BODY, HEADERS)), BytesSink())
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("bytes 0-9/10", (0, 10)),
+    ("bytes 1000-1999/5000", (1000, 5000)),
+    ("bytes 4-9/*", (4, None)),
+])
+def test_parse_content_range(value, expected):
+    assert _parse_content_range(value) == expected
+
+
+@pytest.mark.parametrize("value", ["", "bytes */10", "items 0-9/10", "bytes=0-9/10"])
+def test_parse_content_range_rejects_anything_else(value):
+    with pytest.raises(ValueError):
+        _parse_content_range(value)
+
+
+MIB = 1024 ** 2
+
+
+def stream_upload(s3, key, data, part_size=5 * MIB):
+    uploader = S3StreamUploader(s3, "bucket1", key, part_size=part_size, metadata={"run": "c1"})
+    for i in range(0, len(data), MIB):
+        uploader.write(data[i:i + MIB])
+    return uploader, uploader.close()
+
+
+def test_small_streams_go_up_in_one_put_with_their_hash_as_metadata(s3):
+    data = b"%PDF-1.7 small"
+    uploader, size = stream_upload(s3, "small.pdf", data)
+
+    head = s3.head_object(Bucket="bucket1", Key="small.pdf")
+    assert size == len(data)
+    assert head["Metadata"] == {"run": "c1", "sha256": hashlib.sha256(data).hexdigest()}
+    assert s3.list_objects_v2(Bucket="bucket1", Prefix="small.pdf.")["KeyCount"] == 0
+
+
+def test_multipart_streams_store_the_whole_object_hash_next_to_it(s3):
+    data = os.urandom(11 * MIB)
+    uploader, size = stream_upload(s3, "big.pdf", data)
+
+    assert size == len(data)
+    assert s3.get_object(Bucket="bucket1", Key="big.pdf")["Body"].read() == data
+    sidecar = s3.get_object(Bucket="bucket1", Key="big.pdf.sha256")["Body"].read().decode("ascii")
+    assert sidecar == hashlib.sha256(data).hexdigest() == uploader.sha256.hexdigest()
+
+
+def test_streamed_and_plain_uploads_of_one_pdf_hash_the_same(splitter, s3, tmp_path):
+    data = os.urandom(11 * MIB)
+    stream_upload(s3, "streamed.pdf", data)
+    # upload_file's 8 MB parts and no metadata, like a manual copy
+    path = tmp_path / "plain.pdf"
+    path.write_bytes(data)
+    s3.upload_file(str(path), "bucket1", "plain.pdf")
+
+    expected = f"sha256:{hashlib.sha256(data).hexdigest()}"
+    assert splitter.recorded_content_hash("bucket1", "streamed.pdf") == expected
+    assert splitter.recorded_content_hash("bucket1", "plain.pdf") is None
+    assert splitter.local_content_hash(str(path)) == splitter.local_content_hash(data) == expected
+
+
+def test_an_aborted_stream_leaves_nothing_behind(s3):
+    uploader = S3StreamUploader(s3, "bucket1", "big.pdf", part_size=5 * MIB)
+    uploader.write(os.urandom(6 * MIB))
+    uploader.abort()
+
+    assert s3.list_objects_v2(Bucket="bucket1")["KeyCount"] == 0
+    assert s3.list_multipart_uploads(Bucket="bucket1").get("Uploads", []) == []
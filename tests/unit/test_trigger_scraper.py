@@ -0,0 +1,63 @@
+import argparse
+import json
+
+import pytest
+
+import trigger_scraper
+
+
+@pytest.mark.parametrize("pages, shards", [(5, 4), (10, 3), (100, 7), (4, 4), (1, 1)])
+def test_page_ranges_split_every_page_once_and_none_are_empty(pages, shards):
+    ranges = trigger_scraper.page_ranges(pages, shards)
+
+    assert len(ranges) == shards
+    assert all(start < end for start, end in ranges)
+    assert trigger_scraper.uncovered_pages(ranges, pages) == []
+    assert sum(end - start for start, end in ranges) == pages
+
+
+def test_uncovered_pages_finds_holes_and_a_short_tail():
+    assert trigger_scraper.uncovered_pages([(0, 2), (3, 5)], 5) == [(2, 3)]
+    assert trigger_scraper.uncovered_pages([(2, 5)], 5) == [(0, 2)]
+    assert trigger_scraper.uncovered_pages([(0, 3), (1, 4)], 6) == [(4, 6)]
+
+
+def test_shard_environments_carry_the_page_range_and_total():
+    args = argparse.Namespace(shards=4, fleet_rate=2.0, dataset=3, pages=5)
+
+    environments = trigger_scraper.shard_environments("run1", args)
+
+    assert [(env["SHARD_PAGE_START"], env["SHARD_PAGE_END"]) for env in environments] == [
+        ("0", "1"), ("1", "2"), ("2", "3"), ("3", "5")
+    ]
+    assert {env["SHARD_PAGE_TOTAL"] for env in environments} == {"5"}
+    assert {env["HOST_RATE_LIMIT"] for env in environments} == {"0.5"}
+
+
+@pytest.fixture
+def reports(s3, monkeypatch):
+    """Writes shard reports of run "run1" to a staging bucket, the way the scraper does."""
+    s3.create_bucket(Bucket="gestaltstack-gestaltstagingbucket-1")
+    monkeypatch.setattr(trigger_scraper, "s3", s3)
+
+    def write(*ranges, total=5):
+        for shard_index, (start, end) in enumerate(ranges):
+            report = {"shard_index": shard_index, "shard_count": len(ranges), "page_start": start,
+                      "page_end": end, "page_total": total, "documents": 10}
+            s3.put_object(Bucket="gestaltstack-gestaltstagingbucket-1", Key=f"crawl_runs/run1/shard-{shard_index}.json",
+                          Body=json.dumps(report))
+
+    return write
+
+
+def test_verify_run_accepts_ranges_that_cover_every_page(reports, capsys):
+    reports((0, 2), (2, 5))
+    trigger_scraper.verify_run("run1")
+    assert "COMPLETE" in capsys.readouterr().out
+
+
+def test_verify_run_rejects_ranges_that_stop_short_of_the_total(reports, capsys):
+    reports((0, 2), (2, 4))
+    with pytest.raises(SystemExit):
+        trigger_scraper.verify_run("run1")
+    assert "pages 4-5" in capsys.readouterr().out
@@ -1,57 +1,190 @@
+import argparse
+import json
+import time
 import boto3
 
 ecs = boto3.client('ecs')
 ec2 = boto3.client('ec2')
+s3 = boto3.client('s3')
 
-print("1. Locating Gestalt Cluster & Task...")
-gestalt_cluster = next((c for c in ecs.list_clusters()['clusterArns'] if 'GestaltCluster' in c), None)
-scraper_task = next((t for t in ecs.list_task_definitions(sort='DESC')['taskDefinitionArns'] if 'GestaltScraperTask' in t), None)
-
-print("2. Locating AWS Default VPC...")
-vpcs = ec2.describe_vpcs(Filters=[{'Name': 'isDefault', 'Values': ['true']}])['Vpcs']
-if not vpcs:
-    print("CRITICAL: Could not find Default VPC.")
-    exit(1)
-    
-default_vpc = vpcs[0]['VpcId']
-
-print("3. Grabbing Default Subnets...")
-subnets = ec2.describe_subnets(Filters=[{'Name': 'vpc-id', 'Values': [default_vpc]}])['Subnets']
-subnet_ids = [s['SubnetId'] for s in subnets]
-
-print("4. Applying Amazon Q's Security Group Rules...")
-sg_name = 'GestaltScraperOutboundSG'
-sgs = ec2.describe_security_groups(Filters=[{'Name': 'vpc-id', 'Values': [default_vpc]}])['SecurityGroups']
-scraper_sg = next((sg for sg in sgs if sg['GroupName'] == sg_name), None)
-
-if not scraper_sg:
-    print(" -> Creating new Security Group (AWS auto-adds Allow-All Outbound)...")
-    new_sg = ec2.create_security_group(GroupName=sg_name, Description='Allow Outbound HTTPS/HTTP', VpcId=default_vpc)
-    sg_id = new_sg['GroupId']
-else:
-    sg_id = scraper_sg['GroupId']
-    print(f" -> Found existing SG: {sg_id}")
-
-print(f"\n5. Launching Fargate Task with Public IP ENABLED...")
-response = ecs.run_task(
-    cluster=gestalt_cluster,
-    taskDefinition=scraper_task,
-    launchType='FARGATE',
-    networkConfiguration={
-        'awsvpcConfiguration': {
-            'subnets': subnet_ids,
-            'securityGroups': [sg_id],
-            'assignPublicIp': 'ENABLED'
+# Must match the container name in GestaltStack
+SCRAPER_CONTAINER = "ScraperContainer"
+
+parser = argparse.ArgumentParser(description="Launch the Gestalt scraper on Fargate.")
+parser.add_argument('--shards', type=int, default=1,
+                    help="Number of scraper tasks to launch. Datasets are split round-robin between them.")
+parser.add_argument('--dataset', type=int,
+                    help="Shard a single dataset (1-based) by page range instead of splitting datasets.")
+parser.add_argument('--pages', type=int,
+                    help="Total number of listing pages of --dataset to split between the shards.")
+parser.add_argument('--fleet-rate', type=float, default=2.0,
+                    help="Requests per second the whole fleet may send to the DOJ site; each shard gets an equal share.")
+parser.add_argument('--verify', metavar='RUN_ID',
+                    help="Don't launch anything; check that every shard of a sharded run finished and covered everything.")
+
+def find_staging_bucket():
+    return next((b['Name'] for b in s3.list_buckets()['Buckets'] if 'gestaltstagingbucket' in b['Name'].lower()), None)
+
+def page_ranges(pages, shards):
+    """Splits pages 0..pages into `shards` contiguous [start, end) ranges whose sizes differ by at most one."""
+    return [(shard_index * pages // shards, (shard_index + 1) * pages // shards) for shard_index in range(shards)]
+
+def uncovered_pages(ranges, total):
+    """The [start, end) gaps the union of ranges leaves in pages 0..total."""
+    gaps = []
+    covered_to = 0
+    for start, end in sorted(ranges):
+        if start > covered_to:
+            gaps.append((covered_to, start))
+        covered_to = max(covered_to, end)
+    if covered_to < total:
+        gaps.append((covered_to, total))
+    return gaps
+
+def shard_environments(run_id, args):
+    """Builds the environment overrides for each shard."""
+    shard_rate = args.fleet_rate / args.shards
+    ranges = page_ranges(args.pages, args.shards) if args.dataset else None
+    environments = []
+    for shard_index in range(args.shards):
+        env = {
+            "SHARD_INDEX": str(shard_index),
+            "SHARD_COUNT": str(args.shards),
+            "CRAWL_RUN_ID": run_id,
+            "HOST_RATE_LIMIT": str(shard_rate)
         }
-    }
-)
-
-if response.get('failures'):
-    print(f"\nFAILED TO LAUNCH:")
-    for failure in response['failures']:
-        print(f" - {failure['reason']}")
-else:
-    task_id = response['tasks'][0]['taskArn'].split('/')[-1]
-    print(f"\nSUCCESS! Task is booting up.")
-    print(f"Task ID: {task_id}")
-    print("Go to the ECS Console -> GestaltCluster -> Tasks tab to watch the logs!")
\ No newline at end of file
+        if ranges:
+            env["SHARD_DATASETS"] = str(args.dataset)
+            env["SHARD_PAGE_START"] = str(ranges[shard_index][0])
+            env["SHARD_PAGE_END"] = str(ranges[shard_index][1])
+            env["SHARD_PAGE_TOTAL"] = str(args.pages)
+        environments.append(env)
+    return environments
+
+def verify_run(run_id):
+    """Aggregates the shard reports of a run and confirms that together they covered everything."""
+    bucket = find_staging_bucket()
+    if not bucket:
+        print("CRITICAL: Could not find the Gestalt staging bucket.")
+        exit(1)
+
+    reports = []
+    listing = s3.list_objects_v2(Bucket=bucket, Prefix=f"crawl_runs/{run_id}/")
+    for obj in listing.get('Contents', []):
+        reports.append(json.loads(s3.get_object(Bucket=bucket, Key=obj['Key'])['Body'].read()))
+
+    if not reports:
+        print(f"No shard reports found for run {run_id}.")
+        exit(1)
+
+    shard_count = reports[0]['shard_count']
+    finished = sorted(r['shard_index'] for r in reports)
+    missing_shards = sorted(set(range(shard_count)) - set(finished))
+    print(f"Run {run_id}: {len(finished)}/{shard_count} shards reported.")
+
+    # Page-range runs cover one dataset; together their page ranges have to cover all of it.
+    # Reports from before page_total was recorded can only be checked up to the last range.
+    if reports[0]['page_end'] is not None:
+        ranges = sorted((r['page_start'], r['page_end']) for r in reports)
+        total = reports[0].get('page_total') or max(end for _, end in ranges)
+        print(f" -> Page ranges covered: {ranges} of {total} pages")
+        missing = [f"pages {start}-{end}" for start, end in uncovered_pages(ranges, total)]
+    else:
+        covered = set(d for r in reports for d in r['datasets'])
+        missing = [f"dataset {d}" for d in range(1, reports[0]['dataset_count'] + 1) if d not in covered]
+
+    print(f" -> Documents in manifest at finish: {max(r['documents'] for r in reports)}")
+    if missing_shards or missing:
+        print(f"INCOMPLETE: missing shards {missing_shards}, uncovered: {missing}")
+        exit(1)
+    print("COMPLETE: every shard finished and the run covered everything.")
+
+def main():
+    args = parser.parse_args()
+    if args.verify:
+        verify_run(args.verify)
+        exit(0)
+
+    if args.dataset and not args.pages:
+        parser.error("--dataset needs --pages so the page range can be split")
+    if args.dataset and args.shards > args.pages:
+        parser.error("--shards can't exceed --pages; some shards would get no pages at all")
+
+    print("1. Locating Gestalt Cluster & Task...")
+    gestalt_cluster = next((c for c in ecs.list_clusters()['clusterArns'] if 'GestaltCluster' in c), None)
+    scraper_task = next((t for t in ecs.list_task_definitions(sort='DESC')['taskDefinitionArns'] if 'GestaltScraperTask' in t), None)
+
+    print("2. Locating AWS Default VPC...")
+    vpcs = ec2.describe_vpcs(Filters=[{'Name': 'isDefault', 'Values': ['true']}])['Vpcs']
+    if not vpcs:
+        print("CRITICAL: Could not find Default VPC.")
+        exit(1)
+
+    default_vpc = vpcs[0]['VpcId']
+
+    print("3. Grabbing Default Subnets...")
+    subnets = ec2.describe_subnets(Filters=[{'Name': 'vpc-id', 'Values': [default_vpc]}])['Subnets']
+    subnet_ids = [s['SubnetId'] for s in subnets]
+
+    print("4. Applying Amazon Q's Security Group Rules...")
+    sg_name = 'GestaltScraperOutboundSG'
+    sgs = ec2.describe_security_groups(Filters=[{'Name': 'vpc-id', 'Values': [default_vpc]}])['SecurityGroups']
+    scraper_sg = next((sg for sg in sgs if sg['GroupName'] == sg_name), None)
+
+    if not scraper_sg:
+        print(" -> Creating new Security Group (AWS auto-adds Allow-All Outbound)...")
+        new_sg = ec2.create_security_group(GroupName=sg_name, Description='Allow Outbound HTTPS/HTTP', VpcId=default_vpc)
+        sg_id = new_sg['GroupId']
+    else:
+        sg_id = scraper_sg['GroupId']
+        print(f" -> Found existing SG: {sg_id}")
+
+    # A single unsharded task keeps the original behaviour: no overrides, one shared state file
+    if args.shards > 1:
+        run_id = time.strftime("%Y%m%d-%H%M%S")
+        environments = shard_environments(run_id, args)
+        print(f"\n5. Launching {args.shards} Fargate shards for run {run_id} with Public IP ENABLED...")
+    else:
+        run_id = None
+        environments = [None]
+        print(f"\n5. Launching Fargate Task with Public IP ENABLED...")
+
+    for env in environments:
+        overrides = {}
+        if env:
+            overrides = {'containerOverrides': [{
+                'name': SCRAPER_CONTAINER,
+                'environment': [{'name': name, 'value': value} for name, value in env.items()]
+            }]}
+
+        response = ecs.run_task(
+            cluster=gestalt_cluster,
+            taskDefinition=scraper_task,
+            launchType='FARGATE',
+            networkConfiguration={
+                'awsvpcConfiguration': {
+                    'subnets': subnet_ids,
+                    'securityGroups': [sg_id],
+                    'assignPublicIp': 'ENABLED'
+                }
+            },
+            overrides=overrides
+        )
+
+        if response.get('failures'):
+            print(f"\nFAILED TO LAUNCH{' shard ' + env['SHARD_INDEX'] if env else ''}:")
+            for failure in response['failures']:
+                print(f" - {failure['reason']}")
+        else:
+            task_id = response['tasks'][0]['taskArn'].split('/')[-1]
+            print(f"\nSUCCESS! Task is booting up.")
+            print(f"Task ID: {task_id}")
+            if env:
+                print(f"Shard {env['SHARD_INDEX']}: {env}")
+
+    print("Go to the ECS Console -> GestaltCluster -> Tasks tab to watch the logs!")
+    if run_id:
+        print(f"When every shard has stopped, run: python trigger_scraper.py --verify {run_id}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Compact per-document extraction artifacts.
+
+Layout of an artifact object:
+
+    MAGIC (6 bytes) | header length (8 bytes, big-endian) | header | page blocks...
+
+The header is zlib-compressed JSON describing the source document and holding a page
+index of [page_num, offset, length] entries, with offsets relative to the first page block.
+Every page block is zlib-compressed JSON with the page class, text and image references, so a
+consumer can fetch page N with two small ranged GETs instead of downloading the whole blob.
+"""
+import io
+import json
+import struct
+import tempfile
+import zlib
+
+MAGIC = b"GSTA1\n"
+PREFIX_SIZE = len(MAGIC) + 8
+# First ranged GET when reading; big enough to hold the header of most documents
+HEADER_PROBE_BYTES = 64 * 1024
+
+
+class ArtifactWriter:
+    """Collects page blocks for one document and uploads them as a single object."""
+
+    def __init__(self, source_bucket, source_key, page_start, page_end, spool_max_bytes=32 * 1024 ** 2):
+        self.source_bucket = source_bucket
+        self.source_key = source_key
+        self.page_start = page_start
+        self.page_end = page_end
+        # Page blocks stay in memory until they outgrow spool_max_bytes, then move to disk
+        self._blocks = tempfile.SpooledTemporaryFile(max_size=spool_max_bytes)
+        self._index = []
+        self._offset = 0
+        # {"bucket", "key", "similarity"} of the document this one nearly duplicates, if any
+        self.near_duplicate_of = None
+
+    def add_page(self, result):
+        block = zlib.compress(json.dumps({
+            "page_num": result["page_num"],
+            "class": result["class"],
+            "text": result["text"],
+            # key and format locate the normalized copy; both are None when images aren't normalized
+            "images": [
+                {"index": image["index"], "xref": image["xref"], "ext": image["ext"], "sha256": image["sha256"],
+                 "key": image.get("key"), "format": image.get("format")}
+                for image in result["images"]
+            ]
+        }).encode("utf-8"))
+
+        self._blocks.write(block)
+        self._index.append([result["page_num"], self._offset, len(block)])
+        self._offset += len(block)
+
+    def upload(self, s3, bucket, key, transfer_config=None):
+        """Uploads header and page blocks as one object; large artifacts go up as a multipart upload."""
+        header = zlib.compress(json.dumps({
+            "source": {"bucket": self.source_bucket, "key": self.source_key},
+            "page_start": self.page_start,
+            "page_end": self.page_end,
+            "near_duplicate_of": self.near_duplicate_of,
+            "pages": self._index
+        }).encode("utf-8"))
+
+        self._blocks.seek(0)
+        body = _ConcatReader([io.BytesIO(MAGIC + struct.pack(">Q", len(header)) + header), self._blocks])
+        try:
+            s3.upload_fileobj(body, bucket, key, Config=transfer_config)
+        finally:
+            self._blocks.close()
+
+        return PREFIX_SIZE + len(header) + self._offset
+
+
+class _ConcatReader(io.RawIOBase):
+    """Read-only file object that reads through several file objects back to back."""
+
+    def __init__(self, parts):
+        self._parts = list(parts)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self._parts:
+            data = self._parts[0].read(len(buffer))
+            if data:
+                buffer[:len(data)] = data
+                return len(data)
+            self._parts.pop(0)
+        return 0
+
+
+def _get_range(s3, bucket, key, start, end):
+    return s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end}")['Body'].read()
+
+
+def read_header(s3, bucket, key):
+    """Returns (header, data_start) for an artifact, using ranged GETs only."""
+    probe = _get_range(s3, bucket, key, 0, HEADER_PROBE_BYTES - 1)
+    if probe[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"s3://{bucket}/{key} is not an extraction artifact")
+
+    (header_length,) = struct.unpack(">Q", probe[len(MAGIC):PREFIX_SIZE])
+    data_start = PREFIX_SIZE + header_length
+    header = probe[PREFIX_SIZE:data_start]
+    if len(header) < header_length:
+        header += _get_range(s3, bucket, key, len(probe), data_start - 1)
+
+    return json.loads(zlib.decompress(header)), data_start
+
+
+def read_page(s3, bucket, key, page_num, header=None):
+    """Fetches a single page block from an artifact. Pass a cached (header, data_start) to skip the header GET."""
+    header, data_start = header or read_header(s3, bucket, key)
+
+    for indexed_page, offset, length in header["pages"]:
+        if indexed_page == page_num:
+            block = _get_range(s3, bucket, key, data_start + offset, data_start + offset + length - 1)
+            return json.loads(zlib.decompress(block))
+
+    raise KeyError(f"Page {page_num} is not in s3://{bucket}/{key}")
@@ -0,0 +1,267 @@
+"""SQS consumer for the splitter: the container's entry point.
+
+This module only does the queue plumbing (receiving, deleting, visibility heartbeats) and
+hands every message to splitter.handle_message. In batch mode each document runs in a
+worker process of its own: PyMuPDF isn't thread-safe and holds the GIL, so processes are
+what let one task use all of its cores. A worker that crashes (MuPDF on a malformed PDF)
+only costs a retry of the messages that were in flight.
+
+It is kept light on purpose. Spawned processes re-run the parent's __main__ module, so
+nothing here builds clients or opens files at import time; only the document workers
+import splitter, with its S3 clients, indexes and image pipeline.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+import boto3
+
+# You will need to pass this environment variable when running the container
+QUEUE_URL = os.environ.get('SPLITTER_QUEUE_URL')
+
+# Consumer tuning. "serial" handles one message at a time in this process; "batch" receives
+# up to BATCH_SIZE messages per call and works on up to MAX_WORKERS documents at once, each
+# in its own worker process.
+CONSUMER_MODE = os.environ.get('SPLITTER_CONSUMER_MODE', 'serial')
+BATCH_SIZE = min(int(os.environ.get('SPLITTER_BATCH_SIZE', '10')), 10)  # SQS caps this at 10
+MAX_WORKERS = int(os.environ.get('SPLITTER_MAX_WORKERS', str(os.cpu_count() or 1)))
+# Each document worker may start its own page pool (SPLITTER_PAGE_WORKERS, see splitter.py).
+# In batch mode that setting is capped at the document's share of the CPUs, so MAX_WORKERS
+# documents don't start MAX_WORKERS x PAGE_WORKERS extraction processes between them. The
+# image upload threads mostly wait on S3 and are left alone.
+# Must match (or exceed) the visibility timeout configured on GestaltSplitterQueue
+VISIBILITY_TIMEOUT = int(os.environ.get('SPLITTER_VISIBILITY_TIMEOUT', '900'))
+HEARTBEAT_INTERVAL = int(os.environ.get('SPLITTER_HEARTBEAT_SECONDS', '300'))
+# A batch worker that has been idle this long pushes its search and near-dup index changes
+# to S3, so they are out before the service scales the task away
+IDLE_PUBLISH_SECONDS = int(os.environ.get('SPLITTER_IDLE_PUBLISH_SECONDS', '30'))
+
+# Created in main(); worker processes that re-import this module never need it
+sqs = None
+
+
+def chunked(items, size):
+    """Splits a list into consecutive chunks of at most `size` items."""
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+class VisibilityHeartbeat(threading.Thread):
+    """Background thread that keeps in-flight messages invisible while they are being worked on.
+
+    Slow documents would otherwise outlive the queue's visibility timeout and get handed
+    to a second worker while the first one is still busy with them.
+    """
+
+    def __init__(self, interval, visibility_timeout):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.visibility_timeout = visibility_timeout
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def track(self, message):
+        with self._lock:
+            self._in_flight[message['MessageId']] = message['ReceiptHandle']
+
+    def untrack(self, message):
+        with self._lock:
+            self._in_flight.pop(message['MessageId'], None)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            with self._lock:
+                entries = [
+                    {'Id': message_id, 'ReceiptHandle': receipt_handle, 'VisibilityTimeout': self.visibility_timeout}
+                    for message_id, receipt_handle in self._in_flight.items()
+                ]
+
+            for batch in chunked(entries, 10):
+                try:
+                    response = sqs.change_message_visibility_batch(QueueUrl=QUEUE_URL, Entries=batch)
+                    for failure in response.get('Failed', []):
+                        print(f"Heartbeat failed for message {failure['Id']}: {failure.get('Message')}")
+                except Exception as e:
+                    print(f"Error extending visibility timeouts: {str(e)}")
+
+
+def delete_messages(messages):
+    """Deletes processed messages from SQS in batches of 10."""
+    for batch in chunked(messages, 10):
+        entries = [{'Id': message['MessageId'], 'ReceiptHandle': message['ReceiptHandle']} for message in batch]
+        try:
+            response = sqs.delete_message_batch(QueueUrl=QUEUE_URL, Entries=entries)
+            for failure in response.get('Failed', []):
+                print(f"Failed to delete message {failure['Id']}: {failure.get('Message')}")
+        except Exception as e:
+            print(f"Error deleting messages: {str(e)}")
+
+
+def poll_queue():
+    """Continuously polls the SQS queue for new files and processes them one at a time, in this process."""
+    import splitter
+
+    print(f"Listening to queue: {QUEUE_URL}")
+    if splitter.neardup_sync is not None:
+        splitter.neardup_sync.sync()
+
+    while True:
+        # Long polling: Wait up to 20 seconds for a message to arrive
+        response = sqs.receive_message(
+            QueueUrl=QUEUE_URL,
+            MaxNumberOfMessages=1,
+            WaitTimeSeconds=20
+        )
+
+        if 'Messages' in response:
+            for message in response['Messages']:
+                if splitter.handle_message(message):
+                    # Delete the message from the queue so it isn't processed again
+                    print("Processing complete. Deleting message from SQS.")
+                    sqs.delete_message(
+                        QueueUrl=QUEUE_URL,
+                        ReceiptHandle=message['ReceiptHandle']
+                    )
+        else:
+            # Idle: get what's been indexed out before the service scales this task away
+            splitter.publish_indexes()
+
+
+# --- Batch worker processes ---
+_splitter = None
+_busy = False
+
+
+def _init_document_worker():
+    global _splitter
+    import splitter
+    _splitter = splitter
+
+    # The first sync pulls in what other workers have seen
+    if splitter.neardup_sync is not None:
+        splitter.neardup_sync.sync()
+    threading.Thread(target=_publish_when_idle, daemon=True).start()
+
+
+def _process_message(message):
+    global _busy
+    _busy = True
+    try:
+        return _splitter.handle_message(message)
+    finally:
+        _busy = False
+
+
+def _publish_when_idle():
+    # Workers never see the queue, so each one watches for its own quiet spells. Publishing
+    # is safe next to a document that has just started; the indexes take their own locks.
+    while True:
+        time.sleep(IDLE_PUBLISH_SECONDS)
+        if not _busy:
+            _splitter.publish_indexes()
+
+
+def page_workers_per_document():
+    """SPLITTER_PAGE_WORKERS, capped so every document worker's page pool fits on the task's CPUs."""
+    share = max(1, (os.cpu_count() or 1) // MAX_WORKERS)
+    return min(int(os.environ.get('SPLITTER_PAGE_WORKERS', '1')), share)
+
+
+def new_document_pool():
+    # "spawn" so workers don't inherit this process's boto3 and heartbeat threads mid-flight
+    return ProcessPoolExecutor(
+        max_workers=MAX_WORKERS,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_document_worker
+    )
+
+
+def poll_queue_batched(stop=None):
+    """Receives up to BATCH_SIZE messages per call and processes them on MAX_WORKERS worker processes.
+
+    Runs until the optional stop event is set; then it finishes what is in flight and returns.
+    """
+    print(f"Listening to queue: {QUEUE_URL} (batch mode, {MAX_WORKERS} worker processes)")
+
+    heartbeat = VisibilityHeartbeat(HEARTBEAT_INTERVAL, VISIBILITY_TIMEOUT)
+    heartbeat.start()
+    in_flight = {}
+    pool = new_document_pool()
+
+    try:
+        while in_flight or not (stop and stop.is_set()):
+            # 1. Collect finished documents and delete their messages in one call
+            done = [future for future in in_flight if future.done()]
+            processed = []
+            pool_broken = False
+            for future in done:
+                message = in_flight.pop(future)
+                heartbeat.untrack(message)
+                try:
+                    if future.result():
+                        processed.append(message)
+                except BrokenProcessPool:
+                    pool_broken = True
+                    print(f"A worker process died; message {message['MessageId']} goes back to the queue.")
+                except Exception as e:
+                    print(f"Error processing message {message['MessageId']}: {str(e)}")
+            if processed:
+                print(f"Processing complete for {len(processed)} message(s). Deleting from SQS.")
+                delete_messages(processed)
+
+            # A dead worker takes the whole pool down, and every document in it fails with it
+            if pool_broken:
+                pool.shutdown(wait=False, cancel_futures=True)
+                pool = new_document_pool()
+
+            # 2. Only ask SQS for as many messages as we have free workers
+            free_slots = MAX_WORKERS - len(in_flight)
+            if free_slots <= 0 or (stop and stop.is_set()):
+                if in_flight:
+                    wait(in_flight, return_when=FIRST_COMPLETED)
+                continue
+
+            # Long poll when idle; keep it short while documents are in flight
+            # so finished messages are deleted promptly.
+            response = sqs.receive_message(
+                QueueUrl=QUEUE_URL,
+                MaxNumberOfMessages=min(BATCH_SIZE, free_slots),
+                WaitTimeSeconds=1 if in_flight else 20
+            )
+
+            for message in response.get('Messages', []):
+                heartbeat.track(message)
+                in_flight[pool.submit(_process_message, message)] = message
+    finally:
+        heartbeat.stop()
+        pool.shutdown(wait=True)
+
+
+def main():
+    global sqs
+    if not QUEUE_URL:
+        print("ERROR: SPLITTER_QUEUE_URL environment variable is not set.")
+        exit(1)
+
+    # The memory dedup index lives in one process, so each worker would only dedup against itself
+    if CONSUMER_MODE == 'batch' and MAX_WORKERS > 1 and os.environ.get('SPLITTER_DEDUP_BACKEND') == 'memory':
+        print("ERROR: SPLITTER_DEDUP_BACKEND=memory only works with one worker process; use sqlite or s3.")
+        exit(1)
+
+    sqs = boto3.client('sqs')
+    if CONSUMER_MODE == 'batch':
+        # Spawned workers read their settings from the environment they inherit
+        os.environ['SPLITTER_PAGE_WORKERS'] = str(page_workers_per_document())
+        poll_queue_batched()
+    else:
+        poll_queue()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""Content-hash dedup index: which key holds each distinct document, and which keys are copies.
+
+The first key to claim a hash holds it, but only as "pending" until its document has been
+processed: commit() then makes it canonical for good, and release() (after a failure) hands
+the hash back so the next copy can take over. While a claim is pending, claims from other
+keys raise ClaimPending instead of being recorded as aliases, so a copy is never skipped in
+favour of a document that may still fail. A pending claim older than claim_seconds (its
+worker presumably died) can be taken over.
+
+The memory backend only spans one process. The SQLite backend spans every process that opens
+the same file, i.e. one task's workers. Only the S3 backend spans a fleet.
+"""
+import json
+import sqlite3
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+# Well past the splitter queue's visibility timeout, so a live claim is never taken over
+DEFAULT_CLAIM_SECONDS = 3600
+
+
+class ClaimPending(Exception):
+    """Another key holds a pending claim on this content hash; try again once it's settled."""
+
+
+class MemoryDedupIndex:
+    """Process-local dedup index. Handy for tests and one-off runs."""
+
+    def __init__(self, claim_seconds=DEFAULT_CLAIM_SECONDS):
+        self.claim_seconds = claim_seconds
+        # hash -> {"bucket", "key", "committed", "claimed"}
+        self._documents = {}
+        self._aliases = {}
+        self._lock = threading.Lock()
+
+    def claim(self, content_hash, bucket, key):
+        """Records a document by content hash.
+
+        Returns None if (bucket, key) now holds the hash (pending until commit()) and should
+        be processed, or the canonical {"bucket", "key"} if it is a duplicate (which is then
+        recorded as an alias). Raises ClaimPending while another key's claim is unsettled.
+        """
+        document = {"bucket": bucket, "key": key}
+        with self._lock:
+            holder = self._documents.get(content_hash)
+            if holder is None or _owned_by(holder, document) or _expired(holder, self.claim_seconds):
+                if holder is None or not _owned_by(holder, document):
+                    self._documents[content_hash] = dict(document, committed=False, claimed=time.time())
+                elif not holder["committed"]:
+                    holder["claimed"] = time.time()
+                return None
+            if not holder["committed"]:
+                raise ClaimPending(f"{content_hash} is being processed as '{holder['key']}'")
+
+            aliases = self._aliases.setdefault(content_hash, [])
+            if document not in aliases:
+                aliases.append(document)
+            return {"bucket": holder["bucket"], "key": holder["key"]}
+
+    def commit(self, content_hash, bucket, key):
+        with self._lock:
+            holder = self._documents.get(content_hash)
+            if holder is not None and _owned_by(holder, {"bucket": bucket, "key": key}):
+                holder["committed"] = True
+
+    def release(self, content_hash, bucket, key):
+        with self._lock:
+            holder = self._documents.get(content_hash)
+            if holder is not None and _owned_by(holder, {"bucket": bucket, "key": key}) and not holder["committed"]:
+                del self._documents[content_hash]
+
+    def aliases(self, content_hash):
+        with self._lock:
+            return list(self._aliases.get(content_hash, []))
+
+
+def _owned_by(holder, document):
+    return (holder["bucket"], holder["key"]) == (document["bucket"], document["key"])
+
+
+def _expired(holder, claim_seconds):
+    return not holder.get("committed", True) and time.time() - holder["claimed"] > claim_seconds
+
+
+class SQLiteDedupIndex:
+    """Dedup index in a local SQLite file, so it survives restarts without any AWS dependency."""
+
+    def __init__(self, path, claim_seconds=DEFAULT_CLAIM_SECONDS):
+        self.claim_seconds = claim_seconds
+        # Other worker processes of the task may hold the write lock for a moment
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS documents (content_hash TEXT PRIMARY KEY, bucket TEXT, key TEXT, first_seen REAL, "
+                "committed INTEGER NOT NULL DEFAULT 1)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS aliases (content_hash TEXT, bucket TEXT, key TEXT, seen REAL, "
+                "PRIMARY KEY (content_hash, bucket, key))"
+            )
+            # Files from before pending claims only hold finished documents
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(documents)")]
+            if "committed" not in columns:
+                self._conn.execute("ALTER TABLE documents ADD COLUMN committed INTEGER NOT NULL DEFAULT 1")
+
+    def claim(self, content_hash, bucket, key):
+        now = time.time()
+        with self._lock, self._conn:
+            # BEGIN IMMEDIATE: another process must not slip in between the read and the write
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute(
+                "INSERT OR IGNORE INTO documents VALUES (?, ?, ?, ?, 0)", (content_hash, bucket, key, now)
+            )
+            canonical_bucket, canonical_key, claimed, committed = self._conn.execute(
+                "SELECT bucket, key, first_seen, committed FROM documents WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+            if (canonical_bucket, canonical_key) == (bucket, key):
+                if not committed:
+                    self._conn.execute("UPDATE documents SET first_seen = ? WHERE content_hash = ?", (now, content_hash))
+                return None
+            if not committed:
+                if now - claimed <= self.claim_seconds:
+                    raise ClaimPending(f"{content_hash} is being processed as '{canonical_key}'")
+                self._conn.execute(
+                    "UPDATE documents SET bucket = ?, key = ?, first_seen = ? WHERE content_hash = ?",
+                    (bucket, key, now, content_hash)
+                )
+                return None
+
+            self._conn.execute(
+                "INSERT OR IGNORE INTO aliases VALUES (?, ?, ?, ?)", (content_hash, bucket, key, now)
+            )
+            return {"bucket": canonical_bucket, "key": canonical_key}
+
+    def commit(self, content_hash, bucket, key):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE documents SET committed = 1 WHERE content_hash = ? AND bucket = ? AND key = ?",
+                (content_hash, bucket, key)
+            )
+
+    def release(self, content_hash, bucket, key):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM documents WHERE content_hash = ? AND bucket = ? AND key = ? AND committed = 0",
+                (content_hash, bucket, key)
+            )
+
+    def aliases(self, content_hash):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT bucket, key FROM aliases WHERE content_hash = ? ORDER BY seen", (content_hash,)
+            ).fetchall()
+        return [{"bucket": bucket, "key": key} for bucket, key in rows]
+
+
+class S3DedupIndex:
+    """Dedup index shared by every worker, kept as small JSON objects in S3.
+
+    {prefix}{hash}.json names the holder of a hash and whether it is committed. It is created
+    with a conditional PUT, so exactly one worker wins, and an expired pending claim is taken
+    over with a PUT conditional on its ETag. Aliases are recorded under {prefix}{hash}/aliases/.
+    Without a fixed bucket, the index lives in the bucket of each document.
+    """
+
+    def __init__(self, s3, bucket=None, prefix="dedup/", claim_seconds=DEFAULT_CLAIM_SECONDS):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+        self.claim_seconds = claim_seconds
+
+    def _record_key(self, content_hash):
+        return f"{self.prefix}{content_hash}.json"
+
+    def _put_record(self, index_bucket, content_hash, document, committed, condition):
+        record = dict(document, committed=committed, claimed=time.time())
+        try:
+            self.s3.put_object(Bucket=index_bucket, Key=self._record_key(content_hash), Body=json.dumps(record),
+                               **condition)
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                raise
+            return False
+
+    def claim(self, content_hash, bucket, key):
+        index_bucket = self.bucket or bucket
+        document = {"bucket": bucket, "key": key}
+
+        if self._put_record(index_bucket, content_hash, document, False, {'IfNoneMatch': '*'}):
+            return None
+
+        response = self.s3.get_object(Bucket=index_bucket, Key=self._record_key(content_hash))
+        holder = json.loads(response['Body'].read())
+        if _owned_by(holder, document):
+            return None
+        if not holder.get("committed", True):
+            if not _expired(holder, self.claim_seconds):
+                raise ClaimPending(f"{content_hash} is being processed as '{holder['key']}'")
+            if self._put_record(index_bucket, content_hash, document, False, {'IfMatch': response['ETag']}):
+                return None
+            raise ClaimPending(f"{content_hash} was just claimed by another worker")
+
+        self.s3.put_object(
+            Bucket=index_bucket,
+            Key=f"{self.prefix}{content_hash}/aliases/{bucket}/{key}",
+            Body=json.dumps(dict(document, seen=time.time()))
+        )
+        return {"bucket": holder["bucket"], "key": holder["key"]}
+
+    def commit(self, content_hash, bucket, key):
+        # Only the holder commits, so there's nobody to race with
+        self._put_record(self.bucket or bucket, content_hash, {"bucket": bucket, "key": key}, True, {})
+
+    def release(self, content_hash, bucket, key):
+        index_bucket = self.bucket or bucket
+        try:
+            response = self.s3.get_object(Bucket=index_bucket, Key=self._record_key(content_hash))
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return
+            raise
+        holder = json.loads(response['Body'].read())
+        if _owned_by(holder, {"bucket": bucket, "key": key}) and not holder.get("committed", True):
+            self.s3.delete_object(Bucket=index_bucket, Key=self._record_key(content_hash))
+
+    def aliases(self, content_hash, bucket=None):
+        index_bucket = self.bucket or bucket
+        alias_prefix = f"{self.prefix}{content_hash}/aliases/"
+        aliases = []
+        for listing in self.s3.get_paginator('list_objects_v2').paginate(Bucket=index_bucket, Prefix=alias_prefix):
+            for obj in listing.get('Contents', []):
+                bucket_name, _, key = obj['Key'][len(alias_prefix):].partition('/')
+                aliases.append({"bucket": bucket_name, "key": key})
+        return aliases
+
+
+def open_dedup_index(backend, s3=None, bucket=None, prefix="dedup/", path="/tmp/gestalt_dedup.db",
+                     claim_seconds=DEFAULT_CLAIM_SECONDS):
+    """Builds the dedup index for a backend name ("memory", "sqlite" or "s3"); "none" or empty disables it."""
+    if not backend or backend == "none":
+        return None
+    if backend == "memory":
+        return MemoryDedupIndex(claim_seconds)
+    if backend == "sqlite":
+        return SQLiteDedupIndex(path, claim_seconds)
+    if backend == "s3":
+        return S3DedupIndex(s3, bucket, prefix, claim_seconds)
+    raise ValueError(f"Unknown dedup backend: {backend}")
@@ -0,0 +1,171 @@
+"""Page extraction: everything that runs inside the page-worker processes.
+
+The splitter's page pool spawns its workers, and a spawned process imports the module its
+initializer and tasks live in. This module therefore has no import-time side effects beyond
+reading its settings: no AWS clients, no indexes, no threads. Keep it that way.
+"""
+import hashlib
+import itertools
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz  # This is PyMuPDF
+
+import image_pipeline
+
+# Page classification. Every page is labelled "text" (native text), "scanned" (image-only)
+# or "mixed" before the heavy work; images are only decoded on scanned and mixed pages.
+# A page counts as native text when it has at least CLASSIFY_MIN_TEXT_CHARS characters and
+# its images (at most CLASSIFY_TEXT_MAX_IMAGES, e.g. a logo and a signature) cover less
+# than CLASSIFY_TEXT_MAX_COVERAGE of the page.
+CLASSIFY_PAGES = os.environ.get('SPLITTER_CLASSIFY_PAGES', '1') == '1'
+CLASSIFY_MIN_TEXT_CHARS = int(os.environ.get('SPLITTER_CLASSIFY_MIN_TEXT_CHARS', '50'))
+CLASSIFY_TEXT_MAX_COVERAGE = float(os.environ.get('SPLITTER_CLASSIFY_TEXT_MAX_COVERAGE', '0.15'))
+CLASSIFY_TEXT_MAX_IMAGES = int(os.environ.get('SPLITTER_CLASSIFY_TEXT_MAX_IMAGES', '2'))
+
+
+def open_pdf(source):
+    """Opens a PDF from either a local path or an in-memory bytes object."""
+    if isinstance(source, bytes):
+        return fitz.open(stream=source, filetype="pdf")
+    return fitz.open(source)
+
+
+def classify_page(page_rect, text, image_boxes):
+    """Labels a page "text", "scanned" or "mixed" from its text length and image layout alone."""
+    if not image_boxes:
+        return "text"
+
+    if len(text.strip()) < CLASSIFY_MIN_TEXT_CHARS:
+        return "scanned"
+
+    page_area = page_rect.get_area() or 1
+    covered = sum((fitz.Rect(bbox) & page_rect).get_area() for bbox in image_boxes)
+    if min(covered / page_area, 1.0) < CLASSIFY_TEXT_MAX_COVERAGE and len(image_boxes) <= CLASSIFY_TEXT_MAX_IMAGES:
+        return "text"
+
+    return "mixed"
+
+
+def extract_page(doc, page_num, xref_memo, normalize=None, skip_images=False):
+    """Pulls the native text and the embedded images out of a single page.
+
+    xref_memo maps the xrefs already extracted from this document to their ext, hash and
+    output format; images that repeat on later pages (letterheads, stamps) come back with
+    repeat=True and image=None. Pages classified as native text skip image extraction entirely,
+    as does every page with skip_images.
+
+    normalize holds normalize_image()'s settings. With it, every new image is normalized right
+    here, in the process that extracted it, and only the result is kept: "output" replaces the
+    raw bytes in "image", so a page never holds on to full-size scans. Without it, images keep
+    their raw bytes.
+    """
+    page = doc[page_num]
+    text = page.get_text()
+    image_list = page.get_images(full=True)
+
+    page_class = None
+    image_info = None
+    if skip_images and not CLASSIFY_PAGES:
+        return {"page_num": page_num, "class": page_class, "text": text, "images": [],
+                "images_skipped": len(image_list), "decoded": 0, "decode_seconds": 0.0}
+    if CLASSIFY_PAGES:
+        # get_image_info only reads placement, it doesn't decode anything
+        image_info = page.get_image_info(xrefs=True)
+        page_class = classify_page(page.rect, text, [info["bbox"] for info in image_info])
+        if page_class == "text" or skip_images:
+            return {"page_num": page_num, "class": page_class, "text": text, "images": [],
+                    "images_skipped": len(image_list), "decoded": 0, "decode_seconds": 0.0}
+
+    if image_info is None and image_list:
+        image_info = page.get_image_info(xrefs=True)
+    # An image drawn more than once on a page is sized for its largest placement
+    placements = {}
+    for info in image_info or []:
+        x0, y0, x1, y1 = info["bbox"]
+        width, height = abs(x1 - x0), abs(y1 - y0)
+        current = placements.get(info["xref"])
+        if current is None or width * height > current[0] * current[1]:
+            placements[info["xref"]] = (width, height)
+
+    images = []
+    decoded = 0
+    decode_started = time.perf_counter()
+    for img_index, img in enumerate(image_list):
+        xref = img[0]
+        image = {"index": img_index, "xref": xref, "image": None, "repeat": xref in xref_memo}
+        if not image["repeat"]:
+            base_image = doc.extract_image(xref)
+            image.update({
+                "image": base_image["image"],
+                "ext": base_image["ext"],
+                "width": base_image["width"],
+                "height": base_image["height"],
+                "placement": placements.get(xref)
+            })
+            memo = {"ext": base_image["ext"], "sha256": hashlib.sha256(base_image["image"]).hexdigest(), "format": None}
+            if normalize is not None:
+                image["output"] = image_pipeline.normalize_extracted(image, normalize)
+                image["image"] = None
+                memo["format"] = image["output"]["ext"]
+            xref_memo[xref] = memo
+            decoded += 1
+
+        image["ext"] = xref_memo[xref]["ext"]
+        image["sha256"] = xref_memo[xref]["sha256"]
+        image["format"] = xref_memo[xref]["format"]
+        images.append(image)
+
+    return {"page_num": page_num, "class": page_class, "text": text, "images": images,
+            "images_skipped": 0, "decoded": decoded, "decode_seconds": time.perf_counter() - decode_started}
+
+
+# Each page-worker process opens the document once and keeps it for all of its page ranges
+_worker_doc = None
+_worker_xref_memo = {}
+
+
+_worker_normalize = None
+_worker_skip_images = False
+
+
+def _init_page_worker(source, normalize=None, skip_images=False):
+    global _worker_doc, _worker_normalize, _worker_skip_images
+    _worker_doc = open_pdf(source)
+    _worker_normalize = normalize
+    _worker_skip_images = skip_images
+
+
+def _extract_page_range(page_start, page_end):
+    return [extract_page(_worker_doc, page_num, _worker_xref_memo, _worker_normalize, _worker_skip_images)
+            for page_num in range(page_start, page_end)]
+
+
+def iter_pages_parallel(source, page_start, page_end, workers, chunk_size, normalize=None, skip_images=False):
+    """Extracts disjoint chunk_size page ranges on a pool of worker processes and yields the pages back in order."""
+    ranges = iter([
+        (start, min(start + chunk_size, page_end))
+        for start in range(page_start, page_end, chunk_size)
+    ])
+
+    # "spawn" rather than "fork": the batch consumer runs boto3 threads in this process.
+    # In-memory sources are pickled once per worker, which the splitter's STREAM_MAX_BYTES keeps bounded.
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=context,
+        initializer=_init_page_worker,
+        initargs=(source, normalize, skip_images)
+    ) as pool:
+        # Keep a bounded window of ranges in flight so a huge document doesn't
+        # pile up extracted pages in memory faster than we consume them
+        pending = deque(pool.submit(_extract_page_range, *page_range) for page_range in itertools.islice(ranges, workers * 2))
+        while pending:
+            results = pending.popleft().result()
+            next_range = next(ranges, None)
+            if next_range:
+                pending.append(pool.submit(_extract_page_range, *next_range))
+            yield from results
@@ -0,0 +1,83 @@
+import threading
+from collections import OrderedDict
+
+from botocore.exceptions import ClientError
+
+
+class ImageDedupCache:
+    """Remembers which images (by content hash) have already been handed downstream.
+
+    Hashes live in a bounded in-process LRU. When an S3 client and bucket are given, misses
+    fall through to a shared key index in S3 (one empty object per hash), so duplicates are
+    also caught across workers and restarts.
+
+    An image only counts as seen once it has been delivered: check() claims a new hash for
+    the caller, and commit() records it after the upload went through. release() gives up a
+    claim that was never delivered, so the image is tried again next time instead of being
+    skipped for good. Two workers that claim the same hash at once both deliver it, which is
+    harmless because the outputs are named by content.
+    """
+
+    def __init__(self, max_entries, s3=None, bucket=None, prefix="images/"):
+        self.max_entries = max_entries
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+        self._entries = OrderedDict()
+        # Claimed by a document in this process but not delivered yet
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def check(self, digest):
+        """Returns True if the image was delivered before (or is being delivered); otherwise claims it."""
+        with self._lock:
+            if digest in self._entries:
+                self._entries.move_to_end(digest)
+                return True
+            if digest in self._pending:
+                return True
+            self._pending.add(digest)
+
+        if self._in_index(digest):
+            with self._lock:
+                self._pending.discard(digest)
+                self._remember(digest)
+            return True
+        return False
+
+    def commit(self, digest):
+        """Records a claimed image as delivered, here and in the shared index."""
+        if self.s3 and self.bucket:
+            try:
+                self.s3.put_object(Bucket=self.bucket, Key=f"{self.prefix}{digest}", Body=b"")
+            except ClientError as e:
+                # Only costs a repeat delivery by another worker
+                print(f"Image index update failed for {digest}: {str(e)}")
+
+        with self._lock:
+            self._pending.discard(digest)
+            self._remember(digest)
+
+    def release(self, digest):
+        """Gives up a claim that wasn't delivered; a no-op once the image is committed."""
+        with self._lock:
+            self._pending.discard(digest)
+
+    def _remember(self, digest):
+        self._entries[digest] = True
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _in_index(self, digest):
+        if not (self.s3 and self.bucket):
+            return False
+
+        try:
+            self.s3.head_object(Bucket=self.bucket, Key=f"{self.prefix}{digest}")
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            print(f"Image index lookup failed for {digest}: {str(e)}")
+            return False
@@ -0,0 +1,228 @@
+"""Normalizes extracted images before they go anywhere downstream.
+
+doc.extract_image() hands back images exactly as embedded: a full-page scan can be a 600 DPI
+RGB PNG of tens of MB. Each image is decoded once and
+
+    1. downsampled to at most target_dpi at the size it is drawn on the page (OCR gains
+       nothing above ~300 DPI),
+    2. re-encoded compactly (JPEG for colour, PNG for grayscale and line art),
+    3. shrunk again into a small JPEG thumbnail,
+
+and both outputs are uploaded under {prefix}{sha256}.{ext} / {prefix}{sha256}.thumb.jpg.
+
+PyMuPDF isn't thread-safe, so the decoding and encoding happen in the process that extracted
+the image, as part of extract_page() (see normalize_extracted). Only the uploads run on a
+thread pool, and a ByteBudget caps the normalized bytes waiting for it. submit() blocks while
+the budget is spent, which slows extraction down to the pace of the uploads instead of piling
+images up in memory.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import fitz  # PyMuPDF
+
+# Formats OCR and vision services read as-is; anything else (JBIG2, JPX, CCITT...) is always transcoded
+PORTABLE_FORMATS = {"png", "jpeg", "jpg"}
+CONTENT_TYPES = {"png": "image/png", "jpg": "image/jpeg", "jpeg": "image/jpeg"}
+DEFAULT_CONTENT_TYPE = "application/octet-stream"
+
+
+class ByteBudget:
+    """Counting semaphore over bytes. A request larger than the whole budget waits for
+    everything else to finish and then runs on its own, so it can't deadlock."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.in_use = 0
+        self.peak = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, amount):
+        amount = min(amount, self.max_bytes)
+        with self._condition:
+            self._condition.wait_for(lambda: self.in_use + amount <= self.max_bytes)
+            self.in_use += amount
+            self.peak = max(self.peak, self.in_use)
+        return amount
+
+    def release(self, amount):
+        with self._condition:
+            self.in_use -= amount
+            self._condition.notify_all()
+
+
+def effective_dpi(width_px, placement):
+    """Resolution of an image at the size it is drawn; placement is (width, height) in points."""
+    if not placement or not placement[0]:
+        return None
+    return width_px / (placement[0] / 72)
+
+
+def to_rgb_or_gray(pix):
+    """Drops alpha and converts CMYK and other colourspaces, which JPEG and PNG output can't take."""
+    if pix.alpha:
+        pix = fitz.Pixmap(pix, 0)
+    if pix.colorspace is None or pix.colorspace.n not in (1, 3):
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+    return pix
+
+
+def encode(pix, image_format, jpeg_quality):
+    """Returns (bytes, ext). "auto" keeps grayscale lossless and compresses colour as JPEG."""
+    if image_format == "auto":
+        image_format = "png" if pix.n == 1 else "jpeg"
+    if image_format == "png":
+        return pix.tobytes("png"), "png"
+    return pix.tobytes("jpg", jpg_quality=jpeg_quality), "jpg"
+
+
+def normalize_image(image, target_dpi=300, image_format="auto", jpeg_quality=85, thumbnail_px=256):
+    """Downsamples, transcodes and thumbnails one extracted image.
+
+    image carries the extraction output ("image", "ext", "width", "height") and, when known,
+    "placement": the (width, height) in points of its largest placement on the page. Returns
+    {"data", "ext", "width", "height", "dpi", "thumbnail"}; thumbnail is None when disabled.
+    """
+    pix = to_rgb_or_gray(fitz.Pixmap(image["image"]))
+    original_width = pix.width
+
+    dpi = effective_dpi(pix.width, image.get("placement"))
+    resized = False
+    if target_dpi and dpi and dpi > target_dpi:
+        scale = target_dpi / dpi
+        pix = fitz.Pixmap(pix, max(1, round(pix.width * scale)), max(1, round(pix.height * scale)), None)
+        resized = True
+
+    data, ext = encode(pix, image_format, jpeg_quality)
+    # Re-encoding an untouched, already compact original only makes it bigger
+    if not resized and image["ext"] in PORTABLE_FORMATS and len(image["image"]) <= len(data):
+        data, ext = image["image"], "jpg" if image["ext"] == "jpeg" else image["ext"]
+
+    thumbnail = None
+    if thumbnail_px:
+        scale = min(1.0, thumbnail_px / max(pix.width, pix.height))
+        thumb = fitz.Pixmap(pix, max(1, round(pix.width * scale)), max(1, round(pix.height * scale)), None)
+        thumbnail = thumb.tobytes("jpg", jpg_quality=70)
+
+    return {
+        "data": data,
+        "ext": ext,
+        "width": pix.width,
+        "height": pix.height,
+        "dpi": round(dpi * pix.width / original_width) if dpi else None,
+        "thumbnail": thumbnail
+    }
+
+
+def normalize_extracted(image, settings):
+    """normalize_image() as extract_page() runs it, with settings as its keyword arguments.
+
+    An image PyMuPDF can't decode (often a corrupt or exotic embedded stream) is kept as
+    embedded, with failed=True, rather than failing its document: a retry would only hit the
+    same image again. bytes_in records the size of the original.
+    """
+    try:
+        result = normalize_image(image, **settings)
+        result["failed"] = False
+    except Exception as e:
+        print(f"    * Image normalization failed, keeping it as embedded: {str(e)}")
+        result = {"data": image["image"], "ext": image["ext"], "width": image.get("width"),
+                  "height": image.get("height"), "dpi": None, "thumbnail": None, "failed": True}
+    result["bytes_in"] = len(image["image"])
+    return result
+
+
+class ImagePipeline:
+    """Uploads normalized images on a shared thread pool under one ByteBudget.
+
+    One pipeline serves every document a worker processes; use batch() to track the images of
+    one document. Without an S3 client nothing is uploaded and only the sizes are recorded.
+    """
+
+    def __init__(self, max_workers=4, max_inflight_bytes=256 * 1024 ** 2, s3=None, prefix="page-images/"):
+        self.budget = ByteBudget(max_inflight_bytes)
+        self.s3 = s3
+        self.prefix = prefix
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image")
+
+    def batch(self, bucket):
+        """Tracks the images of one document; outputs go to bucket."""
+        return ImageBatch(self, bucket)
+
+    def output_key(self, image):
+        """Where the normalized copy of an image (by its sha256 and output format) is stored."""
+        return f"{self.prefix}{image['sha256']}.{image['format']}"
+
+    def submit(self, image, bucket):
+        """Queues the upload of one normalized image, blocking first while the in-flight byte budget is spent."""
+        output = image["output"]
+        cost = self.budget.acquire(len(output["data"]) + len(output["thumbnail"] or b""))
+        try:
+            return self._pool.submit(self._upload, image, bucket, cost)
+        except Exception:
+            self.budget.release(cost)
+            raise
+
+    def _upload(self, image, bucket, cost):
+        try:
+            output = image["output"]
+            key = self.output_key(image)
+            if self.s3 is not None:
+                self.s3.put_object(Bucket=bucket, Key=key, Body=output["data"],
+                                   ContentType=CONTENT_TYPES.get(output["ext"], DEFAULT_CONTENT_TYPE))
+                if output["thumbnail"]:
+                    self.s3.put_object(Bucket=bucket, Key=f"{self.prefix}{image['sha256']}.thumb.jpg",
+                                       Body=output["thumbnail"], ContentType="image/jpeg")
+            return {
+                "sha256": image["sha256"],
+                "key": key,
+                "failed": output["failed"],
+                "bytes_in": output["bytes_in"],
+                "bytes_out": len(output["data"]),
+                "thumbnail_bytes": len(output["thumbnail"] or b""),
+                "dpi": output["dpi"]
+            }
+        finally:
+            self.budget.release(cost)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+
+class ImageBatch:
+    """Tracks the images of one document in an ImagePipeline."""
+
+    def __init__(self, pipeline, bucket):
+        self.pipeline = pipeline
+        self.bucket = bucket
+        self._futures = []
+
+    def add_image(self, image):
+        self._futures.append(self.pipeline.submit(image, self.bucket))
+
+    def wait(self):
+        """Waits for every image of the document and returns the totals, with the hashes of
+        the images that were delivered under "delivered". "failed" counts the images that
+        went out as embedded because they couldn't be normalized.
+
+        A failed upload is raised once every other image is done, so the document's message
+        goes back to the queue and is retried.
+        """
+        totals = {"images": 0, "failed": 0, "bytes_in": 0, "bytes_out": 0, "thumbnail_bytes": 0, "delivered": []}
+        error = None
+        for future in self._futures:
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"    * Image upload failed: {str(e)}")
+                error = error or e
+                continue
+            totals["images"] += 1
+            totals["failed"] += result["failed"]
+            totals["delivered"].append(result["sha256"])
+            for name in ("bytes_in", "bytes_out", "thumbnail_bytes"):
+                totals[name] += result[name]
+        self._futures = []
+        if error is not None:
+            raise error
+        return totals
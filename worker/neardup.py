@@ -0,0 +1,339 @@
+"""Near-duplicate detection: MinHash signatures of shingled page text in a banded LSH index.
+
+Exact content hashes (dedup_index.py) only catch byte-identical copies. The same document
+re-released under another EFTA number, or re-scanned with a different OCR layer, has mostly
+the same word 5-grams, and the MinHash signatures of the two shingle sets agree in about as
+many positions as the sets overlap (their Jaccard similarity).
+
+Each signature is cut into bands; documents that share any whole band are candidates, and
+candidates are confirmed against the full signatures. That makes a lookup a handful of
+indexed SQLite reads however large the corpus is.
+
+The index is a SQLite file, so it survives restarts on the same host. Every worker has to
+see everyone's signatures, so unlike the search index it is synced both ways with one shared
+snapshot in S3 (see NearDupSync).
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from array import array
+
+import numpy as np
+from botocore.exceptions import ClientError
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+SHINGLE_WORDS = 5
+# Shingles hashed per numpy pass; bounds the (chunk x num_perm) scratch array at ~4MB
+HASH_CHUNK = 4096
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)",
+    "CREATE TABLE IF NOT EXISTS signatures (bucket TEXT, key TEXT, signature BLOB, shingles INTEGER, added REAL, "
+    "PRIMARY KEY (bucket, key))",
+    "CREATE TABLE IF NOT EXISTS bands (band INTEGER, hash INTEGER, bucket TEXT, key TEXT, "
+    "PRIMARY KEY (band, hash, bucket, key)) WITHOUT ROWID",
+    "CREATE TABLE IF NOT EXISTS near_duplicates (bucket TEXT, key TEXT, match_bucket TEXT, match_key TEXT, "
+    "similarity REAL, found REAL, PRIMARY KEY (bucket, key, match_bucket, match_key))",
+]
+
+
+def shingles(text, size=SHINGLE_WORDS):
+    """The set of lowercased word n-grams of a text; short texts give a single shingle."""
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def choose_bands(num_perm, threshold):
+    """Picks (bands, rows) so the LSH S-curve rises somewhat below the threshold.
+
+    A pair with similarity s becomes a candidate with probability 1 - (1 - s^rows)^bands, which
+    climbs steeply around (1/bands)^(1/rows). Putting that point at 85% of the threshold costs a
+    few more candidates, which are verified anyway, and catches nearly every real match.
+    """
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        if (1 / bands) ** (1 / rows) <= threshold * 0.85:
+            best = (bands, rows)
+    return best
+
+
+class MinHasher:
+    """Computes fixed-length MinHash signatures; the same seed always gives the same permutations."""
+
+    def __init__(self, num_perm=128, seed=1):
+        self.num_perm = num_perm
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, int(MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, int(MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+
+    def signature(self, shingle_set):
+        """Returns the signature as array('I'), or None for an empty set (e.g. a scan with no text layer)."""
+        if not shingle_set:
+            return None
+
+        hashes = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=4).digest(), 'little') for s in shingle_set),
+            dtype=np.uint64, count=len(shingle_set)
+        )
+        signature = np.full(self.num_perm, MAX_HASH, dtype=np.uint64)
+        for start in range(0, len(hashes), HASH_CHUNK):
+            chunk = hashes[start:start + HASH_CHUNK, np.newaxis]
+            # a*h + b wraps at 2^64 before the modulo, like datasketch; still a fine universal hash here
+            permuted = ((chunk * self._a + self._b) % MERSENNE_PRIME) & MAX_HASH
+            np.minimum(signature, permuted.min(axis=0), out=signature)
+        return array('I', signature.astype(np.uint32).tobytes())
+
+
+def similarity(signature, other):
+    """Estimated Jaccard similarity: the share of positions where two signatures agree."""
+    return sum(1 for x, y in zip(signature, other) if x == y) / len(signature)
+
+
+def _band_hash(values):
+    # Signed 64-bit so it fits a SQLite INTEGER
+    return int.from_bytes(hashlib.blake2b(values.tobytes(), digest_size=8).digest(), 'little', signed=True)
+
+
+class NearDupIndex:
+    """LSH index of MinHash signatures in a local SQLite file.
+
+    The band layout is fixed when the file is created; an existing file keeps its own.
+    """
+
+    def __init__(self, path, threshold=0.8, num_perm=128):
+        self.path = path
+        self.threshold = threshold
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        # Bumped on every local write, so a sync can tell whether there's anything to push
+        self.version = 0
+        with self._lock, self._conn:
+            for statement in SCHEMA:
+                self._conn.execute(statement)
+            bands, rows = choose_bands(num_perm, threshold)
+            for name, value in (("num_perm", num_perm), ("bands", bands), ("rows", rows)):
+                self._conn.execute("INSERT OR IGNORE INTO meta VALUES (?, ?)", (name, value))
+            layout = dict(self._conn.execute("SELECT name, value FROM meta").fetchall())
+
+        self.num_perm, self.bands, self.rows = layout["num_perm"], layout["bands"], layout["rows"]
+        if self.num_perm != num_perm:
+            print(f"Near-dup index {path} uses {self.num_perm} permutations; ignoring the configured {num_perm}.")
+        self.hasher = MinHasher(self.num_perm)
+
+    def band_hashes(self, signature):
+        return [(band, _band_hash(signature[band * self.rows:(band + 1) * self.rows])) for band in range(self.bands)]
+
+    def query(self, signature, exclude=None):
+        """Documents at or above the threshold, best first: [{"bucket", "key", "similarity"}]."""
+        return self.query_many({None: signature}, {None: exclude})[None]
+
+    def query_many(self, signatures, exclude=None):
+        """Bulk lookup of {name: signature}: one pass over the band index for all of them.
+
+        exclude maps a name to the (bucket, key) to leave out of its results, usually itself.
+        """
+        exclude = exclude or {}
+        names = list(signatures)
+        with self._lock:
+            self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS probe (query INTEGER, band INTEGER, hash INTEGER)")
+            self._conn.execute("DELETE FROM probe")
+            self._conn.executemany(
+                "INSERT INTO probe VALUES (?, ?, ?)",
+                [(i, band, band_hash) for i, name in enumerate(names) for band, band_hash in self.band_hashes(signatures[name])]
+            )
+            rows = self._conn.execute(
+                # CROSS JOIN pins the probe rows as the outer loop; left alone, the planner
+                # knows nothing about the temp table and may scan all of bands instead
+                "SELECT DISTINCT p.query, s.bucket, s.key, s.signature FROM probe p "
+                "CROSS JOIN bands b ON b.band = p.band AND b.hash = p.hash "
+                "JOIN signatures s ON s.bucket = b.bucket AND s.key = b.key"
+            ).fetchall()
+            self._conn.execute("DELETE FROM probe")
+            self._conn.commit()
+
+        results = {name: [] for name in names}
+        for query, bucket, key, blob in rows:
+            name = names[query]
+            if exclude.get(name) == (bucket, key):
+                continue
+            score = similarity(signatures[name], array('I', blob))
+            if score >= self.threshold:
+                results[name].append({"bucket": bucket, "key": key, "similarity": score})
+        for matches in results.values():
+            matches.sort(key=lambda match: -match["similarity"])
+        return results
+
+    def add(self, bucket, key, signature, shingle_count=0):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM bands WHERE bucket = ? AND key = ?", (bucket, key))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO signatures VALUES (?, ?, ?, ?, ?)",
+                (bucket, key, signature.tobytes(), shingle_count, time.time())
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO bands VALUES (?, ?, ?, ?)",
+                [(band, band_hash, bucket, key) for band, band_hash in self.band_hashes(signature)]
+            )
+            self.version += 1
+
+    def flag(self, bucket, key, match):
+        """Records that (bucket, key) is a near duplicate of an indexed document."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO near_duplicates VALUES (?, ?, ?, ?, ?, ?)",
+                (bucket, key, match["bucket"], match["key"], match["similarity"], time.time())
+            )
+            self.version += 1
+
+    def check(self, bucket, key, text):
+        """Signs a document's text, looks it up and adds it to the index.
+
+        Returns the best match (flagged as a near duplicate), or None. Documents without
+        any text can't be compared and are left out of the index.
+        """
+        shingle_set = shingles(text)
+        signature = self.hasher.signature(shingle_set)
+        if signature is None:
+            return None
+
+        matches = self.query(signature, exclude=(bucket, key))
+        self.add(bucket, key, signature, len(shingle_set))
+        if matches:
+            self.flag(bucket, key, matches[0])
+            return matches[0]
+        return None
+
+    def merge_from(self, path):
+        """Copies in every signature, band and flag from another index file that this one lacks."""
+        with self._lock:
+            self._conn.execute("ATTACH DATABASE ? AS other", (path,))
+            try:
+                with self._conn:
+                    for table in ("signatures", "bands", "near_duplicates"):
+                        self._conn.execute(f"INSERT OR IGNORE INTO {table} SELECT * FROM other.{table}")
+            finally:
+                self._conn.execute("DETACH DATABASE other")
+
+    def close(self):
+        self._conn.close()
+
+
+class NearDupSync:
+    """Keeps a worker's index and one shared snapshot in S3 in step.
+
+    The first sync() always runs, to pull in what other workers have seen. After that a sync
+    runs at most every sync_seconds, or on sync(force=True) when there are local entries to push.
+
+    A sync brings a local copy of the snapshot up to date, adds this worker's entries and
+    uploads it again on the condition that nobody replaced it meanwhile (retrying if they did),
+    then pulls everyone else's entries into the local index. Both sides only ever gain entries,
+    so nothing is lost whichever worker wins. Entries added since a worker's last sync are lost
+    if it dies; those documents just miss out on matching until they are processed again.
+
+    The snapshot is only downloaded when its ETag has moved since the last sync, and only
+    uploaded when this worker has entries to add, so a quiet sync costs one conditional GET.
+    """
+
+    MAX_ATTEMPTS = 3
+
+    def __init__(self, index, s3, bucket, key, sync_seconds=300):
+        self.index = index
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.sync_seconds = sync_seconds
+        self._last_sync = None
+        self._synced_version = 0
+        self._lock = threading.Lock()
+        # The last snapshot seen in S3, kept next to the index, and its ETag
+        self._snapshot_path = index.path + ".snapshot"
+        self._snapshot_etag = None
+
+    def sync(self, force=False):
+        """Never blocks: a sync already in progress wins."""
+        if self._last_sync is not None:
+            if force and self.index.version == self._synced_version:
+                return
+            if not force and time.monotonic() - self._last_sync < self.sync_seconds:
+                return
+        if not self._lock.acquire(blocking=False):
+            return
+
+        try:
+            self._last_sync = time.monotonic()
+            version = self.index.version
+            for attempt in range(self.MAX_ATTEMPTS):
+                if self._sync_once(push=version != self._synced_version):
+                    self._synced_version = version
+                    return
+                print(f"Near-dup snapshot changed during sync (attempt {attempt + 1}), retrying...")
+        except Exception as e:
+            print(f"Error syncing the near-dup index: {str(e)}")
+        finally:
+            self._lock.release()
+
+    def _sync_once(self, push):
+        pulled = self._refresh_snapshot()
+        if not pulled and not push:
+            return True
+
+        if push:
+            snapshot = NearDupIndex(self._snapshot_path, self.index.threshold, self.index.num_perm)
+            try:
+                snapshot.merge_from(self.index.path)
+            finally:
+                snapshot.close()
+
+            condition = {'IfMatch': self._snapshot_etag} if self._snapshot_etag else {'IfNoneMatch': '*'}
+            try:
+                with open(self._snapshot_path, 'rb') as f:
+                    response = self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=f, **condition)
+            except ClientError as e:
+                # The local copy now holds entries S3 doesn't; fetch the snapshot afresh
+                self._snapshot_etag = None
+                if e.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                    return False
+                raise
+            self._snapshot_etag = response['ETag']
+
+        if pulled:
+            self.index.merge_from(self._snapshot_path)
+        print(f"Synced the near-dup index with s3://{self.bucket}/{self.key}.")
+        return True
+
+    def _refresh_snapshot(self):
+        """Downloads the snapshot if it changed since the last sync. Returns True if it did."""
+        condition = {'IfNoneMatch': self._snapshot_etag} if self._snapshot_etag else {}
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=self.key, **condition)
+        except ClientError as e:
+            code = e.response['Error']['Code']
+            if code in ('304', 'NotModified'):
+                return False
+            if code not in ('404', 'NoSuchKey'):
+                raise
+            # Nothing shared yet: start the snapshot from scratch
+            if os.path.exists(self._snapshot_path):
+                os.remove(self._snapshot_path)
+            self._snapshot_etag = None
+            return False
+
+        # Written aside and moved into place, so a failed download never leaves half a file
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(self._snapshot_path) or ".", delete=False) as f:
+            try:
+                for chunk in response['Body'].iter_chunks(8 * 1024 ** 2):
+                    f.write(chunk)
+            except Exception:
+                os.remove(f.name)
+                raise
+        os.replace(f.name, self._snapshot_path)
+        self._snapshot_etag = response['ETag']
+        return True
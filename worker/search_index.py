@@ -0,0 +1,380 @@
+"""Full-text search over extracted page text.
+
+Every worker keeps a local SQLite FTS5 shard that the splitter feeds page by page. From time
+to time the pages indexed since the last publish are uploaded as a small delta database:
+
+    {prefix}deltas/{millis}-{worker}.db
+
+and whoever merges next folds all pending deltas into the single index at {prefix}index.db.
+The upload of index.db is conditional on the ETag it was downloaded with, so two merges
+can't overwrite each other; the loser leaves its deltas for the next round. Rows carry the
+time they were indexed and a merge never replaces a page with an older copy, so applying a
+delta twice is harmless.
+
+Query the merged index from anywhere:
+
+    python search_index.py search "flight logs" --bucket <bucket>
+    python search_index.py merge --bucket <bucket>
+"""
+import argparse
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+from botocore.exceptions import ClientError
+
+PAGE_TEXT_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS page_text ("
+    "id INTEGER PRIMARY KEY, key TEXT NOT NULL, page_num INTEGER NOT NULL, text TEXT NOT NULL, "
+    "indexed_at REAL NOT NULL, UNIQUE (key, page_num))"
+)
+
+# External-content FTS5 table: the text lives once, in page_text, and triggers keep the index in step
+FTS_SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS page_fts USING fts5("
+    "text, content='page_text', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS page_text_ai AFTER INSERT ON page_text BEGIN "
+    "INSERT INTO page_fts(rowid, text) VALUES (new.id, new.text); END",
+    "CREATE TRIGGER IF NOT EXISTS page_text_ad AFTER DELETE ON page_text BEGIN "
+    "INSERT INTO page_fts(page_fts, rowid, text) VALUES ('delete', old.id, old.text); END",
+    "CREATE TRIGGER IF NOT EXISTS page_text_au AFTER UPDATE ON page_text BEGIN "
+    "INSERT INTO page_fts(page_fts, rowid, text) VALUES ('delete', old.id, old.text); "
+    "INSERT INTO page_fts(rowid, text) VALUES (new.id, new.text); END",
+]
+
+UPSERT_PAGE = (
+    "INSERT INTO page_text (key, page_num, text, indexed_at) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT (key, page_num) DO UPDATE SET text = excluded.text, indexed_at = excluded.indexed_at "
+    "WHERE excluded.indexed_at >= page_text.indexed_at"
+)
+
+
+def connect(path, fts=True):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    with conn:
+        conn.execute(PAGE_TEXT_SCHEMA)
+        if fts:
+            conn.execute("CREATE INDEX IF NOT EXISTS page_text_indexed_at ON page_text (indexed_at)")
+            for statement in FTS_SCHEMA:
+                conn.execute(statement)
+    return conn
+
+
+def to_match_query(text):
+    """Turns free text into an FTS5 query that matches pages containing every word."""
+    words = re.findall(r"\w+", text)
+    return " ".join(f'"{word}"' for word in words)
+
+
+class SearchIndex:
+    """A local FTS5 index: a worker's shard, or a downloaded copy of the merged index."""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = connect(path)
+        self._lock = threading.Lock()
+        self._last_indexed_at = 0.0
+
+    @property
+    def last_indexed_at(self):
+        return self._last_indexed_at
+
+    def add_pages(self, key, pages):
+        """Indexes [(page_num, text)] for one document in a single transaction."""
+        with self._lock, self._conn:
+            # Stamped under the lock and strictly increasing, so export_since() never skips a
+            # batch that committed after a publish read the rows before it
+            indexed_at = self._last_indexed_at = max(time.time(), self._last_indexed_at + 1e-6)
+            self._conn.executemany(UPSERT_PAGE, [(key, page_num, text, indexed_at) for page_num, text in pages])
+
+    def document(self, key, flush_pages=500):
+        """A per-document writer with the same add_page() interface as ArtifactWriter."""
+        return DocumentIndexer(self, key, flush_pages)
+
+    def search(self, query, limit=20, raw=False):
+        """Ranked page hits, best first: [{"key", "page_num", "score", "snippet"}].
+
+        query is free text (every word must appear) unless raw is set, in which case it is
+        passed to FTS5 as-is (phrases, OR, NEAR, prefix*).
+        """
+        match = query if raw else to_match_query(query)
+        if not match:
+            return []
+
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT t.key, t.page_num, bm25(page_fts) AS rank, snippet(page_fts, 0, '[', ']', '...', 12) "
+                "FROM page_fts JOIN page_text t ON t.id = page_fts.rowid "
+                "WHERE page_fts MATCH ? ORDER BY rank LIMIT ?",
+                (match, limit)
+            ).fetchall()
+        # bm25() is lower-is-better; flip it so a higher score means a better hit
+        return [{"key": key, "page_num": page_num, "score": -rank, "snippet": snippet}
+                for key, page_num, rank, snippet in rows]
+
+    def export_since(self, since, path):
+        """Copies the pages indexed after `since` into a new delta database. Returns (pages, newest indexed_at)."""
+        delta = connect(path, fts=False)
+        try:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT key, page_num, text, indexed_at FROM page_text WHERE indexed_at > ?", (since,)
+                ).fetchall()
+            with delta:
+                delta.executemany(
+                    "INSERT INTO page_text (key, page_num, text, indexed_at) VALUES (?, ?, ?, ?)", rows
+                )
+        finally:
+            delta.close()
+        return len(rows), max((row[3] for row in rows), default=since)
+
+    def prune_until(self, indexed_at):
+        """Deletes the pages indexed at or before `indexed_at`. Returns how many went.
+
+        A page re-indexed since then carries a newer stamp and stays. Freed pages are reused by
+        later inserts, so a shard that is pruned after every publish stays about one delta big.
+        """
+        with self._lock:
+            with self._conn:
+                pruned = self._conn.execute("DELETE FROM page_text WHERE indexed_at <= ?", (indexed_at,)).rowcount
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return pruned
+
+    def apply_delta(self, path):
+        """Upserts every page of a delta database; newer copies of a page always win."""
+        with self._lock:
+            self._conn.execute("ATTACH DATABASE ? AS delta", (path,))
+            try:
+                with self._conn:
+                    # "WHERE true" keeps SQLite from reading ON CONFLICT as part of the SELECT
+                    self._conn.execute(
+                        "INSERT INTO page_text (key, page_num, text, indexed_at) "
+                        "SELECT key, page_num, text, indexed_at FROM delta.page_text WHERE true "
+                        "ON CONFLICT (key, page_num) DO UPDATE SET text = excluded.text, indexed_at = excluded.indexed_at "
+                        "WHERE excluded.indexed_at >= page_text.indexed_at"
+                    )
+            finally:
+                self._conn.execute("DETACH DATABASE delta")
+
+    def optimize(self):
+        """Merges the FTS b-trees into one, which keeps queries fast after many small merges."""
+        with self._lock, self._conn:
+            self._conn.execute("INSERT INTO page_fts(page_fts) VALUES ('optimize')")
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        self._conn.close()
+
+
+class DocumentIndexer:
+    """Buffers the pages of one document and writes them in page batches, one transaction each."""
+
+    def __init__(self, index, key, flush_pages=500):
+        self.index = index
+        self.key = key
+        self.flush_pages = flush_pages
+        self.pages_indexed = 0
+        self._pending = []
+
+    def add_page(self, result):
+        # Scanned pages have no text layer yet; there's nothing to search on them
+        if not result["text"].strip():
+            return
+        self._pending.append((result["page_num"], result["text"]))
+        if len(self._pending) >= self.flush_pages:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            self.index.add_pages(self.key, self._pending)
+            self.pages_indexed += len(self._pending)
+            self._pending = []
+
+
+class SearchIndexPublisher:
+    """Ships a worker's newly indexed pages to S3 as deltas and periodically merges them.
+
+    Deltas go up at most every publish_seconds (or whenever publish(force=True) is called).
+    Once a delta is uploaded, its pages are deleted from the local shard, which only ever holds
+    what hasn't been published yet.
+    After a publish, a merge runs if index.db is older than merge_seconds; 0 turns merging off.
+    The merge downloads, updates and re-uploads the whole index, so it costs more as the
+    index grows.
+    """
+
+    def __init__(self, index, s3, bucket, prefix="search/", publish_seconds=300, merge_seconds=900):
+        self.index = index
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+        self.publish_seconds = publish_seconds
+        self.merge_seconds = merge_seconds
+        self.worker_id = uuid.uuid4().hex[:12]
+        self._published_until = 0.0
+        self._last_publish = time.monotonic()
+        self._lock = threading.Lock()
+
+    def publish(self, force=False):
+        """Uploads pages indexed since the last publish. Never blocks: a publish in progress wins."""
+        if self.index.last_indexed_at <= self._published_until:
+            return
+        if not force and time.monotonic() - self._last_publish < self.publish_seconds:
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+
+        try:
+            self._last_publish = time.monotonic()
+            with tempfile.TemporaryDirectory() as scratch:
+                delta_path = os.path.join(scratch, "delta.db")
+                pages, newest = self.index.export_since(self._published_until, delta_path)
+                if pages:
+                    delta_key = f"{self.prefix}deltas/{int(time.time() * 1000):013d}-{self.worker_id}.db"
+                    self.s3.upload_file(delta_path, self.bucket, delta_key)
+                    self._published_until = newest
+                    print(f"Published {pages} indexed page(s) to s3://{self.bucket}/{delta_key}.")
+                    self.index.prune_until(newest)
+
+            if self.merge_seconds and self._index_age() >= self.merge_seconds:
+                merge_deltas(self.s3, self.bucket, self.prefix)
+        except Exception as e:
+            # The pages stay in the local shard and go out with the next publish
+            print(f"Error publishing the search index: {str(e)}")
+        finally:
+            self._lock.release()
+
+    def _index_age(self):
+        try:
+            head = self.s3.head_object(Bucket=self.bucket, Key=f"{self.prefix}index.db")
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return float('inf')
+            raise
+        return time.time() - head['LastModified'].timestamp()
+
+
+def merge_deltas(s3, bucket, prefix="search/"):
+    """Folds every pending delta into {prefix}index.db. Returns the number of deltas merged,
+    or None if another merge got there first (the deltas are then left for the next one)."""
+    delta_prefix = f"{prefix}deltas/"
+    delta_keys = []
+    for listing in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=delta_prefix):
+        delta_keys.extend(obj['Key'] for obj in listing.get('Contents', []))
+    if not delta_keys:
+        return 0
+
+    index_key = f"{prefix}index.db"
+    with tempfile.TemporaryDirectory() as scratch:
+        index_path = os.path.join(scratch, "index.db")
+        etag = _download_if_exists(s3, bucket, index_key, index_path)
+
+        index = SearchIndex(index_path)
+        try:
+            # Delta names start with their upload time, so this applies them oldest first
+            for delta_key in sorted(delta_keys):
+                delta_path = os.path.join(scratch, "delta.db")
+                s3.download_file(bucket, delta_key, delta_path)
+                index.apply_delta(delta_path)
+                os.remove(delta_path)
+            index.optimize()
+        finally:
+            index.close()
+
+        condition = {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+        try:
+            with open(index_path, 'rb') as f:
+                s3.put_object(Bucket=bucket, Key=index_key, Body=f, **condition)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                print("Another worker merged the search index first; leaving the deltas for the next merge.")
+                return None
+            raise
+
+    for i in range(0, len(delta_keys), 1000):
+        s3.delete_objects(
+            Bucket=bucket,
+            Delete={'Objects': [{'Key': key} for key in delta_keys[i:i + 1000]], 'Quiet': True}
+        )
+    print(f"Merged {len(delta_keys)} delta(s) into s3://{bucket}/{index_key}.")
+    return len(delta_keys)
+
+
+def _download_if_exists(s3, bucket, key, path):
+    """Downloads key to path and returns its ETag, or returns None if it doesn't exist yet."""
+    try:
+        response = s3.get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+            return None
+        raise
+
+    with open(path, 'wb') as f:
+        for chunk in response['Body'].iter_chunks(8 * 1024 ** 2):
+            f.write(chunk)
+    return response['ETag']
+
+
+def fetch_index(s3, bucket, prefix, path):
+    """Keeps a local copy of the merged index at path, downloading it only when it has changed."""
+    etag_path = path + ".etag"
+    cached_etag = None
+    if os.path.exists(path) and os.path.exists(etag_path):
+        with open(etag_path) as f:
+            cached_etag = f.read().strip()
+
+    try:
+        response = s3.get_object(Bucket=bucket, Key=f"{prefix}index.db", **({'IfNoneMatch': cached_etag} if cached_etag else {}))
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('304', 'NotModified'):
+            return path
+        raise
+
+    partial_path = path + ".part"
+    with open(partial_path, 'wb') as f:
+        for chunk in response['Body'].iter_chunks(8 * 1024 ** 2):
+            f.write(chunk)
+    os.replace(partial_path, path)
+    for stale in (path + "-wal", path + "-shm"):
+        if os.path.exists(stale):
+            os.remove(stale)
+    with open(etag_path, 'w') as f:
+        f.write(response['ETag'])
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search or merge the Gestalt full-text page index.")
+    parser.add_argument('command', choices=['search', 'merge'])
+    parser.add_argument('query', nargs='?', help="Words to search for (search only)")
+    parser.add_argument('--bucket', help="Bucket holding the index (the raw data bucket when deployed with GestaltStack)")
+    parser.add_argument('--prefix', default=os.environ.get('SPLITTER_SEARCH_INDEX_PREFIX', '_gestalt/search/'))
+    parser.add_argument('--db', default=os.path.join(tempfile.gettempdir(), "gestalt_search_index.db"),
+                        help="Local copy of the index. With no --bucket, it is searched as-is.")
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--raw', action='store_true', help="Pass the query to FTS5 unchanged (phrases, OR, NEAR, prefix*)")
+    args = parser.parse_args()
+
+    if args.command == 'merge':
+        import boto3
+        if not args.bucket:
+            parser.error("merge needs --bucket")
+        merge_deltas(boto3.client('s3'), args.bucket, args.prefix)
+    else:
+        if not args.query:
+            parser.error("search needs a query")
+        if args.bucket:
+            import boto3
+            fetch_index(boto3.client('s3'), args.bucket, args.prefix, args.db)
+
+        started = time.perf_counter()
+        hits = SearchIndex(args.db).search(args.query, args.limit, args.raw)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        for hit in hits:
+            print(f"{hit['score']:8.3f}  {hit['key']}  page {hit['page_num'] + 1}: {hit['snippet']}")
+        print(f"{len(hits)} hit(s) in {elapsed_ms:.1f}ms.")
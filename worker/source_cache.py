@@ -0,0 +1,90 @@
+"""A task-wide disk cache of source PDFs for fanned-out shards.
+
+Every shard of a fanned-out document needs the whole file: PyMuPDF reads the cross-reference
+table at the end of a PDF and objects from anywhere in it, so a page range can't be cut out
+of the byte stream with a ranged GET. The shards of one document tend to land on the same
+task, though, so the first one downloads the file into this cache and the rest open it
+from there. The cache is shared by every worker process of the task; a lock file per entry
+makes sure only one of them downloads a given object.
+
+Entries are named after the bucket, key and ETag, so a replaced object is never served from
+a stale copy. Once the cache grows past max_bytes, the least recently used files go.
+Removing a file another process still has open is safe; it keeps its handle. Lock files are
+never removed: another process may be waiting on one, and if it were unlinked the next
+process would lock a fresh file and download the same object alongside it. They are empty,
+so all they cost is an inode per document.
+"""
+import fcntl
+import hashlib
+import os
+import tempfile
+
+
+class SourceCache:
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, bucket, key, etag):
+        name = hashlib.sha256(f"{bucket}/{key}/{etag}".encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, name + ".pdf")
+
+    def fetch(self, s3, bucket, key, stats):
+        """Returns a local path holding the object, downloading it unless a fresh copy is cached."""
+        etag = s3.head_object(Bucket=bucket, Key=key)['ETag']
+        path = self._path(bucket, key, etag)
+
+        with open(path + ".lock", 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.exists(path):
+                # Mark it recently used
+                os.utime(path)
+                print(f"  - Using the cached copy of '{key}'.")
+                return path
+
+            fd, partial = tempfile.mkstemp(dir=self.directory, suffix=".part")
+            os.close(fd)
+            try:
+                s3.download_file(bucket, key, partial)
+                os.replace(partial, path)
+            except Exception:
+                os.remove(partial)
+                raise
+
+        size = os.path.getsize(path)
+        stats["bytes_downloaded"] = stats["bytes_spilled"] = size
+        self._evict(keep=path)
+        return path
+
+    def discard(self, path):
+        """Drops a cached copy once every shard of its document is done; other tasks' copies age out.
+
+        Its lock file stays (see above).
+        """
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, keep):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".pdf"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            self.discard(path)
+            total -= size
@@ -1,98 +1,636 @@
 import os
+import sys
 import json
+import hashlib
 import boto3
-import fitz  # This is PyMuPDF
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
 import time
+import uuid
+import threading
+
+# Shared instrumentation lives in common/python; the Docker image copies it next to this file
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common', 'python'))
+import gestalt_metrics as metrics
+
+from artifact import ArtifactWriter
+from consumer import chunked
+from dedup_index import ClaimPending, open_dedup_index
+from extraction import CLASSIFY_PAGES, extract_page, iter_pages_parallel, open_pdf
+from image_cache import ImageDedupCache
+from image_pipeline import ImagePipeline
+from neardup import NearDupIndex, NearDupSync
+from search_index import SearchIndex, SearchIndexPublisher
+from source_cache import SourceCache
+
+# The fast tier runs this same module in Lambda; report it separately from the Fargate fleet
+metrics.configure("splitter-fast" if os.environ.get('AWS_LAMBDA_FUNCTION_NAME') else "splitter")
 
 # Initialize AWS clients
 # (Boto3 will automatically use the credentials injected by your Codespace/Docker)
 s3 = boto3.client('s3')
 sqs = boto3.client('sqs')
 
-# You will need to pass this environment variable when running the container
+# Fan-out shards go back onto this queue; consumer.py reads from it
 QUEUE_URL = os.environ.get('SPLITTER_QUEUE_URL')
 
-def process_pdf(download_path):
-    """Opens the PDF and separates native text from embedded images."""
-    print(f"Opening {download_path} with PyMuPDF...")
-    
-    doc = fitz.open(download_path)
-    
-    for page_num in range(len(doc)):
-        page = doc[page_num]
-        
-        # 1. Extract Text
-        text = page.get_text()
-        if text.strip():
-            print(f"  - Page {page_num}: Found {len(text)} characters of native text.")
-            # Future step: Send this text to your Database/Embeddings model
-            
-        # 2. Extract Images (Scans or Photos)
-        image_list = page.get_images(full=True)
-        if image_list:
-            print(f"  - Page {page_num}: Found {len(image_list)} embedded images.")
-            for img_index, img in enumerate(image_list):
-                xref = img[0]
-                base_image = doc.extract_image(xref)
-                image_bytes = base_image["image"]
-                image_ext = base_image["ext"]
-                
-                # Future step: Upload these raw image bytes back to S3 
-                # and trigger the OCR or Vision queues
-                print(f"    * Extracted image {img_index} (Type: {image_ext}, Size: {len(image_bytes)} bytes)")
-
-    doc.close()
-
-def poll_queue():
-    """Continuously polls the SQS queue for new files to process."""
-    print(f"Listening to queue: {QUEUE_URL}")
-    
-    while True:
-        # Long polling: Wait up to 20 seconds for a message to arrive
-        response = sqs.receive_message(
-            QueueUrl=QUEUE_URL,
-            MaxNumberOfMessages=1,
-            WaitTimeSeconds=20 
-        )
+def process_local_path(path):
+    """The batch consumer runs one splitter per worker process, and each keeps its own copy of per-worker files."""
+    root, ext = os.path.splitext(path)
+    return f"{root}-{os.getpid()}{ext}"
+
+# Page-parallel extraction. Documents with at least PARALLEL_PAGE_THRESHOLD pages are
+# cut into PAGE_CHUNK_SIZE page ranges and extracted on PAGE_WORKERS processes.
+# Leave PAGE_WORKERS at 1 to keep extraction in-process.
+PAGE_WORKERS = int(os.environ.get('SPLITTER_PAGE_WORKERS', '1'))
+PARALLEL_PAGE_THRESHOLD = int(os.environ.get('SPLITTER_PARALLEL_PAGE_THRESHOLD', '200'))
+PAGE_CHUNK_SIZE = int(os.environ.get('SPLITTER_PAGE_CHUNK_SIZE', '25'))
+
+# Fan-out of oversized PDFs. Documents above either threshold are not processed inline;
+# they are cut into page ranges that go back onto the queue as separate work items.
+# Set both thresholds to 0 to always process inline.
+FANOUT_PAGE_THRESHOLD = int(os.environ.get('SPLITTER_FANOUT_PAGE_THRESHOLD', '1000'))
+FANOUT_SIZE_THRESHOLD = int(os.environ.get('SPLITTER_FANOUT_SIZE_THRESHOLD', str(1024 ** 3)))  # bytes
+FANOUT_SHARD_PAGES = int(os.environ.get('SPLITTER_FANOUT_SHARD_PAGES', '250'))
+
+# Shards of one document that land on the same task share one local copy of it (see
+# source_cache.py) instead of each downloading the whole file. Set SHARD_CACHE_MAX_BYTES
+# to 0 to download per shard.
+SHARD_CACHE_DIR = os.environ.get('SPLITTER_SHARD_CACHE_DIR', '/tmp/gestalt_shard_sources')
+SHARD_CACHE_MAX_BYTES = int(os.environ.get('SPLITTER_SHARD_CACHE_MAX_BYTES', str(4 * 1024 ** 3)))
+
+source_cache = SourceCache(SHARD_CACHE_DIR, SHARD_CACHE_MAX_BYTES) if SHARD_CACHE_MAX_BYTES else None
+
+# Everything the splitter writes about documents (shard records, ...) lives under this
+# prefix of the source bucket. Messages for keys under it are ignored.
+STATE_PREFIX = os.environ.get('SPLITTER_STATE_PREFIX', '_gestalt/')
+
+# I/O mode. "disk" downloads every object to /tmp before opening it; "stream" reads
+# objects of up to STREAM_MAX_BYTES straight into memory and only spills larger ones to disk.
+IO_MODE = os.environ.get('SPLITTER_IO_MODE', 'disk')
+STREAM_MAX_BYTES = int(os.environ.get('SPLITTER_STREAM_MAX_BYTES', str(256 * 1024 ** 2)))
+STREAM_CHUNK_SIZE = 8 * 1024 ** 2
+
+# Image dedup. Each xref is extracted once per document, and each distinct image (by SHA-256)
+# is handed downstream once: IMAGE_CACHE_SIZE hashes are remembered in-process, and setting
+# IMAGE_INDEX_BUCKET adds a shared S3 key index on top for dedup across workers and restarts.
+# An image is only remembered once its document has been delivered, so a failed upload is retried.
+IMAGE_CACHE_SIZE = int(os.environ.get('SPLITTER_IMAGE_CACHE_SIZE', '100000'))
+IMAGE_INDEX_BUCKET = os.environ.get('SPLITTER_IMAGE_INDEX_BUCKET')
+IMAGE_INDEX_PREFIX = os.environ.get('SPLITTER_IMAGE_INDEX_PREFIX', f"{STATE_PREFIX}images/")
+
+image_cache = ImageDedupCache(IMAGE_CACHE_SIZE, s3, IMAGE_INDEX_BUCKET, IMAGE_INDEX_PREFIX)
+
+# Image normalization. Every newly extracted image is downsampled to IMAGE_TARGET_DPI at the
+# size it is drawn, re-encoded (IMAGE_FORMAT: auto, jpeg or png) and thumbnailed by the process
+# that extracted it. The results are uploaded on IMAGE_WORKERS threads, with at most
+# IMAGE_INFLIGHT_BYTES of them waiting at once; see image_pipeline.py.
+# Outputs go to IMAGE_OUTPUT_BUCKET (default: the PDF's bucket) under IMAGE_OUTPUT_PREFIX.
+IMAGE_PIPELINE_ENABLED = os.environ.get('SPLITTER_IMAGE_PIPELINE', '1') == '1'
+IMAGE_TARGET_DPI = int(os.environ.get('SPLITTER_IMAGE_TARGET_DPI', '300'))
+IMAGE_FORMAT = os.environ.get('SPLITTER_IMAGE_FORMAT', 'auto')
+IMAGE_JPEG_QUALITY = int(os.environ.get('SPLITTER_IMAGE_JPEG_QUALITY', '85'))
+IMAGE_THUMBNAIL_PX = int(os.environ.get('SPLITTER_IMAGE_THUMBNAIL_PX', '256'))
+IMAGE_WORKERS = int(os.environ.get('SPLITTER_IMAGE_WORKERS', '4'))
+IMAGE_INFLIGHT_BYTES = int(os.environ.get('SPLITTER_IMAGE_INFLIGHT_BYTES', str(256 * 1024 ** 2)))
+IMAGE_OUTPUT_BUCKET = os.environ.get('SPLITTER_IMAGE_OUTPUT_BUCKET')
+IMAGE_OUTPUT_PREFIX = os.environ.get('SPLITTER_IMAGE_OUTPUT_PREFIX', f"{STATE_PREFIX}page-images/")
+
+image_pipeline = None
+image_normalize = None
+if IMAGE_PIPELINE_ENABLED:
+    image_pipeline = ImagePipeline(IMAGE_WORKERS, IMAGE_INFLIGHT_BYTES, s3, IMAGE_OUTPUT_PREFIX)
+    # Handed to extract_page(), in this process or the page workers
+    image_normalize = {"target_dpi": IMAGE_TARGET_DPI, "image_format": IMAGE_FORMAT,
+                       "jpeg_quality": IMAGE_JPEG_QUALITY, "thumbnail_px": IMAGE_THUMBNAIL_PX}
+
+# Extraction artifacts: one compressed object per source PDF (one per shard for fanned-out
+# documents) holding all page text and image references, see artifact.py.
+# ARTIFACT_BUCKET defaults to the bucket the PDF came from.
+ARTIFACTS_ENABLED = os.environ.get('SPLITTER_ARTIFACTS', '1') == '1'
+ARTIFACT_BUCKET = os.environ.get('SPLITTER_ARTIFACT_BUCKET')
+ARTIFACT_PREFIX = os.environ.get('SPLITTER_ARTIFACT_PREFIX', f"{STATE_PREFIX}artifacts/")
+ARTIFACT_TRANSFER_CONFIG = TransferConfig(multipart_threshold=16 * 1024 ** 2, multipart_chunksize=16 * 1024 ** 2)
+
+# Document dedup. Each PDF is looked up by the SHA-256 of its content; copies of an
+# already-seen document are recorded as aliases and not processed again. The hash the scraper
+# recorded (sha256 metadata, or the {key}.sha256 object next to a streamed multipart upload)
+# is checked before downloading; anything else is hashed once it is downloaded. S3 ETags are
+# never used, since a multipart ETag depends on the part size. A hash is only claimed as
+# pending until its document is processed, and handed back if that fails (see dedup_index.py).
+# Backends: none, memory (this process only; refused by the batch consumer with several
+# workers), sqlite (every process sharing SPLITTER_DEDUP_DB, i.e. one task) and s3 (the fleet).
+DEDUP_BACKEND = os.environ.get('SPLITTER_DEDUP_BACKEND', 'none')
+DEDUP_BUCKET = os.environ.get('SPLITTER_DEDUP_BUCKET')  # s3 backend; defaults to each document's bucket
+DEDUP_PREFIX = os.environ.get('SPLITTER_DEDUP_PREFIX', f"{STATE_PREFIX}dedup/")
+DEDUP_DB_PATH = os.environ.get('SPLITTER_DEDUP_DB', '/tmp/gestalt_dedup.db')  # sqlite backend
+
+dedup_index = open_dedup_index(DEDUP_BACKEND, s3, DEDUP_BUCKET, DEDUP_PREFIX, DEDUP_DB_PATH)
+
+# Near-duplicate detection, off by default. Before a document is extracted, the text of its
+# first NEARDUP_MAX_PAGES pages is MinHash-signed and looked up in an LSH index (see neardup.py).
+# Documents at least NEARDUP_THRESHOLD similar to one already seen are flagged in the metrics
+# and their artifact, and unless NEARDUP_SKIP_IMAGES is 0 their images aren't extracted,
+# normalized or uploaded at all. Setting NEARDUP_BUCKET shares the index between workers
+# through one snapshot in S3. Fanned-out documents are not checked.
+NEARDUP_ENABLED = os.environ.get('SPLITTER_NEARDUP', '0') == '1'
+NEARDUP_THRESHOLD = float(os.environ.get('SPLITTER_NEARDUP_THRESHOLD', '0.8'))
+NEARDUP_SKIP_IMAGES = os.environ.get('SPLITTER_NEARDUP_SKIP_IMAGES', '1') == '1'
+NEARDUP_MAX_PAGES = int(os.environ.get('SPLITTER_NEARDUP_MAX_PAGES', '200'))
+NEARDUP_DB_PATH = os.environ.get('SPLITTER_NEARDUP_DB', '/tmp/gestalt_neardup.db')
+NEARDUP_BUCKET = os.environ.get('SPLITTER_NEARDUP_BUCKET')
+NEARDUP_KEY = os.environ.get('SPLITTER_NEARDUP_KEY', f"{STATE_PREFIX}neardup.db")
+NEARDUP_SYNC_SECONDS = int(os.environ.get('SPLITTER_NEARDUP_SYNC_SECONDS', '300'))
+
+neardup_index = NearDupIndex(process_local_path(NEARDUP_DB_PATH), NEARDUP_THRESHOLD) if NEARDUP_ENABLED else None
+neardup_sync = None
+if neardup_index is not None and NEARDUP_BUCKET:
+    neardup_sync = NearDupSync(neardup_index, s3, NEARDUP_BUCKET, NEARDUP_KEY, NEARDUP_SYNC_SECONDS)
+
+# Full-text search. Every page's text goes into a local SQLite FTS5 shard at SEARCH_DB_PATH.
+# With SEARCH_INDEX_BUCKET set, new pages are published there as deltas at most every
+# SEARCH_PUBLISH_SECONDS (and whenever the worker goes idle), and merged into the single
+# index at {SEARCH_INDEX_PREFIX}index.db once it is SEARCH_MERGE_SECONDS old; see search_index.py.
+# Without a bucket nothing ever prunes the local shard, so indexing is off unless one is set
+# (or SPLITTER_SEARCH_INDEX=1 asks for a local-only index, e.g. for a one-off run).
+SEARCH_INDEX_BUCKET = os.environ.get('SPLITTER_SEARCH_INDEX_BUCKET')
+SEARCH_INDEX_ENABLED = os.environ.get('SPLITTER_SEARCH_INDEX', '1' if SEARCH_INDEX_BUCKET else '0') == '1'
+SEARCH_DB_PATH = os.environ.get('SPLITTER_SEARCH_DB', '/tmp/gestalt_search.db')
+SEARCH_INDEX_PREFIX = os.environ.get('SPLITTER_SEARCH_INDEX_PREFIX', f"{STATE_PREFIX}search/")
+SEARCH_PUBLISH_SECONDS = int(os.environ.get('SPLITTER_SEARCH_PUBLISH_SECONDS', '300'))
+SEARCH_MERGE_SECONDS = int(os.environ.get('SPLITTER_SEARCH_MERGE_SECONDS', '900'))
+
+search_index = SearchIndex(process_local_path(SEARCH_DB_PATH)) if SEARCH_INDEX_ENABLED else None
+search_publisher = None
+if search_index is not None and SEARCH_INDEX_BUCKET:
+    search_publisher = SearchIndexPublisher(
+        search_index, s3, SEARCH_INDEX_BUCKET, SEARCH_INDEX_PREFIX, SEARCH_PUBLISH_SECONDS, SEARCH_MERGE_SECONDS
+    )
+
+# Running image decode timings across documents, used to estimate the time classification saves
+decode_timing = {"seconds": 0.0, "images": 0}
+decode_timing_lock = threading.Lock()
+
+def handle_page(result, stats, artifact=None, search=None, image_batch=None):
+    """Hands the extracted text and images of one page to the downstream steps."""
+    page_num = result["page_num"]
+
+    if result["class"]:
+        stats["page_classes"][result["class"]] += 1
+    stats["images_skipped"] += result["images_skipped"]
+    if result["decoded"]:
+        with decode_timing_lock:
+            decode_timing["seconds"] += result["decode_seconds"]
+            decode_timing["images"] += result["decoded"]
 
-        if 'Messages' in response:
-            for message in response['Messages']:
-                receipt_handle = message['ReceiptHandle']
-                body = json.loads(message['Body'])
-                
-                bucket = body['bucket']
-                key = body['key']
-                
-                local_file_path = f"/tmp/{key.replace('/', '_')}"
-                
-                try:
-                    print(f"\nDownloading '{key}' from '{bucket}'...")
-                    s3.download_file(bucket, key, local_file_path)
-                    
-                    # Process the file
-                    process_pdf(local_file_path)
-                    
-                    # Clean up the local file to prevent disk exhaustion
-                    os.remove(local_file_path)
-                    
-                    # Delete the message from the queue so it isn't processed again
-                    print(f"Processing complete. Deleting message from SQS.")
-                    sqs.delete_message(
-                        QueueUrl=QUEUE_URL,
-                        ReceiptHandle=receipt_handle
-                    )
-                    
-                except Exception as e:
-                    print(f"Error processing {key}: {str(e)}")
-                    # If we don't delete the message, SQS's visibility timeout will 
-                    # expire and the message will automatically pop back onto the queue for a retry.
+    # 1. Native Text
+    text = result["text"]
+    if text.strip():
+        print(f"  - Page {page_num}: Found {len(text)} characters of native text.")
+        if search is not None:
+            search.add_page(result)
+
+    # 2. Images (Scans or Photos). Pages classified as native text arrive without any.
+    images = result["images"]
+    if images:
+        print(f"  - Page {page_num}: Found {len(images)} embedded images.")
+        for image in images:
+            image["key"] = image_pipeline.output_key(image) if image["format"] else None
+            if image["repeat"]:
+                stats["images_repeated"] += 1
+                continue
+
+            # Drop the bytes of images we already handed downstream, from this or an earlier document
+            if image_cache.check(image["sha256"]):
+                image["image"] = image["output"] = None
+                stats["images_duplicate"] += 1
+                print(f"    * Skipped duplicate image {image['index']} ({image['sha256'][:12]})")
+                continue
+
+            # Claimed for this document until download_and_process commits or releases it
+            stats["images_claimed"].append(image["sha256"])
+            stats["images_extracted"] += 1
+            size = image["output"]["bytes_in"] if image.get("output") else len(image["image"])
+            print(f"    * Extracted image {image['index']} (Type: {image['ext']}, Size: {size} bytes)")
+            # Blocks while the pipeline's in-flight byte budget is spent
+            if image_batch is not None:
+                image_batch.add_image(image)
+
+    # 3. Page block for the document's extraction artifact
+    if artifact is not None:
+        artifact.add_page(result)
+
+def process_pdf(source, page_start=None, page_end=None, stats=None, artifact=None, search=None, image_batch=None,
+                skip_images=False):
+    """Opens the PDF and separates native text from embedded images.
+
+    source is a local path or the PDF bytes. page_start/page_end (end exclusive) restrict
+    the work to one shard of a fanned-out document. If a stats dict is passed, the time
+    the first page was handled and the image counts are recorded in it. Every page is
+    also added to the ArtifactWriter and the search index's DocumentIndexer, if passed, and
+    every newly extracted image is submitted to the image_batch, if passed; waiting for the
+    batch is left to the caller. With skip_images, no page's images are extracted at all.
+    """
+    stats = {} if stats is None else stats
+    for counter in ("images_extracted", "images_repeated", "images_duplicate", "images_skipped"):
+        stats.setdefault(counter, 0)
+    stats.setdefault("page_classes", {"text": 0, "scanned": 0, "mixed": 0})
+    stats.setdefault("images_claimed", [])
+
+    if isinstance(source, bytes):
+        print(f"Opening in-memory PDF ({len(source)} bytes) with PyMuPDF...")
+    else:
+        print(f"Opening {source} with PyMuPDF...")
+
+    doc = open_pdf(source)
+    try:
+        page_start = page_start or 0
+        page_end = len(doc) if page_end is None else min(page_end, len(doc))
+        page_count = page_end - page_start
+
+        if PAGE_WORKERS > 1 and page_count >= PARALLEL_PAGE_THRESHOLD:
+            print(f"  - {page_count} pages: extracting on {PAGE_WORKERS} processes...")
+            pages = iter_pages_parallel(source, page_start, page_end, PAGE_WORKERS, PAGE_CHUNK_SIZE, image_normalize,
+                                        skip_images)
         else:
-            # No messages, loop continues
-            pass
-
-if __name__ == "__main__":
-    if not QUEUE_URL:
-        print("ERROR: SPLITTER_QUEUE_URL environment variable is not set.")
-        exit(1)
-        
-    poll_queue()
\ No newline at end of file
+            xref_memo = {}
+            pages = (extract_page(doc, page_num, xref_memo, image_normalize, skip_images)
+                     for page_num in range(page_start, page_end))
+
+        for result in pages:
+            if "first_page_at" not in stats:
+                stats["first_page_at"] = time.monotonic()
+            handle_page(result, stats, artifact, search, image_batch)
+        if search is not None:
+            search.flush()
+    finally:
+        doc.close()
+
+    print(f"  - Images: {stats['images_extracted']} extracted, {stats['images_repeated']} repeated xrefs "
+          f"and {stats['images_duplicate']} duplicates skipped.")
+
+    if CLASSIFY_PAGES:
+        with decode_timing_lock:
+            per_image = decode_timing["seconds"] / decode_timing["images"] if decode_timing["images"] else 0.0
+        stats["classify_seconds_saved"] = per_image * stats["images_skipped"]
+        classes = stats["page_classes"]
+        print(f"  - Pages: {classes['text']} native text, {classes['scanned']} scanned, {classes['mixed']} mixed; "
+              f"{stats['images_skipped']} images not decoded (~{stats['classify_seconds_saved']:.2f}s saved).")
+
+def plan_shards(source, size):
+    """Returns the (page_start, page_end) ranges to fan a document out into, or [] to process it inline."""
+    with open_pdf(source) as doc:
+        page_count = len(doc)
+
+    too_many_pages = FANOUT_PAGE_THRESHOLD and page_count > FANOUT_PAGE_THRESHOLD
+    too_large = FANOUT_SIZE_THRESHOLD and size > FANOUT_SIZE_THRESHOLD
+    if not (too_many_pages or too_large):
+        return []
+
+    shard_pages = FANOUT_SHARD_PAGES
+    if too_large:
+        # A few huge scanned pages can blow the size limit on their own, so cut
+        # the document into at least as many shards as it is multiples over it
+        size_shards = -(-size // FANOUT_SIZE_THRESHOLD)
+        shard_pages = min(shard_pages, max(1, -(-page_count // size_shards)))
+
+    shards = [(start, min(start + shard_pages, page_count)) for start in range(0, page_count, shard_pages)]
+    return shards if len(shards) > 1 else []
+
+def find_near_duplicate(source, bucket, key, correlation_id=None):
+    """Looks the document up in the near-dup index (and adds it). Returns the best match or None.
+
+    Reading the text layer of NEARDUP_MAX_PAGES pages costs far less than extracting the
+    images of a whole document, which is what a match lets the caller skip.
+    """
+    with open_pdf(source) as doc:
+        text = "\n".join(doc[page_num].get_text() for page_num in range(min(len(doc), NEARDUP_MAX_PAGES)))
+
+    match = neardup_index.check(bucket, key, text)
+    if match:
+        print(f"'{key}' is a near duplicate of '{match['key']}' ({match['similarity']:.0%} similar).")
+        metrics.put_metric("NearDuplicateDocuments", 1, correlation_id=correlation_id, key=key,
+                           match=match['key'], similarity=round(match['similarity'], 3))
+    return match
+
+def shard_prefix(key):
+    return f"{STATE_PREFIX}shards/{key}/"
+
+def enqueue_shards(bucket, key, shards, trace=None):
+    """Records the shard plan for a document and queues one work item per page range.
+
+    Each shard message carries the parent's trace, so its timings join the same correlation ID.
+    """
+    s3.put_object(
+        Bucket=bucket,
+        Key=shard_prefix(key) + "manifest.json",
+        Body=json.dumps({"bucket": bucket, "key": key, "shards": shards, "created": time.time()})
+    )
+
+    messages = [
+        dict(trace or {}, bucket=bucket, key=key, page_start=page_start, page_end=page_end, routed_at=time.time())
+        for page_start, page_end in shards
+    ]
+    for batch_index, batch in enumerate(chunked(messages, 10)):
+        entries = [{'Id': str(i), 'MessageBody': json.dumps(body)} for i, body in enumerate(batch)]
+        response = sqs.send_message_batch(QueueUrl=QUEUE_URL, Entries=entries)
+        if response.get('Failed'):
+            # Raising keeps the parent message on the queue; shards that did go out
+            # are harmless to repeat because their completion records are idempotent.
+            raise Exception(f"Failed to queue {len(response['Failed'])} shard(s) of batch {batch_index}")
+
+    print(f"Fanned '{key}' out into {len(shards)} shards.")
+
+def record_shard_complete(bucket, key, page_start, page_end):
+    """Marks one shard as done and writes complete.json once every shard of the document is.
+
+    Returns True if this was the last shard.
+    """
+    prefix = shard_prefix(key)
+    s3.put_object(Bucket=bucket, Key=f"{prefix}{page_start:06d}-{page_end:06d}.done", Body=b"")
+
+    manifest = json.loads(s3.get_object(Bucket=bucket, Key=prefix + "manifest.json")['Body'].read())
+    done = 0
+    for listing in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        done += sum(1 for obj in listing.get('Contents', []) if obj['Key'].endswith('.done'))
+
+    print(f"Shard {page_start}-{page_end} of '{key}' done ({done}/{len(manifest['shards'])}).")
+    if done >= len(manifest['shards']):
+        s3.put_object(
+            Bucket=bucket,
+            Key=prefix + "complete.json",
+            Body=json.dumps({"bucket": bucket, "key": key, "shards": len(manifest['shards']), "completed": time.time()})
+        )
+        print(f"All shards of '{key}' are done.")
+        return True
+    return False
+
+def fetch_pdf(bucket, key, stats):
+    """Fetches a PDF from S3 as bytes, or as a local path when it has to go to disk.
+
+    Returns (source, local_file_path); local_file_path is None when nothing was written to disk.
+    """
+    # Unique per call: shards of one document (or redelivered messages) can run side by side
+    local_file_path = f"/tmp/{uuid.uuid4().hex}_{key.replace('/', '_')}"
+
+    if IO_MODE != 'stream':
+        s3.download_file(bucket, key, local_file_path)
+        size = os.path.getsize(local_file_path)
+        stats["bytes_downloaded"] = stats["bytes_spilled"] = size
+        return local_file_path, local_file_path
+
+    response = s3.get_object(Bucket=bucket, Key=key)
+    body = response['Body']
+
+    if response['ContentLength'] <= STREAM_MAX_BYTES:
+        data = body.read()
+        stats["bytes_downloaded"] = len(data)
+        return data, None
+
+    # Too big to hold in memory: spill to disk as the body streams in
+    print(f"  - {response['ContentLength']} bytes is over the in-memory limit, spilling to disk...")
+    try:
+        with open(local_file_path, 'wb') as f:
+            for chunk in body.iter_chunks(STREAM_CHUNK_SIZE):
+                f.write(chunk)
+                stats["bytes_downloaded"] += len(chunk)
+                stats["bytes_spilled"] += len(chunk)
+    except Exception:
+        if os.path.exists(local_file_path):
+            os.remove(local_file_path)
+        raise
+    return local_file_path, local_file_path
+
+def artifact_key(key, page_start=None, page_end=None):
+    if page_start is None:
+        return f"{ARTIFACT_PREFIX}{key}.gsta"
+    return f"{ARTIFACT_PREFIX}{key}.{page_start:06d}-{page_end:06d}.gsta"
+
+# Written by the scraper's S3StreamUploader next to every multipart upload
+SHA256_SIDECAR_SUFFIX = ".sha256"
+
+def recorded_content_hash(bucket, key):
+    """The SHA-256 the scraper recorded for an object, read without downloading it, or None."""
+    head = s3.head_object(Bucket=bucket, Key=key)
+    if head.get('Metadata', {}).get('sha256'):
+        return f"sha256:{head['Metadata']['sha256']}"
+
+    try:
+        digest = s3.get_object(Bucket=bucket, Key=key + SHA256_SIDECAR_SUFFIX)['Body'].read().decode('ascii').strip()
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+            return None
+        raise
+    return f"sha256:{digest}"
+
+def local_content_hash(source):
+    """The SHA-256 of a downloaded document, in memory or on disk."""
+    if isinstance(source, bytes):
+        return f"sha256:{hashlib.sha256(source).hexdigest()}"
+
+    digest = hashlib.sha256()
+    with open(source, 'rb') as f:
+        for chunk in iter(lambda: f.read(STREAM_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return f"sha256:{digest.hexdigest()}"
+
+def is_duplicate(digest, bucket, key, correlation_id=None):
+    """Claims a document's content hash; True if another key already holds it.
+
+    Raises ClaimPending while another key's copy is still being processed, so the message is
+    retried once that copy has either made it or failed.
+    """
+    canonical = dedup_index.claim(digest, bucket, key)
+    if canonical:
+        print(f"\n'{key}' has the same content as '{canonical['key']}'. Recorded as an alias, skipping.")
+        metrics.put_metric("DuplicateDocuments", 1, correlation_id=correlation_id, key=key)
+    return bool(canonical)
+
+def download_and_process(bucket, key, page_start=None, page_end=None, trace=None):
+    """Downloads a single PDF from S3, processes it and cleans up any local copy.
+
+    trace holds the correlation_id / discovered_at the document picked up in the scraper, if any.
+    """
+    trace = trace or {}
+    correlation_id = trace.get("correlation_id")
+
+    # Shards were already checked when their parent document came through
+    check_dedup = dedup_index is not None and page_start is None
+    digest = recorded_content_hash(bucket, key) if check_dedup else None
+    if digest and is_duplicate(digest, bucket, key, correlation_id):
+        return
+    # The hash this key now holds, pending until the document is done with
+    claimed = digest
+
+    stats = {"bytes_downloaded": 0, "bytes_spilled": 0, "images_claimed": []}
+    started = time.monotonic()
+    local_file_path = cached_path = None
+
+    try:
+        print(f"\nDownloading '{key}' from '{bucket}'...")
+        with metrics.timer("DownloadTime", correlation_id, key=key):
+            if page_start is not None and source_cache is not None:
+                source = cached_path = source_cache.fetch(s3, bucket, key, stats)
+            else:
+                source, local_file_path = fetch_pdf(bucket, key, stats)
+
+        # Nothing recorded a hash for this object, so hash what was downloaded
+        if check_dedup and digest is None:
+            digest = local_content_hash(source)
+            if is_duplicate(digest, bucket, key, correlation_id):
+                return
+            claimed = digest
+
+        # Oversized documents are spread across the worker fleet instead of processed here
+        if page_start is None:
+            shards = plan_shards(source, stats["bytes_downloaded"])
+            if shards:
+                enqueue_shards(bucket, key, shards, trace)
+                if claimed:
+                    # Each shard is retried on its own from here
+                    dedup_index.commit(claimed, bucket, key)
+                    claimed = None
+                metrics.put_metric("DocumentsFannedOut", 1, correlation_id=correlation_id, key=key, shards=len(shards))
+                return
+
+        near_duplicate = None
+        if neardup_index is not None and page_start is None:
+            with metrics.timer("NearDupCheckTime", correlation_id, key=key):
+                near_duplicate = find_near_duplicate(source, bucket, key, correlation_id)
+        # A near duplicate's text is still extracted and indexed; its images are the costly part
+        skip_images = bool(near_duplicate) and NEARDUP_SKIP_IMAGES
+        if skip_images:
+            print(f"Skipping the images of '{key}'; its near duplicate already has them.")
+
+        # Process the file
+        artifact = ArtifactWriter(bucket, key, page_start, page_end) if ARTIFACTS_ENABLED else None
+        if artifact is not None:
+            artifact.near_duplicate_of = near_duplicate
+        search = search_index.document(key) if search_index is not None else None
+        image_batch = None
+        if image_pipeline is not None and not skip_images:
+            image_batch = image_pipeline.batch(IMAGE_OUTPUT_BUCKET or bucket)
+        with metrics.timer("ExtractionTime", correlation_id, key=key, page_start=page_start, page_end=page_end):
+            process_pdf(source, page_start, page_end, stats, artifact, search, image_batch, skip_images)
+        metrics.put_metric("ImagesExtracted", stats["images_extracted"], correlation_id=correlation_id, key=key)
+
+        delivered = stats["images_claimed"]
+        if image_batch is not None:
+            with metrics.timer("ImageNormalizeWaitTime", correlation_id, key=key):
+                images = image_batch.wait()
+            delivered = images["delivered"]
+            print(f"Normalized {images['images']} images: {images['bytes_in']} bytes in, {images['bytes_out']} bytes "
+                  f"out plus {images['thumbnail_bytes']} bytes of thumbnails, {images['failed']} kept as embedded.")
+            metrics.put_metric("ImageBytesIn", images["bytes_in"], "Bytes", correlation_id, key=key)
+            metrics.put_metric("ImageBytesOut", images["bytes_out"], "Bytes", correlation_id, key=key)
+            if images["failed"]:
+                metrics.put_metric("ImageNormalizeFailures", images["failed"], correlation_id=correlation_id, key=key)
+        if search is not None:
+            metrics.put_metric("PagesIndexed", search.pages_indexed, correlation_id=correlation_id, key=key)
+
+        if artifact is not None:
+            destination = artifact_key(key, page_start, page_end)
+            with metrics.timer("ArtifactUploadTime", correlation_id, key=key):
+                size = artifact.upload(s3, ARTIFACT_BUCKET or bucket, destination, ARTIFACT_TRANSFER_CONFIG)
+            print(f"Wrote {size} byte extraction artifact to '{destination}'.")
+
+        # Only now do this document's images, and its content hash, count as handed downstream
+        for image_digest in delivered:
+            image_cache.commit(image_digest)
+        if claimed:
+            dedup_index.commit(claimed, bucket, key)
+            claimed = None
+
+        # From the scraper finding the link to this document (or shard) being extracted
+        metrics.put_latency("EndToEndLatency", trace.get("discovered_at"), correlation_id, key=key,
+                            page_start=page_start, page_end=page_end)
+
+        if page_start is not None and record_shard_complete(bucket, key, page_start, page_end) and cached_path:
+            source_cache.discard(cached_path)
+    finally:
+        # Images that never made it out are fair game for the next attempt, and so is the
+        # document: a copy of it is no longer skipped in favour of this failed one
+        for image_digest in stats["images_claimed"]:
+            image_cache.release(image_digest)
+        if claimed:
+            dedup_index.release(claimed, bucket, key)
+
+        # Clean up the local file to prevent disk exhaustion
+        if local_file_path and os.path.exists(local_file_path):
+            os.remove(local_file_path)
+
+        first_page = f"{stats['first_page_at'] - started:.2f}s" if "first_page_at" in stats else "n/a"
+        print(f"I/O for '{key}': {stats['bytes_downloaded']} bytes downloaded, "
+              f"{stats['bytes_spilled']} bytes spilled to disk, time to first page {first_page}.")
+
+def handle_message(message):
+    """Processes one SQS message. Returns True if the message can be deleted."""
+    try:
+        body = json.loads(message['Body'])
+        key = body['key']
+        bucket = body['bucket']
+    except (ValueError, TypeError, KeyError) as e:
+        # A failure like any other: the message stays on the queue for SQS to redeliver
+        print(f"Malformed message {message.get('MessageId')}: {str(e)}")
+        metrics.put_metric("MalformedMessages", 1, message_id=message.get('MessageId'))
+        return False
+
+    if key.startswith(STATE_PREFIX):
+        # Our own bookkeeping objects land in the same bucket; nothing to split
+        return True
+
+    trace = {name: body.get(name) for name in ("correlation_id", "discovered_at")}
+    metrics.put_latency("QueueWaitTime", body.get('routed_at'), trace["correlation_id"], key=key)
+
+    try:
+        download_and_process(bucket, key, body.get('page_start'), body.get('page_end'), trace)
+        if search_publisher is not None:
+            search_publisher.publish()
+        if neardup_sync is not None:
+            neardup_sync.sync()
+        return True
+    except ClaimPending as e:
+        # Not a failure: a copy is in flight elsewhere, and this one is settled on a retry
+        print(f"Holding '{key}' back: {str(e)}")
+        metrics.put_metric("DuplicatesPending", 1, correlation_id=trace["correlation_id"], key=key)
+        return False
+    except Exception as e:
+        print(f"Error processing {key}: {str(e)}")
+        metrics.put_metric("ProcessingFailures", 1, correlation_id=trace["correlation_id"], key=key, error=str(e))
+        # If we don't delete the message, SQS's visibility timeout will
+        # expire and the message will automatically pop back onto the queue for a retry.
+        return False
+
+def publish_indexes():
+    """Pushes local search index and near-dup index changes to S3 now, if they're shared at all."""
+    if search_publisher is not None:
+        search_publisher.publish(force=True)
+    if neardup_sync is not None:
+        neardup_sync.sync(force=True)
+
+def lambda_handler(event, context):
+    """Fast-tier entry point: the router sends small PDFs to a queue this Lambda consumes.
+
+    Records are processed one after another with the same handle_message as the Fargate
+    consumers. Only the failures are reported back, so SQS retries just those. SPLITTER_QUEUE_URL
+    still points at the Fargate queue, so a small file with too many pages fans out there.
+    """
+    # The first call pulls in the shared near-dup index
+    if neardup_sync is not None:
+        neardup_sync.sync()
+
+    failures = []
+    for record in event.get('Records', []):
+        message = {'MessageId': record['messageId'], 'Body': record['body']}
+        if not handle_message(message):
+            failures.append({'itemIdentifier': record['messageId']})
+
+    # /tmp outlives an invocation only as long as the execution environment does. The
+    # near-dup sync keeps to its interval here; see NearDupSync for what one costs.
+    if search_publisher is not None:
+        search_publisher.publish(force=True)
+    if neardup_sync is not None:
+        neardup_sync.sync()
+
+    print(f"Processed {len(event.get('Records', []))} message(s), {len(failures)} failed.")
+    return {'batchItemFailures': failures}